@@ -11,6 +11,83 @@ PORT=8080
 
 # required parameters for AES encryption
 KEY='a1b4c6d1efgh5678'# key shared between server and client only
-INTERRUPT = u'\u0001' # Interrupt to detect padding start
-PAD = u'\u0000'       # Padding (zero)
-FIXED_BLOCK_SIZE = 16 # Must be 16 for Python AES.
+CRYPTO_MODE = 'CTR'   # Cipher the client asks for: 'CTR' (fastest), 'GCM' (authenticated) or 'CFB'
+CRYPTO_MODES = ('CTR', 'GCM', 'CFB') # Ciphers the server accepts
+CODEC = 'bin1' # Message codec clients prefer: 'bin1' (binary) or 'json'
+
+# parameters for message framing
+RECV_BUFFER_SIZE = 4096 # Initial size of each connection's reassembly buffer, it grows for larger frames and shrinks back after them
+MAX_FRAME_SIZE = 16777216 # Largest frame accepted from a peer (16 MB)
+
+# parameters for outbound queues
+MAX_OUTPUT_BUFFER = 1048576 # Most bytes queued for one client before it counts as a slow consumer (1 MB)
+OUTPUT_LOW_WATER = 262144 # Senders paused by a slow client resume once its queue drains below this
+SLOW_CONSUMER_POLICY = 'DISCONNECT' # 'DROP' the frame, 'DISCONNECT' the client or 'PAUSE' the sending client (disconnects when there is none)
+TCP_NODELAY = True # Frames are batched per event loop cycle, so client sockets skip Nagle's delay
+CRYPTO_WORKERS = 0 # Threads encrypting and decrypting large messages next to the event loop (0 = all crypto in the event loop)
+CRYPTO_OFFLOAD_SIZE = 16384 # Bytes of messages for one client below which they are encrypted or decrypted in the event loop
+
+# parameters for file transfers
+FILE_CHUNK_SIZE = 65536 # Bytes read from the file and sent per data frame (multiple of 16)
+FILE_SEND_BATCH = 16 # Chunks the client reads and encrypts before writing them with one system call
+TRANSFER_RATE_LIMIT = 8388608 # Bytes per second one file transfer may relay through the server (0 = unlimited)
+TRANSFER_BURST = 1048576 # Bytes a transfer may send at once before the rate limit applies
+FILE_READY_TIMEOUT = 10 # Seconds to wait for receivers to say which chunks they are missing
+
+# parameters for the multi-process server
+WORKERS = 0 # Worker processes started by cluster.py, each accepting on PORT (0 = one per CPU core)
+
+# parameters for linked servers
+SERVER_NAME = 'irc1' # Name this server is known by on its links, unique among linked servers
+LINK_PORT = 8081 # Port other servers link to (0 = do not accept links)
+LINKS = [] # 'host:port' of the servers to link to; link each pair of servers from one side only
+LINK_RETRY = 5 # Seconds between attempts to reconnect a lost link
+LINK_KEY = 'f3e8a1c9b7d2k4m6' # AES key shared by linked servers only, never given to clients (16, 24 or 32 characters)
+
+# parameters for room history
+HISTORY_SIZE = 256 # Recent messages of each room kept in memory
+HISTORY_DIR = 'history' # Directory the room histories are logged to ('' keeps history in memory only)
+HISTORY_SEGMENT_SIZE = 4194304 # Bytes written to a history log segment before a new one is started (4 MB)
+HISTORY_ON_JOIN = 20 # Latest messages sent to a client joining a room (0 = none)
+HISTORY_PAGE = 50 # Most messages returned by one RH command
+
+# parameters for message search
+SEARCH_DIR = '' # Directory of the message search index, private messages included ('' turns searching off)
+SEARCH_TAIL_SIZE = 4096 # Messages indexed in memory before they are written out as a segment
+SEARCH_MAX_SEGMENTS = 32 # Segments searched before new messages wait for the merge in progress
+SEARCH_PAGE = 20 # Most results returned by one SR command
+SEARCH_SCAN = 1000 # Most messages one SR command reads, the client continues from the last one with before:ID
+
+# parameters for compression
+COMPRESSION = 'zlib' # Compression offered in the hello, applied before encryption ('' = never compress)
+COMPRESS_LEVEL = 1 # zlib level, 1 (fastest) to 9 (smallest)
+COMPRESS_THRESHOLD = 256 # Messages shorter than this many bytes are sent uncompressed
+COMPRESSED_TYPES = ('.gz', '.tgz', '.bz2', '.xz', '.zst', '.zip', '.7z', '.rar', '.jpg', '.jpeg', '.png', '.gif', '.webp', '.mp3', '.mp4', '.mkv', '.avi', '.mov', '.pdf', '.docx', '.xlsx', '.pptx') # Files sent without compressing them
+
+# parameters for server statistics
+STATS_INTERVAL = 60 # Seconds between statistics logged by the server (0 = never)
+
+# parameters for server logging
+LOG_LEVEL = 'INFO' # Least severe records written: 'DEBUG' (adds every frame and command), 'INFO', 'WARNING' or 'ERROR'
+LOG_FILE = '' # File the server log is appended to ('' = standard output)
+LOG_SAMPLE = {'frame_received': 100, 'command_received': 100} # Events written only once every N times they happen
+LOG_QUEUE_SIZE = 65536 # Records waiting for the writer thread before new ones are dropped
+
+# parameters for metrics
+METRICS_HOST = '127.0.0.1' # Address of the metrics endpoint, local only by default
+METRICS_PORT = 0 # Port serving the metrics in the Prometheus text format (0 = no endpoint; cluster workers use consecutive ports)
+ADMINS = [] # Names allowed to use the ST command (empty = everyone)
+
+# parameters for keepalive
+TIMER_TICK = 0.01 # Seconds per tick of the server's timer wheel, timers fire up to one tick late
+HELLO_TIMEOUT = 10 # Seconds a new connection has to send its hello (0 = no limit)
+PING_INTERVAL = 30 # Seconds a client may stay silent before the server pings it (0 = never ping)
+PONG_TIMEOUT = 15 # Seconds a pinged client has to answer before it is disconnected
+IDLE_TIMEOUT = 0 # Seconds a client may go without sending a command before it is disconnected (0 = no limit)
+
+# parameters for rate limiting
+CLIENT_RATE_LIMIT = 50 # Commands per second one client may send (0 = unlimited)
+CLIENT_BURST = 100 # Commands a client may send at once before its rate limit applies
+COMMAND_RATE_LIMITS = {'chat': (20, 50), 'list': (5, 20), 'file': (1, 5), 'other': (5, 20)} # Commands per second and burst of each class of ratelimit.COMMAND_CLASSES, per client
+ROOM_FANOUT_LIMIT = 20000 # Messages per second delivered to the members of one room, a message to n members counts n times (0 = unlimited)
+ROOM_FANOUT_BURST = 50000 # Messages a room may deliver at once before its limit applies, larger rooms wait for a full bucket
@@ -0,0 +1,246 @@
+#####################################################################
+#                    Haritha Munagala, Susham Yerabolu              #
+#                    CS 594 Internetworking Protocols               #
+#                             Spring 2018                           #
+#                           Async IRC Server                        #
+#####################################################################
+
+#--------------------------------------------------------------------#
+# Python Imports
+import asyncio
+import signal
+import socket
+import threading
+import CONSTANTS
+import framing
+import metrics
+from server import IRCServer, IRCConnection
+from logger import log
+
+# uvloop is optional, the standard event loop is used without it
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+#--------------------------------------------------------------------#
+
+#--------------------------------------------------------------------#
+# Async IRC Connection
+# Connection state of one client served by asyncio. The StreamWriter
+# stands in for the socket, so the command handling shared with
+# IRCServer keys everything by it.
+#--------------------------------------------------------------------#
+class AsyncIRCConnection(IRCConnection):
+    def __init__(self, reader, writer):
+        IRCConnection.__init__(self, writer)
+        self.reader = reader #StreamReader the client's frames are read from
+        self.readable = asyncio.Event() #Cleared while the client is paused or throttled
+        self.readable.set()
+        self.blocked = asyncio.Event() #Set when senders wait for this client's queue to drain
+#--------------------------------------------------------------------#
+
+#--------------------------------------------------------------------#
+# Async IRC Server
+# Runs the IRCServer command set on asyncio. Every connection gets a
+# reader coroutine that reads and handles frames and a writer coroutine
+# that waits for the transport to drain and resumes the senders paused
+# on it. Frames sent during one loop iteration are handed to the
+# transport together at its end, and the transport's buffer takes the
+# place of the selector server's outBuffer.
+#--------------------------------------------------------------------#
+class AsyncIRCServer(IRCServer):
+    def __init__(self, host, port):
+        IRCServer.__init__(self, host, port)
+        self.loop = None
+        self.stopping = None # Event set by stop() to shut the server down
+
+    # Pauses or resumes the client's reader coroutine
+    def updateEvents(self, connection):
+        if connection.paused or connection.throttled:
+            connection.readable.clear()
+        else:
+            connection.readable.set()
+
+    # Runs callback(argument) from the event loop after delay seconds, returns a handle that can be cancelled
+    def callLater(self, delay, callback, argument):
+        return self.loop.call_later(delay, callback, argument)
+
+    # Queues a frame over the transport's limit, the writer coroutine watches the transport drain
+    def queueFrame(self, connection, frame):
+        self.queuePending(connection, frame)
+
+    # Holds a frame until the flush that runs once the frames of this loop iteration are handled
+    def queuePending(self, connection, frame):
+        if not self.dirty:
+            self.loop.call_soon(self.flushPending)
+        IRCServer.queuePending(self, connection, frame)
+
+    # Hands each client's pending frames to its transport at once and lets the writer coroutine watch it drain
+    def flushPending(self):
+        dirty = self.dirty
+        self.dirty = []
+        for connection in dirty:
+            frames = connection.pending
+            connection.pending = []
+            connection.pendingBytes = 0
+            s = connection.socket
+            if s in self.connections and s not in self.closing and not s.is_closing():
+                s.writelines(frames)
+                connection.blocked.set()
+        self.metrics.writes += len(dirty)
+
+    # Sends an already framed message, applying the slow consumer policy once the
+    # transport holds more than MAX_OUTPUT_BUFFER bytes the client has not read.
+    # Frames of this iteration do not count, the transport usually takes them at once
+    def sendFrame(self, s, frame, bulk=False):
+        connection = self.connections.get(s)
+        if connection is None or s in self.closing or s.is_closing():
+            return
+        self.metrics.framesOut += 1
+        self.metrics.bytesOut += len(frame)
+        if s.transport.get_write_buffer_size() + len(frame) > CONSTANTS.MAX_OUTPUT_BUFFER:
+            self.slowConsumer(connection, frame, "PAUSE" if bulk else CONSTANTS.SLOW_CONSUMER_POLICY)
+            return
+        self.queuePending(connection, frame)
+
+    # Bytes the client's transport holds that the client has not read yet
+    def outputQueued(self, connection):
+        return connection.socket.transport.get_write_buffer_size() + connection.pendingBytes
+
+    # Answers one scrape of the metrics endpoint
+    async def serveMetrics(self, reader, writer):
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+        writer.write(metrics.http_response(request, self.renderMetrics))
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    # Registers a new client and runs its reader and writer coroutines until it disconnects
+    async def serveClient(self, reader, writer):
+        connection = AsyncIRCConnection(reader, writer)
+        # drain() waits until the transport is back under the low water mark
+        writer.transport.set_write_buffer_limits(CONSTANTS.MAX_OUTPUT_BUFFER, CONSTANTS.OUTPUT_LOW_WATER)
+        self.lock.acquire()
+        self.clients[writer] = writer
+        self.connections[writer] = connection
+        self.lock.release()
+        self.watchConnection(connection)
+        writerTask = asyncio.ensure_future(self.writeClient(connection))
+        try:
+            await self.readClient(writer)
+        finally:
+            writerTask.cancel()
+            # A slow consumer has already been cleaned up by disconnectClosing
+            if writer in self.connections:
+                self.lock.acquire()
+                self.cleanup(writer)
+                self.lock.release()
+                writer.close()
+
+    # Reads and handles the client's frames until the connection closes
+    async def readClient(self, s):
+        connection = self.connections[s]
+        try:
+            while True:
+                await connection.readable.wait()
+                kind, length = framing.HEADER.unpack(await connection.reader.readexactly(framing.HEADER.size))
+                if length > CONSTANTS.MAX_FRAME_SIZE:
+                    raise ValueError("Frame of " + str(length) + " bytes exceeds MAX_FRAME_SIZE")
+                data = await connection.reader.readexactly(length)
+                self.metrics.bytesIn += framing.HEADER.size + length
+                self.metrics.framesIn += 1
+                plaintext = None
+                if self.cryptoPool is not None and kind == framing.MESSAGE and length >= self.cryptoPool.threshold and connection.session is not None:
+                    # Other clients are served while a worker decrypts, this client's next frame waits for it
+                    plaintext = await self.loop.run_in_executor(self.cryptoPool.executor, connection.session.decrypt, data)
+                    if s not in self.connections:
+                        return
+                self.currentSender = s
+                try:
+                    self.handleFrame(s, kind, data, plaintext)
+                finally:
+                    self.currentSender = None
+                # Drop clients that could not keep up while the frame was handled
+                self.disconnectClosing()
+                if s not in self.connections:
+                    return
+        except asyncio.IncompleteReadError:
+            # Handles the connection closed by client, a reaped client is already gone
+            if s in self.connections:
+                log.info("client_closed", client=self.clients[s])
+        except Exception as e:
+            log.warning("client_error", client=self.clients.get(s), error=e)
+
+    # Resumes the senders paused on this client once its transport has drained
+    async def writeClient(self, connection):
+        try:
+            while True:
+                await connection.blocked.wait()
+                await connection.socket.drain()
+                connection.blocked.clear()
+                for sender in connection.blockedSenders:
+                    self.resumeReading(sender)
+                connection.blockedSenders.clear()
+        except (ConnectionError, asyncio.CancelledError):
+            return
+
+    # Asks the server to shut down, safe to call from any thread
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.stopping.set)
+
+    # Accepts clients until stop() is called, then disconnects everyone
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        self.serverSocket = await asyncio.start_server(self.serveClient, self.host, self.port, reuse_address=True, backlog=socket.SOMAXCONN)
+        self.clients[self.serverSocket] = "SERVER"
+        self.nicknames["SERVER"] = self.serverSocket
+        if self.metricsPort:
+            try:
+                await asyncio.start_server(self.serveMetrics, CONSTANTS.METRICS_HOST, self.metricsPort, reuse_address=True)
+            except OSError as e:
+                log.error("metrics_unavailable", port=self.metricsPort, error=e)
+        if CONSTANTS.STATS_INTERVAL:
+            self.callLater(CONSTANTS.STATS_INTERVAL, self.reportStats, None)
+
+        # Signals can only be handled by the main thread
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                self.loop.add_signal_handler(signum, self.stopping.set)
+
+        await self.stopping.wait()
+        log.info("server_stopping")
+        self.serverSocket.close()
+        for s in list(self.connections):
+            s.close()
+        await self.serverSocket.wait_closed()
+        # Let the reader coroutines run their cleanup
+        await asyncio.sleep(0)
+
+    # The function that is executed once initialized is complete
+    def run(self):
+        if uvloop is not None:
+            with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+                runner.run(self.serve())
+        else:
+            asyncio.run(self.serve())
+#--------------------------------------------------------------------#
+
+#--------------------------------------------------------------------#
+# Main function
+# This function creates an AsyncIRCServer object and runs it in the
+# main thread so it can shut down cleanly on SIGINT and SIGTERM
+#--------------------------------------------------------------------#
+def main():
+    server = AsyncIRCServer(CONSTANTS.HOST, CONSTANTS.PORT)
+    server.run()
+
+if __name__ == "__main__":
+    main()
@@ -14,47 +14,113 @@ import select
 import CONSTANTS
 import json
 import os
-from Crypto.Cipher import AES
-from Crypto import Random
+import framing
+import cryptosession
+import filetransfer
+import codec
+import compression
 #--------------------------------------------------------------------#
 
 #--------------------------------------------------------------------#
-# Encryption Functions for Secure Messaging
+# Message Functions for Secure Messaging
 #--------------------------------------------------------------------#
-# Adds padding to keep data block size == FIXED_BLOCK_SIZE
-def add_padding(data, interrupt, pad, block_size):
-    new_data = ''.join([data, interrupt])
-    new_data_len = len(new_data)
-    remaining_len = block_size - new_data_len
-    to_pad_len = remaining_len % block_size
-    pad_string = pad * to_pad_len
-    return ''.join([new_data, pad_string])
-
-# Removes extra padding
-def strip_padding(data, interrupt, pad):
-    return data.rstrip(pad).rstrip(interrupt)
-
-# Pads, encodes, and then encrypt the data
-def encode_n_encrypt(data):
-    IV = Random.new().read(16) # randomly generated Initialization vector
-    padded_data = add_padding(data, CONSTANTS.INTERRUPT, CONSTANTS.PAD, CONSTANTS.FIXED_BLOCK_SIZE)
-    padded_data = padded_data.encode('UTF-8')
-    obj = AES.new(CONSTANTS.KEY, AES.MODE_CFB, IV)
-    ciphertext = obj.encrypt(padded_data)
-    return IV+ciphertext
-
-# Decrypts, decodes, and strips pads in data
-def decrypt_n_decode(data):
-    IV = data[:16] # Extracts the Initialization Vector of size 16
-    ciphertext = data[16:] # Extracts the ciphertext
-    obj = AES.new(CONSTANTS.KEY, AES.MODE_CFB, IV)
-    decrypted_padded_data = obj.decrypt(ciphertext)
-    decrypted_padded_data = decrypted_padded_data.decode('UTF-8')
-    decrypted_data = strip_padding(decrypted_padded_data, CONSTANTS.INTERRUPT, CONSTANTS.PAD)
-    # Reads from JSON
-    jsonData = json.loads(str(decrypted_data))
-    decrypted_data = jsonData["message"]
-    return decrypted_data
+# Decodes a message decrypted by the crypto session into its fields
+def decode_message(codecName, data):
+    return codec.decode(codecName, data)
+#-----------------------------------------------------------------------#
+
+#-----------------------------------------------------------------------#
+# Incoming File
+# Tracks one file being received from the server. Several can arrive at
+# the same time, told apart by the transfer id in each data frame.
+# Chunks are written at their offset into a ".part" file and every
+# verified chunk is appended to a ".idx" sidecar, so a transfer that was
+# cut off resumes with only the chunks that are still missing. The two
+# are named after the sender and the file's hash, so files of the same
+# name from different senders do not overwrite each other's chunks.
+#-----------------------------------------------------------------------#
+class IncomingFile():
+    def __init__(self, info, path, work):
+        self.name = os.path.basename(info["name"]) # Name of the file
+        self.size = info["size"] # Size of the file in bytes
+        self.hash = info["hash"] # SHA-256 of the whole file
+        self.chunkSize = info["chunk_size"] # Bytes per chunk, the last one may be shorter
+        self.nonce = info["nonce"] # Nonce of the file's end to end cipher
+        self.path = path # Where the finished file goes
+        self.work = work # Path of the ".part" and ".idx" files, without the extension
+        self.have = bytearray(filetransfer.chunk_count(self.size, self.chunkSize)) # 1 for every chunk on disk
+        header = json.dumps({"hash": self.hash, "size": self.size, "chunk_size": self.chunkSize}).encode('UTF-8') + b"\n"
+
+        # Pick up where an earlier transfer of the same file stopped
+        if self.loadIndex(header):
+            self.data = open(work + '.part', 'r+b')
+            self.index = open(work + '.idx', 'ab')
+        else:
+            self.data = open(work + '.part', 'wb')
+            self.data.truncate(self.size)
+            self.index = open(work + '.idx', 'wb')
+            self.index.write(header)
+            self.index.flush()
+        self.remaining = self.have.count(0) # Chunks still to be received
+
+    # Marks the chunks recorded by a sidecar index of the same file, returns False if there is none
+    def loadIndex(self, header):
+        try:
+            with open(self.work + '.idx', 'rb') as f:
+                if f.readline() != header or not os.path.isfile(self.work + '.part'):
+                    return False
+                records = f.read()
+        except IOError:
+            return False
+        # A record cut short by a crash is ignored; the chunk is simply sent again
+        for (seq,) in filetransfer.SEQUENCE.iter_unpack(records[:len(records) - len(records) % filetransfer.SEQUENCE.size]):
+            if seq < len(self.have):
+                self.have[seq] = 1
+        return True
+
+    # Ranges of chunk sequence numbers the sender still has to send
+    def missing(self):
+        return filetransfer.missing_ranges(self.have)
+
+    # Verifies, decrypts (and inflates, if the chunk was deflated) and stores one chunk,
+    # returns False if it arrived damaged
+    def write(self, seq, digest, data, deflated=False):
+        if seq >= len(self.have) or filetransfer.chunk_digest(data) != digest:
+            return False
+        if self.have[seq]:
+            return True
+        offset = seq * self.chunkSize
+        data = cryptosession.file_cipher(self.nonce, offset).decrypt(data)
+        if deflated:
+            try:
+                data = compression.decompress_chunk(data, self.chunkSize)
+            except ValueError:
+                return False
+        self.data.seek(offset)
+        self.data.write(data)
+        # Data goes to the file before the index claims it is there
+        self.data.flush()
+        self.index.write(filetransfer.SEQUENCE.pack(seq))
+        self.index.flush()
+        self.have[seq] = 1
+        self.remaining -= 1
+        return True
+
+    # Checks the whole file against its hash and moves it into place, returns False on a mismatch
+    def finish(self):
+        self.close()
+        if filetransfer.file_digest(self.work + '.part') != self.hash:
+            # Start over next time, the chunks on disk cannot be trusted
+            os.remove(self.work + '.idx')
+            return False
+        os.replace(self.work + '.part', self.path)
+        os.remove(self.work + '.idx')
+        return True
+
+    # Closes the files, keeping the sidecar so the transfer can be resumed
+    def close(self):
+        self.data.close()
+        self.index.close()
 #-----------------------------------------------------------------------#
 
 #-----------------------------------------------------------------------#
@@ -70,15 +136,53 @@ class IRCClient():
         self.server_connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_connection.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.server_connection.connect((CONSTANTS.HOST, CONSTANTS.PORT))
+        self.frameBuffer = framing.FrameBuffer() # Reassembles server messages split or merged by TCP
+        self.startSession()
+        self.outgoingFiles = {} # File waiting to be sent for each nonce announced, one per transfer
+        self.incomingFiles = {} # IncomingFile for each transfer id being received
         # Register the client with the provided name
         serverMsg = {}
         serverMsg["command"] = "NN"
         serverMsg["name"] = self.name
-        self.server_connection.send(encode_n_encrypt(json.dumps(serverMsg)))
+        self.sendServer(serverMsg)
         print("You are now connected to Server!")
         self.printCommands()
     
 
+    # Exchanges hellos with the server and sets up the connection's crypto session
+    def startSession(self):
+        self.session = cryptosession.CryptoSession(CONSTANTS.CRYPTO_MODE)
+        # Offer the preferred codec, with JSON to fall back on
+        codecs = [CONSTANTS.CODEC] if CONSTANTS.CODEC == codec.JSON else [CONSTANTS.CODEC, codec.JSON]
+        self.server_connection.sendall(framing.frame(cryptosession.make_hello(dict(self.session.hello(), codecs=codecs, compression=compression.offer()))))
+        # The server answers with its own hello before anything else
+        hello = []
+        while not hello:
+            if not self.frameBuffer.recvFrom(self.server_connection):
+                print("Server Down")
+                sys.exit(1)
+            hello = self.frameBuffer.frames()
+        hello = cryptosession.read_hello(hello[0][1])
+        self.session.start(hello["nonce"])
+        self.codec = hello.get("codec", codec.JSON) # Servers that do not negotiate speak JSON
+        self.compression = None # Messages are compressed only if the server chose a compression
+        if hello.get("compression") is not None:
+            self.compression = compression.CompressionStream()
+
+    # Encodes a command with the negotiated codec, compresses and encrypts it and sends it to the server as one frame
+    def sendServer(self, serverMsg):
+        data = codec.encode(self.codec, serverMsg)
+        if self.compression is not None:
+            data = self.compression.compress(data)
+        self.server_connection.sendall(framing.frame(self.session.encrypt(data)))
+
+    # Decrypts a message from the server, decompressing it if the connection compresses
+    def receiveServer(self, message):
+        data = self.session.decrypt(message)
+        if self.compression is not None:
+            data = self.compression.decompress(data)
+        return decode_message(self.codec, data)
+
     def printCommands(self):
         f = open('COMMANDS.txt','r')
         message = f.read()
@@ -93,41 +197,41 @@ class IRCClient():
     def listRooms(self):
         serverMsg = {}
         serverMsg["command"] = "LR"
-        self.server_connection.send(encode_n_encrypt(json.dumps(serverMsg)))
+        self.sendServer(serverMsg)
 
     # Create a room on the IRC server 
     def createRoom(self, roomName):
         serverMsg = {}
         serverMsg["command"] = "CR"
         serverMsg["roomname"] = roomName
-        self.server_connection.send(encode_n_encrypt(json.dumps(serverMsg)))
+        self.sendServer(serverMsg)
 
     # Join a room on the IRC server
     def joinRoom(self, roomName):
         serverMsg = {}
         serverMsg["command"] = "JR"
         serverMsg["roomname"] = roomName
-        self.server_connection.send(encode_n_encrypt(json.dumps(serverMsg)))
+        self.sendServer(serverMsg)
 
     # Leave a room on the IRC server
     def leaveRoom(self, roomName):
         serverMsg = {}
         serverMsg["command"] = "LER"
         serverMsg["roomname"] = roomName
-        self.server_connection.send(encode_n_encrypt(json.dumps(serverMsg)))
+        self.sendServer(serverMsg)
 
     # List all clients connected to the server
     def listClients(self):
         serverMsg = {}
         serverMsg["command"] = "LC"
-        self.server_connection.send(encode_n_encrypt(json.dumps(serverMsg)))
+        self.sendServer(serverMsg)
 
     # List all clients connected to a room on the IRC Server
     def listRoomClients(self, roomName):
         serverMsg = {}
         serverMsg["command"] = "LRC"
         serverMsg["roomname"] = roomName
-        self.server_connection.send(encode_n_encrypt(json.dumps(serverMsg)))
+        self.sendServer(serverMsg)
 
     # Send a message to a room on the IRC server
     def msgRoom(self, roomName, message):
@@ -135,7 +239,7 @@ class IRCClient():
         serverMsg["command"] = "MR"
         serverMsg["roomname"] = roomName
         serverMsg["message"] = message
-        self.server_connection.send(encode_n_encrypt(json.dumps(serverMsg)))
+        self.sendServer(serverMsg)
 
     # Send a private message to a connected client on the IRC server
     def privateMsg(self, toMessage, message):
@@ -143,7 +247,48 @@ class IRCClient():
         serverMsg["command"] = "PM"
         serverMsg["target"] = toMessage
         serverMsg["message"] = message
-        self.server_connection.send(encode_n_encrypt(json.dumps(serverMsg)))
+        self.sendServer(serverMsg)
+
+    # Request earlier messages of a room, the newest ones unless a message number to read before is given
+    def roomHistory(self, roomName, count=None, before=None):
+        serverMsg = {}
+        serverMsg["command"] = "RH"
+        serverMsg["roomname"] = roomName
+        if count is not None:
+            serverMsg["count"] = count
+        if before is not None:
+            serverMsg["before"] = before
+        self.sendServer(serverMsg)
+
+    # Search the messages of a room (or of all rooms and private messages when roomName is None).
+    # Words of the form from:NAME, days:N, count:N and before:ID narrow down the search
+    def searchMessages(self, roomName, query):
+        serverMsg = {}
+        serverMsg["command"] = "SR"
+        if roomName is not None:
+            serverMsg["roomname"] = roomName
+        words = []
+        for word in query.split(" "):
+            option = word.split(":", 1)
+            if len(option) == 2 and option[0] in ("from", "days", "count", "before") and option[1]:
+                serverMsg[option[0]] = option[1]
+            else:
+                words.append(word)
+        serverMsg["query"] = " ".join(words)
+        self.sendServer(serverMsg)
+
+    # Request the server's statistics
+    def serverStats(self):
+        serverMsg = {}
+        serverMsg["command"] = "ST"
+        self.sendServer(serverMsg)
+
+    # Answer a ping from the server
+    def pong(self, ping):
+        serverMsg = {}
+        serverMsg["command"] = "PO"
+        serverMsg["ping"] = ping
+        self.sendServer(serverMsg)
 
     # Send a file to a room 
     def sendFileRoom(self, target, file_name):
@@ -153,7 +298,11 @@ class IRCClient():
         serverMsg["file_name"] = file_name
         if(os.path.isfile(file_name)):
             serverMsg["file_size"] = os.stat(file_name).st_size
-            self.server_connection.send(encode_n_encrypt(json.dumps(serverMsg)))
+            serverMsg["file_nonce"] = nonce = cryptosession.new_file_nonce()
+            self.outgoingFiles[nonce] = file_name
+            serverMsg["file_hash"] = filetransfer.file_digest(file_name)
+            serverMsg["chunk_size"] = CONSTANTS.FILE_CHUNK_SIZE
+            self.sendServer(serverMsg)
         else:
             print("File: '" + file_name + "'' doesn't exist. Please check!")
             self.prompt()
@@ -166,35 +315,93 @@ class IRCClient():
         serverMsg["file_name"] = file_name
         if(os.path.isfile(file_name)):
             serverMsg["file_size"] = os.stat(file_name).st_size
-            self.server_connection.send(encode_n_encrypt(json.dumps(serverMsg)))
+            serverMsg["file_nonce"] = nonce = cryptosession.new_file_nonce()
+            self.outgoingFiles[nonce] = file_name
+            serverMsg["file_hash"] = filetransfer.file_digest(file_name)
+            serverMsg["chunk_size"] = CONSTANTS.FILE_CHUNK_SIZE
+            self.sendServer(serverMsg)
         else:
             print("File: '" + file_name + "'' doesn't exist. Please check!")
             self.prompt()
 
-    # Send the file contents to the server
-    def sendFileData(self, file_name):
-        # file_data = open(file_name)
-        with open(file_name) as file_data:
-            read_data = file_data.read(1024)
-            while read_data:
-                self.server_connection.send(encode_n_encrypt(read_data))
-                read_data = file_data.read(1024)
-            file_data.close()
-
-    # Receive any incoming file contents from the server
-    def receiveFileData(self, message, FILE_NAME, FILE_SIZE):
-        with open(self.name + '_' + FILE_NAME, 'wb') as f:
-            total_received_data = 0
-            while True:
-                f.write(message.encode('UTF-8')) # Explicitly encoded to write to file
-                total_received_data += len(message.encode('UTF-8'))
-                if(total_received_data < FILE_SIZE):
-                    message = s.recv(1024)
-                    message = decrypt_n_decode(message)
-                else:
-                    break
-            f.close()
-        print("File: " + FILE_NAME + " received successfully")
+    # Send the requested chunks of the file to the server as binary data frames. The contents
+    # are encrypted end to end with the file's own cipher, so the server relays them as is.
+    # If everyone involved compresses, chunks that shrink are deflated before they are encrypted;
+    # files of already compressed types are sent as they are
+    def sendFileData(self, nonce, transferId, chunks, chunk_size, compress=False):
+        # The server names the transfer by its nonce, so the same file can be sent several times at once
+        file_name = self.outgoingFiles.pop(nonce, None)
+        if file_name is None:
+            return
+        compress = compress and compression.compressible(file_name)
+        # Chunks are read and encrypted in place in reused buffers, and a batch of
+        # frames goes out with one scatter/gather write
+        buffers = [memoryview(bytearray(chunk_size)) for i in range(CONSTANTS.FILE_SEND_BATCH)]
+        parts = []
+        with open(file_name, 'rb') as file_data:
+            for start, end in chunks:
+                file_data.seek(start * chunk_size)
+                # Whole chunks continue each other's keystream, a deflated chunk needs its own
+                cipher = None if compress else cryptosession.file_cipher(nonce, start * chunk_size)
+                for seq in range(start, end):
+                    view = buffers[len(parts) // 2]
+                    read_size = file_data.readinto(view)
+                    source = data = view[:read_size]
+                    kind = framing.DATA
+                    deflated = compression.compress_chunk(data) if compress else None
+                    if deflated is not None:
+                        # Shorter than the chunk, so it never runs into the next chunk's keystream
+                        kind = framing.DEFLATED_DATA
+                        source = deflated
+                        data = view[:len(deflated)]
+                    (cipher or cryptosession.file_cipher(nonce, seq * chunk_size)).encrypt(source, output=data)
+                    # Transfer id and sequence number tell the receiver where the chunk goes
+                    header = framing.HEADER.pack(kind, filetransfer.CHUNK.size + filetransfer.DIGEST_SIZE + len(data)) + filetransfer.CHUNK.pack(transferId, seq) + filetransfer.chunk_digest(data)
+                    parts += [header, data]
+                    if len(parts) == 2 * len(buffers):
+                        framing.send_buffers(self.server_connection, parts)
+                        parts = []
+        framing.send_buffers(self.server_connection, parts)
+
+    # Tells the server which chunks of an announced file are still needed
+    def requestChunks(self, transferId, missing):
+        serverMsg = {}
+        serverMsg["command"] = "FR"
+        serverMsg["transfer"] = transferId
+        serverMsg["missing"] = missing
+        self.sendServer(serverMsg)
+
+    # Stores one chunk of incoming file contents, finishing the file once complete
+    def receiveFileData(self, kind, data):
+        transferId, seq = filetransfer.CHUNK.unpack_from(data)
+        incoming = self.incomingFiles.get(transferId)
+        if incoming is None:
+            return
+        data = memoryview(data)
+        digest = data[filetransfer.CHUNK.size:filetransfer.CHUNK.size + filetransfer.DIGEST_SIZE]
+        if not incoming.write(seq, digest, data[filetransfer.CHUNK.size + filetransfer.DIGEST_SIZE:], kind == framing.DEFLATED_DATA):
+            print("\nFile: " + incoming.name + " chunk " + str(seq) + " failed its checksum")
+            self.prompt()
+            return
+        if(incoming.remaining == 0):
+            self.finishFile(transferId)
+
+    # Path of the partial file of an incoming transfer, shared by later attempts from the same sender
+    # so they can resume, but not by another transfer of the same file still in progress
+    def partPath(self, info):
+        work = self.name + '_' + os.path.basename(info["name"]) + '.' + os.path.basename(info["sender"]) + '.' + os.path.basename(info["hash"][:16])
+        if any(incoming.work == work for incoming in self.incomingFiles.values()):
+            work += '.' + str(info["transfer"])
+        return work
+
+    # Verifies and closes a received file
+    def finishFile(self, transferId):
+        incoming = self.incomingFiles.pop(transferId)
+        if incoming.finish():
+            print("File: " + incoming.name + " received successfully")
+        else:
+            print("File: " + incoming.name + " failed its checksum, send it again to retry")
+        self.prompt()
 
     # The function that is executed once all initialization is complete
     def run(self):
@@ -202,46 +409,56 @@ class IRCClient():
         # Prompt the client for their command
         self.prompt()
 
-        # File transfer parameters
-        FILE_TRANSFER_MODE = False
-        FILE_NAME = None
-        FILE_SIZE = None
-
         while True:
             read, write, error = select.select(socket_list, [], [])
             for s in read:
                 # Incoming server response
                 if s is self.server_connection:
-                    # Get server response and display
-                    message = s.recv(1024)
+                    # Get server responses and display
+                    received = self.frameBuffer.recvFrom(s)
 
                     # No message indicates that the server is down
-                    if not message:
+                    if not received:
                         print("Server Down")
                         sys.exit(1)
-                    else:
-                        message = decrypt_n_decode(message)
+
+                    # One read may carry several messages
+                    for kind, message in self.frameBuffer.frames():
+                        # Recieve file data
+                        if kind == framing.DATA or kind == framing.DEFLATED_DATA:
+                            self.receiveFileData(kind, message)
+                            continue
+
+                        jsonData = self.receiveServer(message)
+                        message = jsonData["message"]
+                        # Answer the server's keepalive without showing anything
+                        if("ping" in jsonData):
+                            self.pong(jsonData["ping"])
+
                         # Sends file data when server is ready to recieve
-                        if("RECEIVING FILE" in message):
-                            self.sendFileData(message.split(" ", 4)[3])
-
-                        # Switch to FILE_TRANSFER_MODE when server is sending a file
-                        elif("SENDING FILE" in message):
-                            FILE_TRANSFER_MODE = True
-                            FILE_NAME = message.split(" ", 10)[8]
-                            FILE_SIZE = int(message.split(" ", 10)[9])
+                        elif("send_file" in jsonData):
+                            self.sendFileData(jsonData["file_nonce"], jsonData["transfer"], jsonData["chunks"], jsonData["chunk_size"], jsonData.get("compress", False))
+
+                        # Start receiving when server is sending a file
+                        elif("file" in jsonData):
+                            info = jsonData["file"]
+                            FILE_NAME = os.path.basename(info["name"])
+                            incoming = self.incomingFiles[info["transfer"]] = IncomingFile(info, self.name + '_' + FILE_NAME, self.partPath(info))
                             display_msg = message
-                            display_msg = display_msg[:-len(str(FILE_SIZE))]
+                            display_msg = display_msg[:-len(str(info["size"]))]
                             print("\n" + display_msg)
-
-                        # Recieve file data and reset file parameters afterwards
-                        elif(FILE_TRANSFER_MODE):
-                            self.receiveFileData(message, FILE_NAME, FILE_SIZE)
+                            # Only ask for what an earlier attempt did not already store
+                            self.requestChunks(info["transfer"], incoming.missing())
+                            if(incoming.remaining == 0):
+                                self.finishFile(info["transfer"])
+
+                        # Sender went away before the whole file arrived
+                        elif("file_failed" in jsonData):
+                            incoming = self.incomingFiles.pop(jsonData["file_failed"], None)
+                            if incoming is not None:
+                                incoming.close()
+                            print("\n" + message)
                             self.prompt()
-                            # Resetting the file parameters
-                            FILE_TRANSFER_MODE = False
-                            FILE_NAME = None
-                            FILE_SIZE = None
 
                         # Print response from server and ask for client input
                         else:
@@ -292,6 +509,27 @@ class IRCClient():
                             parse = message.split(" ", 2)
                             self.privateMsg(parse[1], parse[2])
 
+                        # Client wants earlier messages of a room
+                        elif command == "RH":
+                            parse = message.split(" ")
+                            try:
+                                count = int(parse[2]) if len(parse) > 2 else None
+                                before = int(parse[3]) if len(parse) > 3 else None
+                            except ValueError:
+                                print("Count and message number must be numbers! Please try again!")
+                                self.prompt()
+                                continue
+                            self.roomHistory(parse[1], count, before)
+
+                        # Client wants to search messages
+                        elif command == "SR":
+                            parse = message.split(" ", 2)
+                            self.searchMessages(None if parse[1] == "*" else parse[1], parse[2] if len(parse) > 2 else "")
+
+                        # Client wants the server statistics
+                        elif command == "ST":
+                            self.serverStats()
+
                         # Client wants to send file to a room
                         elif command == "SFR":
                             parse = message.split(" ", 2)
@@ -0,0 +1,129 @@
+#####################################################################
+#                    Haritha Munagala, Susham Yerabolu              #
+#                    CS 594 Internetworking Protocols               #
+#                             Spring 2018                           #
+#                          Multi-process Server                     #
+#####################################################################
+
+#--------------------------------------------------------------------#
+# Python Imports
+import os
+import signal
+import socket
+import selectors
+import CONSTANTS
+import framing
+from linking import Link, LinkedIRCServer
+from logger import log
+#--------------------------------------------------------------------#
+
+#--------------------------------------------------------------------#
+# Cluster Hub
+# Starts the worker processes and relays events between them. Every
+# worker accepts clients on the same port (SO_REUSEPORT) and is linked
+# to the hub by a Unix socket pair; each event a worker sends is
+# passed on unchanged to every other worker. A worker that dies is
+# announced to the others as down and started again.
+#--------------------------------------------------------------------#
+class ClusterHub():
+    def __init__(self, host, port, workers):
+        self.host = host
+        self.port = port
+        self.workers = workers #Number of worker processes
+        self.selector = selectors.DefaultSelector()
+        # Dictionary containing the link to every worker
+        #   Key: Socket Object
+        #   Value: (Link object, worker index, process id)
+        self.links = {}
+        self.stopping = False
+
+    # Forks worker number index, linked to the hub by a socket pair
+    def spawn(self, index):
+        hubSocket, workerSocket = socket.socketpair()
+        pid = os.fork()
+        if pid == 0:
+            # The hub asks workers to stop with SIGTERM, a Ctrl-C is for the hub only
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            # Keep only our own end of the bus, so the hub sees EOF when any worker exits
+            for s in list(self.links):
+                s.close()
+            hubSocket.close()
+            self.selector.close()
+            try:
+                server = LinkedIRCServer(self.host, self.port, "worker-" + str(index))
+                server.reusePort = True
+                # Each worker serves its own metrics, on consecutive ports
+                if server.metricsPort:
+                    server.metricsPort += index
+                server.addLink(workerSocket, "hub")
+                server.run()
+            finally:
+                os._exit(1)
+        workerSocket.close()
+        self.links[hubSocket] = (Link(self.selector, hubSocket, self.relay, "worker-" + str(index)), index, pid)
+
+    # Passes the events from one worker on to all the others
+    def relay(self, s, mask):
+        if s not in self.links:
+            return
+        link, index, pid = self.links[s]
+        if mask & selectors.EVENT_WRITE:
+            link.flush()
+        if mask & selectors.EVENT_READ:
+            try:
+                events = link.receive()
+            except (BlockingIOError, InterruptedError):
+                return
+            except (socket.error, ValueError):
+                events = None
+            if events is None:
+                self.workerDown(s)
+                return
+            for data in events:
+                frame = framing.frame(data)
+                for other, otherIndex, otherPid in self.links.values():
+                    if other is not link:
+                        other.sendFrame(frame)
+
+    # Tells the other workers that a worker's clients are gone and replaces the worker
+    def workerDown(self, s):
+        link, index, pid = self.links.pop(s)
+        link.close()
+        os.waitpid(pid, 0)
+        for other, otherIndex, otherPid in self.links.values():
+            other.send({"event": "down", "server": link.name})
+        if not self.stopping:
+            log.warning("worker_restarted", worker=index)
+            self.spawn(index)
+
+    # Stops every worker, the hub exits once they are gone
+    def stop(self, signum, frame):
+        self.stopping = True
+        for link, index, pid in self.links.values():
+            os.kill(pid, signal.SIGTERM)
+
+    # Runs the hub until every worker has stopped
+    def run(self):
+        for index in range(self.workers):
+            self.spawn(index)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+        log.info("cluster_started", workers=self.workers)
+        while self.links:
+            for key, mask in self.selector.select():
+                callback = key.data
+                callback(key.fileobj, mask)
+#--------------------------------------------------------------------#
+
+#--------------------------------------------------------------------#
+# Main function
+# This function starts the IRC server with one worker process per CPU
+# core, or CONSTANTS.WORKERS of them
+#--------------------------------------------------------------------#
+def main():
+    hub = ClusterHub(CONSTANTS.HOST, CONSTANTS.PORT, CONSTANTS.WORKERS or os.cpu_count())
+    hub.run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#####################################################################
+#                    Haritha Munagala, Susham Yerabolu              #
+#                    CS 594 Internetworking Protocols               #
+#                             Spring 2018                           #
+#                           Message Codecs                          #
+#####################################################################
+
+#--------------------------------------------------------------------#
+# Python Imports
+import json
+import struct
+#--------------------------------------------------------------------#
+
+# Codecs a connection can use, chosen in the hello. "json" is understood by every
+# client and server; "bin1" is version 1 of the binary codec
+JSON = "json"
+BINARY = "bin1"
+CODECS = (BINARY, JSON) # Preferred first
+
+# Field types of the binary codec
+SHORT = struct.Struct('!H') # Names, up to 65535 bytes of UTF-8 after a 2 byte length
+TEXT = struct.Struct('!I')  # Message text, after a 4 byte length
+NUMBER = struct.Struct('!Q') # Sizes and counts
+
+# Opcodes that are not commands
+FALLBACK = 0x00 # JSON follows, for anything the opcode table does not cover
+MESSAGE = 0x80  # Server reply holding only a message
+
+# Opcode and fields, in wire order, of every command of the binary codec
+COMMANDS = {
+    "NN": (0x01, (("name", SHORT),)),
+    "LR": (0x02, ()),
+    "CR": (0x03, (("roomname", SHORT),)),
+    "JR": (0x04, (("roomname", SHORT),)),
+    "LER": (0x05, (("roomname", SHORT),)),
+    "LC": (0x06, ()),
+    "LRC": (0x07, (("roomname", SHORT),)),
+    "MR": (0x08, (("roomname", SHORT), ("message", TEXT))),
+    "PM": (0x09, (("target", SHORT), ("message", TEXT))),
+    "SFR": (0x0A, (("target", SHORT), ("file_name", SHORT), ("file_size", NUMBER), ("file_nonce", SHORT), ("file_hash", SHORT), ("chunk_size", NUMBER))),
+    "SFP": (0x0B, (("target", SHORT), ("file_name", SHORT), ("file_size", NUMBER), ("file_nonce", SHORT), ("file_hash", SHORT), ("chunk_size", NUMBER))),
+}
+
+# Command and fields of every opcode
+OPCODES = dict((opcode, (command, fields)) for command, (opcode, fields) in COMMANDS.items())
+OPCODES[MESSAGE] = (None, (("message", TEXT),))
+
+# Picks the codec for a connection from the ones the peer offered, JSON if it offered none
+def choose(offered):
+    for name in CODECS:
+        if offered and name in offered:
+            return name
+    return JSON
+
+# Packs the fields of one opcode, raises an error if a value does not fit its type
+def pack(opcode, fields, values):
+    parts = [bytes((opcode,))]
+    for name, kind in fields:
+        value = values[name]
+        if kind is NUMBER:
+            parts.append(NUMBER.pack(value))
+        else:
+            data = value.encode('UTF-8')
+            parts.append(kind.pack(len(data)))
+            parts.append(data)
+    return b"".join(parts)
+
+# Encodes a command or reply dictionary
+def encode(codec, values):
+    if codec == BINARY:
+        command = values.get("command")
+        if command is None:
+            opcode, fields = MESSAGE, OPCODES[MESSAGE][1]
+        else:
+            opcode, fields = COMMANDS.get(command, (None, ()))
+        # Only exactly the fields of the opcode go binary, anything else falls back to JSON
+        if opcode is not None and len(values) == len(fields) + (command is not None):
+            try:
+                return pack(opcode, fields, values)
+            except (KeyError, AttributeError, TypeError, struct.error):
+                pass
+        return bytes((FALLBACK,)) + json.dumps(values).encode('UTF-8')
+    return json.dumps(values).encode('UTF-8')
+
+# Decodes a command or reply dictionary, raises ValueError on a malformed message
+def decode(codec, data):
+    if codec != BINARY:
+        return json.loads(bytes(data).decode('UTF-8'))
+    data = memoryview(data)
+    if data[0] == FALLBACK:
+        return json.loads(bytes(data[1:]).decode('UTF-8'))
+    if data[0] not in OPCODES:
+        raise ValueError("Unknown opcode: " + str(data[0]))
+    command, fields = OPCODES[data[0]]
+    values = {}
+    if command is not None:
+        values["command"] = command
+    offset = 1
+    try:
+        for name, kind in fields:
+            if kind is NUMBER:
+                values[name] = NUMBER.unpack_from(data, offset)[0]
+                offset += NUMBER.size
+            else:
+                length = kind.unpack_from(data, offset)[0]
+                offset += kind.size
+                if offset + length > len(data):
+                    raise ValueError("Truncated field: " + name)
+                values[name] = bytes(data[offset:offset + length]).decode('UTF-8')
+                offset += length
+    except struct.error:
+        raise ValueError("Truncated message")
+    return values
@@ -0,0 +1,125 @@
+#####################################################################
+#                    Haritha Munagala, Susham Yerabolu              #
+#                    CS 594 Internetworking Protocols               #
+#                             Spring 2018                           #
+#                            Compression                            #
+#####################################################################
+
+#--------------------------------------------------------------------#
+# Python Imports
+import os
+import zlib
+import CONSTANTS
+#--------------------------------------------------------------------#
+
+# Compression methods a connection can use, chosen in the hello
+ZLIB = "zlib"
+
+# First byte of every message on a compressing connection, in front of the codec's bytes
+RAW = 0      # Sent as is, too small to be worth compressing
+DEFLATED = 1 # Deflated with the connection's stream context
+
+# Compression methods this side offers in its hello
+def offer():
+    return [CONSTANTS.COMPRESSION] if CONSTANTS.COMPRESSION else []
+
+# Picks the compression method for a connection from the ones the peer offered, None to not compress
+def choose(offered):
+    if CONSTANTS.COMPRESSION and offered and CONSTANTS.COMPRESSION in offered:
+        return CONSTANTS.COMPRESSION
+    return None
+
+# Whether a file's contents are worth compressing, files of already compressed types are not
+def compressible(file_name):
+    return bool(CONSTANTS.COMPRESSION) and os.path.splitext(file_name)[1].lower() not in CONSTANTS.COMPRESSED_TYPES
+
+# Deflates one file chunk on its own, so receivers can take chunks in any order.
+# Returns None if that does not make the chunk smaller
+def compress_chunk(data):
+    deflated = zlib.compress(data, CONSTANTS.COMPRESS_LEVEL)
+    if len(deflated) >= len(data):
+        return None
+    return deflated
+
+# Inflates one file chunk, raises ValueError if it is damaged or larger than `limit` bytes
+def decompress_chunk(data, limit):
+    decompressor = zlib.decompressobj()
+    try:
+        chunk = decompressor.decompress(data, limit)
+    except zlib.error as e:
+        raise ValueError("Damaged chunk: " + str(e))
+    if decompressor.unconsumed_tail or not decompressor.eof:
+        raise ValueError("Chunk inflates to more than " + str(limit) + " bytes")
+    return chunk
+
+#--------------------------------------------------------------------#
+# Compression Statistics
+# Bytes before and after compression, kept by the server across all of
+# its connections and links.
+#--------------------------------------------------------------------#
+class CompressionStats():
+    __slots__ = ('messageBytes', 'messageWireBytes', 'fileBytes', 'fileWireBytes')
+
+    def __init__(self):
+        self.messageBytes = 0 # Messages, as encoded by their codec
+        self.messageWireBytes = 0 # The same messages as they went over the wire, before encryption
+        self.fileBytes = 0 # File chunks relayed for compressing transfers
+        self.fileWireBytes = 0 # The same chunks as they were relayed
+
+    # Wire bytes per original byte, 1.0 while nothing has been compressed
+    def ratio(self, original, wire):
+        return wire / original if original else 1.0
+#--------------------------------------------------------------------#
+
+#--------------------------------------------------------------------#
+# Compression Stream
+# One per connection, set up when both sides offered compression in
+# their hellos. Each direction keeps one zlib stream for the lifetime of
+# the connection, so a message can refer back to earlier ones; every
+# message is flushed on its own and is inflated as soon as it arrives.
+# Like the CTR and GCM sessions this depends on every message being
+# delivered in order, a dropped message breaks the stream.
+# Messages are compressed before they are encrypted.
+#--------------------------------------------------------------------#
+class CompressionStream():
+    def __init__(self, stats=None):
+        self.compressor = zlib.compressobj(CONSTANTS.COMPRESS_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+        self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        self.stats = stats if stats is not None else CompressionStats()
+
+    # Whether a message is large enough to be compressed
+    def worthwhile(self, data):
+        return len(data) >= CONSTANTS.COMPRESS_THRESHOLD
+
+    # Compresses one message, small ones are only marked as raw
+    def compress(self, data):
+        original = len(data)
+        if self.worthwhile(data):
+            # Once deflated the message is part of the stream, even if it did not shrink
+            data = bytes((DEFLATED,)) + self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        else:
+            data = bytes((RAW,)) + data
+        self.count(original, len(data))
+        return data
+
+    # Decompresses one message, raises ValueError if it is damaged or too large
+    def decompress(self, data):
+        if not data or data[0] not in (RAW, DEFLATED):
+            raise ValueError("Invalid compressed message")
+        if data[0] == RAW:
+            message = bytes(data[1:])
+        else:
+            try:
+                message = self.decompressor.decompress(bytes(data[1:]), CONSTANTS.MAX_FRAME_SIZE)
+            except zlib.error as e:
+                raise ValueError("Damaged compressed message: " + str(e))
+            if self.decompressor.unconsumed_tail:
+                raise ValueError("Message inflates to more than MAX_FRAME_SIZE")
+        self.count(len(message), len(data))
+        return message
+
+    # Adds a message to the statistics
+    def count(self, original, wire):
+        self.stats.messageBytes += original
+        self.stats.messageWireBytes += wire
+#--------------------------------------------------------------------#
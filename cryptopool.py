@@ -0,0 +1,51 @@
+#####################################################################
+#                    Haritha Munagala, Susham Yerabolu              #
+#                    CS 594 Internetworking Protocols               #
+#                             Spring 2018                           #
+#                            Crypto Pool                            #
+#####################################################################
+
+#--------------------------------------------------------------------#
+# Python Imports
+from concurrent.futures import ThreadPoolExecutor
+#--------------------------------------------------------------------#
+
+# Applies a CryptoSession method ("encrypt" or "decrypt") to each piece of data in order.
+# Returns the results, ending with the exception instead if one of them failed
+def run_batch(operation, session, datas):
+    results = []
+    try:
+        for data in datas:
+            results.append(getattr(session, operation)(data))
+    except Exception as e:
+        results.append(e)
+    return results
+
+#--------------------------------------------------------------------#
+# Crypto Pool
+# Worker threads the server hands large encryptions and decryptions
+# to. PyCryptodome releases the GIL while it runs AES, so the messages
+# of different connections are processed on several cores at once.
+# The data of one session always goes to a single task, in order, since
+# CTR and GCM sessions depend on every message being processed in turn.
+# Batches smaller than `threshold` bytes are cheaper to process inline
+# than to hand over.
+#--------------------------------------------------------------------#
+class CryptoPool():
+    def __init__(self, workers, threshold):
+        self.threshold = threshold # Bytes a batch needs before it is handed to the workers
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="crypto")
+
+    # Runs a batch of (session, [data]) pairs, each session at most once. Returns one
+    # list of results per pair, in the order of the pairs
+    def process(self, operation, batch):
+        futures = {}
+        for i, (session, datas) in enumerate(batch):
+            if sum(len(data) for data in datas) >= self.threshold:
+                futures[i] = self.executor.submit(run_batch, operation, session, datas)
+        # The small ones run here while the workers are busy with the large ones
+        results = [None if i in futures else run_batch(operation, session, datas) for i, (session, datas) in enumerate(batch)]
+        for i, future in futures.items():
+            results[i] = future.result()
+        return results
+#--------------------------------------------------------------------#
@@ -0,0 +1,119 @@
+#####################################################################
+#                    Haritha Munagala, Susham Yerabolu              #
+#                    CS 594 Internetworking Protocols               #
+#                             Spring 2018                           #
+#                        Encryption Sessions                        #
+#####################################################################
+
+#--------------------------------------------------------------------#
+# Python Imports
+import binascii
+import hashlib
+import hmac
+import json
+import CONSTANTS
+from Crypto.Cipher import AES
+from Crypto import Random
+#--------------------------------------------------------------------#
+
+# Key shared between server and client, encoded once instead of per message
+KEY = CONSTANTS.KEY.encode('UTF-8')
+
+# Key shared by linked servers. Every client holds KEY, so links need a key of their own
+LINK_KEY = CONSTANTS.LINK_KEY.encode('UTF-8')
+
+# Links always use GCM, so events cannot be altered on the way unnoticed
+LINK_MODE = "GCM"
+
+# Bytes of random nonce each side picks for its sending direction
+NONCE_SIZES = {"CTR": 8, "GCM": 12, "CFB": 0}
+
+# Builds the plaintext hello frame that opens a connection
+def make_hello(fields):
+    return json.dumps(fields).encode('UTF-8')
+
+# Parses a hello frame received from the peer
+def read_hello(data):
+    return json.loads(bytes(data).decode('UTF-8'))
+
+# Proof that the sender of a link hello holds the key. It covers the sender's server id and
+# the nonces of both sides, so it is only good for the link it was made for
+def hello_proof(key, server, nonce, peerNonce):
+    return hmac.new(key, json.dumps([server, nonce, peerNonce]).encode('UTF-8'), hashlib.sha256).hexdigest()
+
+# Picks the nonce a sender announces for one file transfer
+def new_file_nonce():
+    return binascii.hexlify(Random.new().read(8)).decode('ascii')
+
+# Cipher for file contents starting at a byte offset (a multiple of 16). Files are
+# encrypted end to end under their own nonce, so the server relays them untouched
+def file_cipher(nonce, offset=0):
+    return AES.new(KEY, AES.MODE_CTR, nonce=binascii.unhexlify(nonce), initial_value=offset // 16)
+
+#--------------------------------------------------------------------#
+# Crypto Session
+# One per connection. Each side picks a nonce for the direction it sends
+# in and announces it in its hello; after that no IV travels with the
+# messages.
+#   CTR: one AES-CTR keystream per direction for the whole connection.
+#        Fastest mode, the key schedule is done once per connection.
+#   GCM: authenticated, the per-message nonce is the announced nonce
+#        combined with a message counter both sides keep in step.
+#   CFB: stateless, a random 16 byte IV is sent with every message.
+# CTR and GCM depend on every message being delivered in order, so a
+# frame encrypted by these sessions must never be dropped.
+#--------------------------------------------------------------------#
+class CryptoSession():
+    def __init__(self, mode, key=KEY):
+        if mode not in NONCE_SIZES:
+            raise ValueError("Unsupported crypto mode: " + str(mode))
+        self.mode = mode
+        self.key = key
+        self.sendNonce = Random.new().read(NONCE_SIZES[mode])
+        self.stateless = (mode == "CFB") # Same plaintext encrypts the same way for every receiver
+        self.encryptor = None
+        self.decryptor = None
+        self.sendCount = 0
+        self.receiveCount = 0
+
+    # Fields announced to the peer in the hello frame
+    def hello(self):
+        return {"crypto": self.mode, "nonce": binascii.hexlify(self.sendNonce).decode('ascii')}
+
+    # Sets up both directions once the peer's nonce is known
+    def start(self, peerNonce):
+        self.receiveNonce = binascii.unhexlify(peerNonce)
+        if len(self.receiveNonce) != NONCE_SIZES[self.mode]:
+            raise ValueError("Invalid nonce for crypto mode " + self.mode)
+        if self.mode == "CTR":
+            self.encryptor = AES.new(self.key, AES.MODE_CTR, nonce=self.sendNonce)
+            self.decryptor = AES.new(self.key, AES.MODE_CTR, nonce=self.receiveNonce)
+
+    # Derives the GCM nonce of the count-th message in one direction
+    def gcmNonce(self, nonce, count):
+        return nonce[:4] + (int.from_bytes(nonce[4:], 'big') ^ count).to_bytes(8, 'big')
+
+    # Encrypts one message
+    def encrypt(self, data):
+        if self.mode == "CTR":
+            return self.encryptor.encrypt(data)
+        elif self.mode == "GCM":
+            cipher = AES.new(self.key, AES.MODE_GCM, nonce=self.gcmNonce(self.sendNonce, self.sendCount))
+            self.sendCount += 1
+            ciphertext, tag = cipher.encrypt_and_digest(data)
+            return ciphertext + tag
+        else:
+            IV = Random.new().read(16) # Randomly generated Initialization vector
+            return IV + AES.new(self.key, AES.MODE_CFB, IV).encrypt(data)
+
+    # Decrypts one message, GCM raises ValueError if the message was tampered with
+    def decrypt(self, data):
+        if self.mode == "CTR":
+            return self.decryptor.decrypt(data)
+        elif self.mode == "GCM":
+            cipher = AES.new(self.key, AES.MODE_GCM, nonce=self.gcmNonce(self.receiveNonce, self.receiveCount))
+            self.receiveCount += 1
+            return cipher.decrypt_and_verify(data[:-16], data[-16:])
+        else:
+            return AES.new(self.key, AES.MODE_CFB, data[:16]).decrypt(data[16:])
+#--------------------------------------------------------------------#
@@ -0,0 +1,135 @@
+#####################################################################
+#                    Haritha Munagala, Susham Yerabolu              #
+#                    CS 594 Internetworking Protocols               #
+#                             Spring 2018                           #
+#                          Linked IRC Server                        #
+#####################################################################
+
+#--------------------------------------------------------------------#
+# Python Imports
+import socket
+import sys
+import errno
+import selectors
+import CONSTANTS
+import cryptosession
+from linking import LinkedIRCServer
+from logger import log
+#--------------------------------------------------------------------#
+
+#--------------------------------------------------------------------#
+# Federated IRC Server
+# An IRC server linked to other servers over TCP, like classic IRC
+# server links. It accepts links on its link port and connects to the
+# configured peers, reconnecting when a link is lost. Clients, rooms,
+# room messages and private messages span every linked server; links
+# are expected to form a tree, each pair linked from one side only.
+#--------------------------------------------------------------------#
+class FederatedIRCServer(LinkedIRCServer):
+    def __init__(self, host, port, serverId, linkPort, peers):
+        LinkedIRCServer.__init__(self, host, port, serverId)
+        self.linkPort = linkPort #Port other servers link to, 0 to accept no links
+        self.peers = peers #(host, port) of the servers to link to
+        # Dictionary containing the address of every link this server opened
+        #   Key: Link object
+        #   Value: (host, port) to reconnect to
+        self.outgoing = {}
+        # Dictionary containing the links still connecting
+        #   Key: Socket Object
+        #   Value: ((host, port), timer giving up on the connection)
+        self.connecting = {}
+
+    # Accepts a link from another server
+    def acceptLink(self, linkSocket, mask):
+        try:
+            peerSocket, peerAddr = linkSocket.accept()
+        except socket.error:
+            return
+        peerSocket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.addLink(peerSocket, peerAddr[0] + ":" + str(peerAddr[1]), cryptosession.CryptoSession(cryptosession.LINK_MODE, cryptosession.LINK_KEY))
+
+    # Starts connecting a link to another server without blocking the event loop, retrying later
+    # if it is not reachable. The link is set up once the socket becomes writable
+    def connectLink(self, address):
+        try:
+            peerSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            peerSocket.setblocking(False)
+            error = peerSocket.connect_ex(address)
+        except socket.error:
+            error = errno.EHOSTUNREACH
+        if error not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            peerSocket.close()
+            self.callLater(CONSTANTS.LINK_RETRY, self.connectLink, address)
+            return
+        self.connecting[peerSocket] = (address, self.callLater(CONSTANTS.LINK_RETRY, self.connectTimeout, peerSocket))
+        self.selector.register(peerSocket, selectors.EVENT_WRITE, self.linkConnected)
+
+    # Opens the link once the connection is established, or retries later if it failed
+    def linkConnected(self, peerSocket, mask):
+        address, timer = self.connecting.pop(peerSocket)
+        timer.cancel()
+        self.selector.unregister(peerSocket)
+        if peerSocket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR):
+            peerSocket.close()
+            self.callLater(CONSTANTS.LINK_RETRY, self.connectLink, address)
+            return
+        peerSocket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        link = self.addLink(peerSocket, address[0] + ":" + str(address[1]), cryptosession.CryptoSession(cryptosession.LINK_MODE, cryptosession.LINK_KEY))
+        self.outgoing[link] = address
+        log.info("link_opened", link=link.name)
+
+    # Gives up on a connection that did not complete in time and tries again
+    def connectTimeout(self, peerSocket):
+        if peerSocket not in self.connecting:
+            return
+        address, timer = self.connecting.pop(peerSocket)
+        self.selector.unregister(peerSocket)
+        peerSocket.close()
+        self.connectLink(address)
+
+    # Reconnects links this server opened once they are lost
+    def linkDown(self, link):
+        LinkedIRCServer.linkDown(self, link)
+        address = self.outgoing.pop(link, None)
+        if address is not None:
+            self.callLater(CONSTANTS.LINK_RETRY, self.connectLink, address)
+
+    # Starts accepting and opening links, then runs the server
+    def run(self):
+        if self.linkPort:
+            self.linkSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.linkSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.linkSocket.bind((self.host, self.linkPort))
+            self.linkSocket.listen(socket.SOMAXCONN)
+            self.selector.register(self.linkSocket, selectors.EVENT_READ, self.acceptLink)
+        for address in self.peers:
+            self.connectLink(address)
+        LinkedIRCServer.run(self)
+#--------------------------------------------------------------------#
+
+# Splits a 'host:port' peer address
+def parse_address(address):
+    host, port = address.rsplit(":", 1)
+    return (host, int(port))
+
+#--------------------------------------------------------------------#
+# Main function
+# Usage: python federation.py [name port link_port [host:port ...]]
+# Without arguments the server is set up from CONSTANTS.py, so several
+# linked servers can run on one machine by passing different ports.
+#--------------------------------------------------------------------#
+def main():
+    if len(sys.argv) > 1:
+        if len(sys.argv) < 4:
+            print("Usage: python federation.py [name port link_port [host:port ...]]")
+            sys.exit(1)
+        serverId, port, linkPort, peers = sys.argv[1], int(sys.argv[2]), int(sys.argv[3]), sys.argv[4:]
+    else:
+        serverId, port, linkPort, peers = CONSTANTS.SERVER_NAME, CONSTANTS.PORT, CONSTANTS.LINK_PORT, CONSTANTS.LINKS
+    server = FederatedIRCServer(CONSTANTS.HOST, port, serverId, linkPort, [parse_address(peer) for peer in peers])
+    server.start()
+    # Worker pools only take work while the main thread is alive, so wait for the server here
+    server.join()
+
+if __name__ == "__main__":
+    main()
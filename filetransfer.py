@@ -0,0 +1,64 @@
+#####################################################################
+#                    Haritha Munagala, Susham Yerabolu              #
+#                    CS 594 Internetworking Protocols               #
+#                             Spring 2018                           #
+#                          File Transfers                           #
+#####################################################################
+
+#--------------------------------------------------------------------#
+# Python Imports
+import hashlib
+import struct
+#--------------------------------------------------------------------#
+
+# Every DATA payload starts with the transfer id and the chunk
+# sequence number, followed by the SHA-256 of the encrypted chunk and the chunk itself
+CHUNK = struct.Struct('!II')
+DIGEST_SIZE = 32
+
+# Sequence numbers recorded in a receiver's sidecar index
+SEQUENCE = struct.Struct('!I')
+
+# Digest of one encrypted chunk
+def chunk_digest(data):
+    return hashlib.sha256(data).digest()
+
+# Hex digest of a whole file, read in chunks so large files are never loaded at once
+def file_digest(path, chunk_size=1048576):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        data = f.read(chunk_size)
+        while data:
+            digest.update(data)
+            data = f.read(chunk_size)
+    return digest.hexdigest()
+
+# Number of chunks a file of the given size is split into
+def chunk_count(size, chunk_size):
+    return (size + chunk_size - 1) // chunk_size
+
+# Turns a bytearray of received flags (one per chunk) into [start, end) ranges of missing chunks
+def missing_ranges(have):
+    ranges = []
+    start = have.find(0)
+    while start != -1:
+        end = have.find(1, start)
+        if end == -1:
+            end = len(have)
+        ranges.append([start, end])
+        start = have.find(0, end)
+    return ranges
+
+# Union of two sorted lists of [start, end) ranges
+def merge_ranges(first, second):
+    merged = []
+    for start, end in sorted(first + second):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+# Number of chunks covered by a list of ranges
+def range_count(ranges):
+    return sum(end - start for start, end in ranges)
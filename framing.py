@@ -0,0 +1,105 @@
+#####################################################################
+#                    Haritha Munagala, Susham Yerabolu              #
+#                    CS 594 Internetworking Protocols               #
+#                             Spring 2018                           #
+#                          Message Framing                          #
+#####################################################################
+
+#--------------------------------------------------------------------#
+# Python Imports
+import struct
+import CONSTANTS
+#--------------------------------------------------------------------#
+
+# Every message on the wire is a 1 byte kind and a 4 byte big-endian length followed by the payload
+HEADER = struct.Struct('!BI')
+
+# Frame kinds
+MESSAGE = 0 # Hello or a message encrypted by the connection's crypto session
+DATA = 1    # File contents, encrypted end to end and relayed by the server untouched
+DEFLATED_DATA = 2 # File contents deflated before they were encrypted, relayed like DATA
+
+# Prefixes the payload with its kind and length
+def frame(payload, kind=MESSAGE):
+    return HEADER.pack(kind, len(payload)) + payload
+
+# Most buffers handed to one sendmsg call (IOV_MAX on Linux)
+MAX_IOVECS = 1024
+
+# Writes the buffers in order on a blocking socket with scatter/gather sendmsg calls,
+# or one sendall per buffer where sendmsg is missing (Windows)
+def send_buffers(sock, buffers):
+    if not hasattr(sock, "sendmsg"):
+        for buffer in buffers:
+            sock.sendall(buffer)
+        return
+    buffers = [memoryview(buffer) for buffer in buffers]
+    first = 0
+    while first < len(buffers):
+        sent = sock.sendmsg(buffers[first:first + MAX_IOVECS])
+        # Skip the buffers that went out, keeping the unsent end of a partly sent one
+        while first < len(buffers) and sent >= len(buffers[first]):
+            sent -= len(buffers[first])
+            first += 1
+        if sent:
+            buffers[first] = buffers[first][sent:]
+
+#--------------------------------------------------------------------#
+# Frame Buffer
+# Per-connection reassembly buffer. TCP may merge or split messages, so
+# bytes are read straight into the free tail of a bytearray and complete
+# frames are cut out of it once their whole payload has arrived. The
+# buffer starts small, grows to hold a large frame and shrinks back once
+# that frame has been read, so idle connections hold little memory.
+#--------------------------------------------------------------------#
+class FrameBuffer():
+    def __init__(self, size=CONSTANTS.RECV_BUFFER_SIZE):
+        self.size = size # Size the buffer starts at and shrinks back to
+        self.buffer = bytearray(size)
+        self.start = 0 # Offset of the first unparsed byte
+        self.end = 0   # Offset one past the last received byte
+
+    # Moves a partial frame to the front of the buffer, growing it if the frame does not fit
+    def compact(self):
+        pending = self.end - self.start
+        if self.start:
+            self.buffer[:pending] = self.buffer[self.start:self.end]
+        else:
+            # At least double, or make room for the whole frame at once if its header has arrived
+            size = 2 * len(self.buffer)
+            if pending >= HEADER.size:
+                size = max(size, HEADER.size + HEADER.unpack_from(self.buffer)[1])
+            self.buffer.extend(bytes(size - len(self.buffer)))
+        self.start = 0
+        self.end = pending
+
+    # Reads whatever is available on the socket into the buffer, returns the number of bytes read
+    def recvFrom(self, sock):
+        if self.end == len(self.buffer):
+            self.compact()
+        with memoryview(self.buffer) as view:
+            received = sock.recv_into(view[self.end:])
+        self.end += received
+        return received
+
+    # Returns (kind, payload) for all complete frames received so far
+    def frames(self):
+        frames = []
+        with memoryview(self.buffer) as view:
+            while self.end - self.start >= HEADER.size:
+                kind, length = HEADER.unpack_from(self.buffer, self.start)
+                if length > CONSTANTS.MAX_FRAME_SIZE:
+                    raise ValueError("Frame of " + str(length) + " bytes exceeds MAX_FRAME_SIZE")
+                begin = self.start + HEADER.size
+                if self.end - begin < length:
+                    break
+                frames.append((kind, bytes(view[begin:begin + length])))
+                self.start = begin + length
+        # Everything parsed, start filling from the front again, dropping the room a large frame took
+        if self.start == self.end:
+            self.start = 0
+            self.end = 0
+            if len(self.buffer) > self.size:
+                self.buffer = bytearray(self.size)
+        return frames
+#--------------------------------------------------------------------#
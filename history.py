@@ -0,0 +1,165 @@
+#####################################################################
+#                    Haritha Munagala, Susham Yerabolu              #
+#                    CS 594 Internetworking Protocols               #
+#                             Spring 2018                           #
+#                            Room History                           #
+#####################################################################
+
+#--------------------------------------------------------------------#
+# Python Imports
+import os
+import json
+import mmap
+import struct
+import shutil
+import time
+import CONSTANTS
+#--------------------------------------------------------------------#
+
+# Every record in a log segment is a 4 byte length followed by the JSON encoded entry
+RECORD = struct.Struct('!I')
+
+# The index of a segment holds the offset of each of its records, so record i is found at i * 8
+OFFSET = struct.Struct('!Q')
+
+#--------------------------------------------------------------------#
+# Ring Buffer
+# Holds the most recent history entries of a room in a fixed list that
+# is overwritten in a circle. Entries are (seq, time, sender, message)
+# tuples with consecutive sequence numbers.
+#--------------------------------------------------------------------#
+class RingBuffer():
+    __slots__ = ('entries', 'start', 'count')
+
+    def __init__(self, capacity):
+        self.entries = [None] * capacity
+        self.start = 0 # Position of the oldest entry
+        self.count = 0 # Number of entries held
+
+    # Adds an entry, overwriting the oldest one once full
+    def append(self, entry):
+        capacity = len(self.entries)
+        if self.count < capacity:
+            self.entries[(self.start + self.count) % capacity] = entry
+            self.count += 1
+        else:
+            self.entries[self.start] = entry
+            self.start = (self.start + 1) % capacity
+
+    # The newest `limit` entries with a sequence number below `before`, oldest first
+    def before(self, before, limit):
+        if not self.count:
+            return []
+        capacity = len(self.entries)
+        end = min(self.count, max(0, before - self.entries[self.start][0]))
+        return [self.entries[(self.start + i) % capacity] for i in range(max(0, end - limit), end)]
+#--------------------------------------------------------------------#
+
+#--------------------------------------------------------------------#
+# Room Log
+# Append-only history of one room on disk, split into segments of about
+# HISTORY_SEGMENT_SIZE bytes. Each segment is named after the sequence
+# number of its first entry and has an index of record offsets beside
+# it; older pages are read by mapping the segment and its index instead
+# of loading whole files.
+#--------------------------------------------------------------------#
+class RoomLog():
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        # First sequence number of every segment, oldest first
+        self.segments = sorted(int(name[:-4]) for name in os.listdir(directory) if name.endswith('.log'))
+        if not self.segments:
+            self.segments.append(0)
+        self.openSegment(self.segments[-1])
+        self.nextSeq = self.segments[-1] + os.path.getsize(self.path(self.segments[-1], '.idx')) // OFFSET.size
+
+    # Path of a segment's log or index file
+    def path(self, base, extension):
+        return os.path.join(self.directory, "%020d" % base + extension)
+
+    # Opens a segment for appending
+    def openSegment(self, base):
+        self.log = open(self.path(base, '.log'), 'ab')
+        self.index = open(self.path(base, '.idx'), 'ab')
+
+    # Closes the segment being appended to
+    def close(self):
+        self.log.close()
+        self.index.close()
+
+    # Appends an entry, starting a new segment once the current one is full
+    def append(self, entry):
+        if self.log.tell() >= CONSTANTS.HISTORY_SEGMENT_SIZE:
+            self.log.close()
+            self.index.close()
+            self.segments.append(entry[0])
+            self.openSegment(entry[0])
+        data = json.dumps(entry).encode('UTF-8')
+        offset = self.log.tell()
+        # The record is written before the index points to it
+        self.log.write(RECORD.pack(len(data)) + data)
+        self.log.flush()
+        self.index.write(OFFSET.pack(offset))
+        self.index.flush()
+        self.nextSeq = entry[0] + 1
+
+    # The newest `limit` entries with a sequence number below `before`, oldest first
+    def read(self, before, limit):
+        entries = []
+        for base in reversed(self.segments):
+            if len(entries) >= limit:
+                break
+            if base < before:
+                entries = self.readSegment(base, before, limit - len(entries)) + entries
+        return entries
+
+    # Reads the newest `limit` entries below `before` from one segment
+    def readSegment(self, base, before, limit):
+        with open(self.path(base, '.idx'), 'rb') as indexFile, open(self.path(base, '.log'), 'rb') as logFile:
+            count = os.fstat(indexFile.fileno()).st_size // OFFSET.size
+            end = min(count, before - base)
+            if end <= 0:
+                return []
+            with mmap.mmap(indexFile.fileno(), 0, access=mmap.ACCESS_READ) as index, mmap.mmap(logFile.fileno(), 0, access=mmap.ACCESS_READ) as log:
+                entries = []
+                for i in range(max(0, end - limit), end):
+                    offset = OFFSET.unpack_from(index, i * OFFSET.size)[0]
+                    length = RECORD.unpack_from(log, offset)[0]
+                    entries.append(tuple(json.loads(log[offset + RECORD.size:offset + RECORD.size + length].decode('UTF-8'))))
+                return entries
+#--------------------------------------------------------------------#
+
+#--------------------------------------------------------------------#
+# Room History
+# Recent messages of a room are served from the ring buffer, anything
+# older from the on-disk log (when one is kept).
+#--------------------------------------------------------------------#
+class RoomHistory():
+    def __init__(self, directory=None):
+        self.ring = RingBuffer(CONSTANTS.HISTORY_SIZE)
+        self.log = RoomLog(directory) if directory else None
+        self.nextSeq = self.log.nextSeq if self.log else 0 # Sequence number of the next message
+
+    # Records a message sent to the room, at the time it was sent if that is given
+    def add(self, sender, message, stamp=None):
+        entry = (self.nextSeq, time.time() if stamp is None else stamp, sender, message)
+        self.nextSeq += 1
+        self.ring.append(entry)
+        if self.log:
+            self.log.append(entry)
+
+    # The newest `limit` messages sent before message number `before`, oldest first
+    def before(self, before, limit):
+        entries = self.ring.before(before, limit)
+        if len(entries) < limit and self.log:
+            # Continue below what the ring buffer still holds
+            entries = self.log.read(entries[0][0] if entries else before, limit - len(entries)) + entries
+        return entries
+
+    # Deletes the log of a room that is gone
+    def remove(self):
+        if self.log:
+            self.log.close()
+            shutil.rmtree(self.log.directory)
+#--------------------------------------------------------------------#
@@ -0,0 +1,417 @@
+#####################################################################
+#                    Haritha Munagala, Susham Yerabolu              #
+#                    CS 594 Internetworking Protocols               #
+#                             Spring 2018                           #
+#                            Server Links                           #
+#####################################################################
+
+#--------------------------------------------------------------------#
+# Python Imports
+import os
+import socket
+import json
+import hmac
+import selectors
+import framing
+import cryptosession
+import compression
+from server import IRCServer
+from logger import log
+#--------------------------------------------------------------------#
+
+# Fields every event of a kind carries and the types they may have
+EVENT_FIELDS = {"nick": {"server": str, "name": str, "old": (str, type(None))},
+                "quit": {"server": str, "name": str},
+                "join": {"server": str, "name": str, "room": str},
+                "leave": {"server": str, "name": str, "room": str},
+                "deliver": {"to": list, "message": str, "extra": (dict, type(None)), "record": (dict, type(None))},
+                "sync": {"server": str},
+                "down": {"server": str}}
+
+# Fields of the record of a room or private message carried by a deliver event
+RECORD_FIELDS = {"time": (int, float), "room": (str, type(None)), "sender": str, "target": (str, type(None)), "message": str}
+
+# Raises ValueError unless every field is present with one of its types
+def check_fields(fields, data):
+    for name, types in fields.items():
+        if name not in data or not isinstance(data[name], types):
+            raise ValueError("Invalid field in link event: " + name)
+
+# Raises ValueError unless an event is of a known kind and has the fields of its kind
+def check_event(event):
+    if not isinstance(event, dict) or event.get("event") not in EVENT_FIELDS:
+        raise ValueError("Unknown link event")
+    check_fields(EVENT_FIELDS[event["event"]], event)
+    if event["event"] == "deliver":
+        if not all(isinstance(name, str) for name in event["to"]):
+            raise ValueError("Invalid field in link event: to")
+        if event["record"] is not None:
+            check_fields(RECORD_FIELDS, event["record"])
+
+#--------------------------------------------------------------------#
+# Link
+# A connection to another server (or to the bus relaying between
+# worker processes). Events are JSON frames; writes never block, bytes
+# the socket does not accept are queued until it becomes writable.
+# Links between servers are encrypted: both sides open with a hello
+# like clients do, and events wait until the peer's hello has arrived.
+# They use a key of their own, which each side then proves it holds
+# with a proof over both hellos, so a client cannot pass itself off as
+# a server and a recorded link cannot be played back.
+# If both hellos offer the same compression, events are compressed
+# before they are encrypted.
+#--------------------------------------------------------------------#
+class Link():
+    def __init__(self, selector, socket, callback, name, session=None, serverId=None, stats=None):
+        self.selector = selector
+        self.socket = socket #Socket object of the link
+        self.name = name #Name of the server or worker at the other end
+        self.frameBuffer = framing.FrameBuffer() #Reassembles events split or merged by the socket
+        self.outBuffer = bytearray() #Outbound bytes waiting for the socket to become writable
+        self.events = selectors.EVENT_READ #Events the socket is currently registered for
+        self.session = session #Crypto session, None on the local bus between worker processes
+        self.serverId = serverId #Id of this server, which its hello and proof carry
+        self.pending = None #Events sent before the peer proved it holds the link key
+        self.peerProof = None #Proof the peer has to send, known once its hello arrived
+        self.compression = None #CompressionStream, set up if both hellos offered compression
+        self.stats = stats #CompressionStats the link's compression adds to
+        self.socket.setblocking(False)
+        self.selector.register(self.socket, self.events, callback)
+        if session is not None:
+            self.pending = []
+            self.sendFrame(framing.frame(cryptosession.make_hello(dict(session.hello(), server=serverId, compression=compression.offer()))))
+
+    # Sends one event
+    def send(self, event):
+        if self.pending is not None:
+            self.pending.append(event)
+            return
+        data = json.dumps(event).encode('UTF-8')
+        if self.compression is not None:
+            data = self.compression.compress(data)
+        if self.session is not None:
+            data = self.session.encrypt(data)
+        self.sendFrame(framing.frame(data))
+
+    # Sends an already framed event, queueing what the socket does not accept
+    def sendFrame(self, frame):
+        if not self.outBuffer:
+            try:
+                sent = self.socket.send(frame)
+            except (BlockingIOError, InterruptedError):
+                sent = 0
+            except socket.error:
+                # The next read reports the broken link
+                return
+            frame = memoryview(frame)[sent:]
+        if frame:
+            self.outBuffer += frame
+            self.updateEvents()
+
+    # Writes queued bytes once the socket is writable
+    def flush(self):
+        try:
+            sent = self.socket.send(self.outBuffer)
+        except (BlockingIOError, InterruptedError):
+            return
+        except socket.error:
+            return
+        del self.outBuffer[:sent]
+        self.updateEvents()
+
+    # Watches for writability only while bytes are queued
+    def updateEvents(self):
+        events = selectors.EVENT_READ
+        if self.outBuffer:
+            events |= selectors.EVENT_WRITE
+        if events != self.events:
+            self.selector.modify(self.socket, events, self.selector.get_key(self.socket).data)
+            self.events = events
+
+    # Reads from the socket, returns the decrypted events of the complete frames or None once the link is closed
+    def receive(self):
+        if not self.frameBuffer.recvFrom(self.socket):
+            return None
+        events = []
+        for kind, data in self.frameBuffer.frames():
+            if self.session is None:
+                events.append(data)
+            elif self.peerProof is None:
+                self.startSession(cryptosession.read_hello(data))
+            elif self.pending is not None:
+                self.authenticate(self.session.decrypt(data))
+            elif self.compression is not None:
+                events.append(self.compression.decompress(self.session.decrypt(data)))
+            else:
+                events.append(self.session.decrypt(data))
+        return events
+
+    # Sets up the crypto session from the peer's hello and answers with the proof that this
+    # server holds the link key, made over both nonces
+    def startSession(self, hello):
+        if not isinstance(hello, dict) or not isinstance(hello.get("nonce"), str):
+            raise ValueError("Invalid link hello")
+        if hello.get("crypto") != self.session.mode:
+            raise ValueError("Link crypto mode mismatch: " + str(hello.get("crypto")))
+        if hello.get("server") == self.serverId:
+            raise ValueError("Link hello comes from this server")
+        self.session.start(hello["nonce"])
+        nonce = self.session.hello()["nonce"]
+        self.peerProof = cryptosession.hello_proof(self.session.key, hello.get("server"), hello["nonce"], nonce)
+        self.sendFrame(framing.frame(self.session.encrypt(cryptosession.hello_proof(self.session.key, self.serverId, nonce, hello["nonce"]).encode('UTF-8'))))
+        self.name = str(hello.get("server") or self.name)
+        # Both sides make the same choice from the two hellos
+        if compression.choose(hello.get("compression")) is not None:
+            self.compression = compression.CompressionStream(self.stats)
+
+    # Checks the peer's proof that it holds the link key and sends the events that waited for it
+    def authenticate(self, proof):
+        if not hmac.compare_digest(bytes(proof), self.peerProof.encode('UTF-8')):
+            raise ValueError("Link hello is not signed with the link key")
+        pending = self.pending
+        self.pending = None
+        for event in pending:
+            self.send(event)
+
+    # Stops watching and closes the socket
+    def close(self):
+        try:
+            self.selector.unregister(self.socket)
+        except (KeyError, ValueError):
+            pass
+        self.socket.close()
+#--------------------------------------------------------------------#
+
+#--------------------------------------------------------------------#
+# Remote Client
+# Stands in for a client connected to another server. It is used as the
+# client's key in clients, nicknames and roomClients, so commands that
+# list or look up clients treat local and remote clients alike.
+#--------------------------------------------------------------------#
+class RemoteClient():
+    def __init__(self, name, server, link):
+        self.name = name #Name of the client
+        self.server = server #Id of the server the client is connected to
+        self.link = link #Link the client's traffic goes out on
+        self.rooms = set() #Names of the rooms the client is part of
+#--------------------------------------------------------------------#
+
+#--------------------------------------------------------------------#
+# Linked IRC Server
+# An IRCServer that shares its clients and rooms with other servers over
+# links. Changes are sent as events:
+#   nick, quit:    a client took a name or disconnected
+#   join, leave:   a client joined or left a room
+#   deliver:       a message for a list of clients, with the record of
+#                  a room or private message their servers keep
+#   sync:          asks the other side for all of its clients and rooms
+#   down:          a server went away, its clients are gone
+# Messages to remote clients are grouped per link, so a message crosses
+# each link once however many of its receivers are behind it.
+#--------------------------------------------------------------------#
+class LinkedIRCServer(IRCServer):
+    def __init__(self, host, port, serverId):
+        IRCServer.__init__(self, host, port)
+        self.serverId = serverId
+        # Servers sharing a machine keep separate history logs and search indexes
+        if self.historyDir:
+            self.historyDir = os.path.join(self.historyDir, serverId)
+        if self.searchDir:
+            self.searchDir = os.path.join(self.searchDir, serverId)
+        # Dictionary containing the links to other servers
+        #   Key: Socket Object
+        #   Value: Link object
+        self.links = {}
+
+    # Starts exchanging events over a connected socket
+    def addLink(self, socket, name, session=None):
+        link = Link(self.selector, socket, self.handleLink, name, session, self.serverId, self.compressionStats)
+        self.links[socket] = link
+        # Ask for the clients and rooms that already exist on the other side
+        link.send({"event": "sync", "server": self.serverId})
+        return link
+
+    # Sends an event over every link except the one it came from
+    def publish(self, event, exclude=None):
+        for link in self.links.values():
+            if link is not exclude:
+                link.send(event)
+
+    def clientNamed(self, s, previous):
+        self.publish({"event": "nick", "server": self.serverId, "name": self.clients[s], "old": previous})
+
+    def clientLeft(self, s):
+        self.publish({"event": "quit", "server": self.serverId, "name": self.clients[s]})
+
+    def roomJoined(self, room, s):
+        self.publish({"event": "join", "server": self.serverId, "name": self.clients[s], "room": room.name})
+
+    def roomLeft(self, room, s):
+        self.publish({"event": "leave", "server": self.serverId, "name": self.clients[s], "room": room.name})
+
+    # Sends a message to a remote client over its link, local clients get it directly
+    def sendMessage(self, s, message, extra=None, record=None):
+        if isinstance(s, RemoteClient):
+            s.link.send({"event": "deliver", "to": [s.name], "message": message, "extra": extra, "record": record})
+            if record is not None:
+                self.recordMessage(record)
+        else:
+            IRCServer.sendMessage(self, s, message, extra, record)
+
+    # Sends a message to every client except the excluded one, with one deliver event per link
+    def broadcast(self, sockets, message, exclude=None, extra=None, record=None):
+        remote = {}
+        for userSocket in sockets:
+            if isinstance(userSocket, RemoteClient) and userSocket != exclude:
+                remote.setdefault(userSocket.link, []).append(userSocket.name)
+        for link, names in remote.items():
+            link.send({"event": "deliver", "to": names, "message": message, "extra": extra, "record": record})
+        IRCServer.broadcast(self, sockets, message, exclude, extra, record)
+
+    # Sends every client this server knows of, except those reached over the link itself,
+    # and the rooms they are part of
+    def syncLink(self, link):
+        for s, name in list(self.clients.items()):
+            if isinstance(s, RemoteClient):
+                if s.link is link:
+                    continue
+                server, rooms = s.server, s.rooms
+            elif s in self.connections and self.nicknames.get(name) == s:
+                server, rooms = self.serverId, self.connections[s].rooms
+            else:
+                continue
+            link.send({"event": "nick", "server": server, "name": name, "old": None})
+            for roomName in rooms:
+                link.send({"event": "join", "server": server, "name": name, "room": roomName})
+
+    # Delivers a message to the local receivers and passes the rest on towards their servers.
+    # Every server the message reaches that has the room keeps a room message in its history,
+    # a private message is indexed by the target's server
+    def deliver(self, link, event):
+        local = []
+        forward = {}
+        for name in event["to"]:
+            target = self.nicknames.get(name)
+            if isinstance(target, RemoteClient):
+                if target.link is not link:
+                    forward.setdefault(target.link, []).append(name)
+            elif target in self.connections:
+                local.append(target)
+        IRCServer.broadcast(self, local, event["message"], extra=event["extra"])
+        record = event["record"]
+        if record is not None and (record["room"] is not None or local):
+            self.recordMessage(record)
+        for other, names in forward.items():
+            other.send(dict(event, to=names))
+
+    # Removes a remote client from its rooms and from the list of clients
+    def dropRemote(self, remote):
+        for roomName in remote.rooms:
+            room = self.rooms.get(roomName)
+            if room is not None:
+                room.roomClients.pop(remote, None)
+                if not room.roomClients:
+                    self.removeRoom(room)
+        if self.nicknames.get(remote.name) is remote:
+            del self.nicknames[remote.name]
+        self.clients.pop(remote, None)
+
+    # Handles one event received over a link. Events that changed what this server
+    # knows are passed on over the other links; an event that changed nothing has
+    # been seen before, which keeps events from circling if the links form a loop
+    def handleEvent(self, link, event):
+        kind = event["event"]
+        if kind == "deliver":
+            self.deliver(link, event)
+        elif kind == "sync":
+            self.syncLink(link)
+        elif self.applyEvent(link, event):
+            self.publish(event, link)
+
+    # Applies a presence or membership event, returns True if anything changed
+    def applyEvent(self, link, event):
+        kind = event["event"]
+        if kind == "down":
+            gone = [c for c in self.clients if isinstance(c, RemoteClient) and c.server == event["server"]]
+            for remote in gone:
+                self.dropRemote(remote)
+            return bool(gone)
+
+        name = event["name"]
+        remote = self.nicknames.get(name)
+        if kind == "nick":
+            previous = self.nicknames.get(event["old"]) if event["old"] else None
+            if isinstance(previous, RemoteClient) and previous.server == event["server"]:
+                # Renamed, the client keeps its rooms
+                del self.nicknames[previous.name]
+                previous.name = name
+                remote = previous
+            elif remote is not None:
+                # Already known, or the name is in use here. Names are claimed without
+                # a global lock, a client taking the same name elsewhere at the same
+                # moment stays invisible to this server
+                return False
+            else:
+                remote = RemoteClient(name, event["server"], link)
+            self.clients[remote] = name
+            self.nicknames[name] = remote
+            return True
+
+        if not isinstance(remote, RemoteClient) or remote.server != event["server"]:
+            return False
+        if kind == "quit":
+            self.dropRemote(remote)
+        elif kind == "join":
+            if event["room"] in remote.rooms:
+                return False
+            room = self.rooms.get(event["room"])
+            if room is None:
+                room = self.createRoom(event["room"])
+            room.roomClients[remote] = name
+            remote.rooms.add(room.name)
+        elif kind == "leave":
+            if event["room"] not in remote.rooms:
+                return False
+            room = self.rooms.get(event["room"])
+            remote.rooms.discard(event["room"])
+            if room is not None:
+                room.roomClients.pop(remote, None)
+                if not room.roomClients:
+                    self.removeRoom(room)
+        return True
+
+    # Forgets every client reached over a link that went down and tells the other links
+    def linkDown(self, link):
+        link.close()
+        del self.links[link.socket]
+        for remote in [c for c in self.clients if isinstance(c, RemoteClient) and c.link is link]:
+            self.dropRemote(remote)
+            self.publish({"event": "quit", "server": remote.server, "name": remote.name})
+        log.info("link_closed", link=link.name)
+
+    # Handles a ready link socket
+    def handleLink(self, s, mask):
+        link = self.links[s]
+        if mask & selectors.EVENT_WRITE:
+            link.flush()
+        if mask & selectors.EVENT_READ:
+            try:
+                events = link.receive()
+            except (BlockingIOError, InterruptedError):
+                return
+            except (socket.error, ValueError):
+                events = None
+            if events is None:
+                self.linkDown(link)
+                return
+            for data in events:
+                # A peer sending an event this server cannot handle is cut off, not the server
+                try:
+                    event = json.loads(bytes(data).decode('UTF-8'))
+                    check_event(event)
+                    self.handleEvent(link, event)
+                except (KeyError, TypeError, ValueError) as e:
+                    log.warning("link_error", link=link.name, error=e)
+                    self.linkDown(link)
+                    return
+#--------------------------------------------------------------------#
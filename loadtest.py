@@ -0,0 +1,484 @@
+#####################################################################
+#                    Haritha Munagala, Susham Yerabolu              #
+#                    CS 594 Internetworking Protocols               #
+#                             Spring 2018                           #
+#                          Load Generator                           #
+#####################################################################
+
+#--------------------------------------------------------------------#
+# Python Imports
+import os
+import sys
+import json
+import time
+import heapq
+import random
+import socket
+import argparse
+import selectors
+import subprocess
+import multiprocessing
+from array import array
+import CONSTANTS
+import framing
+import cryptosession
+import filetransfer
+import codec
+import compression
+from client import decode_message
+#--------------------------------------------------------------------#
+
+# Every benchmark message starts with the marker, the send time (time.monotonic_ns, which
+# all processes on the host share) and the sender's index: "bench@<ns>@<index> xxxx"
+MARKER = "bench@"
+
+# Seconds allowed for the server to start listening when the benchmark starts it
+SERVER_START_TIMEOUT = 10
+
+# Value at a quantile of sorted samples
+def quantile(samples, fraction):
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+# Nanoseconds to milliseconds, rounded for the results file
+def ms(ns):
+    return None if ns is None else round(ns / 1e6, 3)
+
+# Name of simulated client number index
+def client_name(index):
+    return "bench" + str(index)
+
+# Rooms simulated client number index joins. With the zipf distribution a few rooms get
+# most of the members, like popular channels; uniform spreads the members evenly
+def client_rooms(index, options):
+    rng = random.Random(options.seed * 1000003 + index)
+    count = min(options.rooms_per_client, options.rooms)
+    if options.room_dist == "zipf":
+        weights = [1.0 / (rank + 1) ** options.zipf_s for rank in range(options.rooms)]
+        rooms = set()
+        while len(rooms) < count:
+            rooms.add(rng.choices(range(options.rooms), weights)[0])
+        rooms = sorted(rooms)
+    else:
+        rooms = rng.sample(range(options.rooms), count)
+    return ["room" + str(room) for room in rooms]
+
+#--------------------------------------------------------------------#
+# Benchmark Statistics
+# What one process measured; the parent adds them up.
+#--------------------------------------------------------------------#
+class BenchStats():
+    def __init__(self):
+        self.sent = {"MR": 0, "PM": 0, "SFR": 0}
+        self.delivered = 0 # Benchmark messages received
+        self.latencies = array('q') # Nanoseconds from sending to receiving each message
+        self.fileLatencies = array('q') # Nanoseconds from announcing a file to receiving its last chunk
+        self.fileBytes = 0 # File bytes received
+        self.setupErrors = 0 # Rooms a client could not join
+        self.disconnects = 0 # Clients the server disconnected
+        self.throttled = 0 # Commands the server turned away for going over a rate limit
+
+    # Plain values, to send the statistics to the parent process
+    def export(self):
+        return {"sent": self.sent, "delivered": self.delivered, "latencies": self.latencies.tobytes(), "file_latencies": self.fileLatencies.tobytes(),
+                "file_bytes": self.fileBytes, "setup_errors": self.setupErrors, "disconnects": self.disconnects, "throttled": self.throttled}
+#--------------------------------------------------------------------#
+
+#--------------------------------------------------------------------#
+# Simulated Client
+# Speaks the same protocol as client.py: the hello offering codecs and
+# compression, then framed, compressed and encrypted commands, and file
+# chunks encrypted end to end. The handshake blocks; afterwards the
+# socket is non-blocking and driven by the benchmark's selector loop.
+#--------------------------------------------------------------------#
+class SimClient():
+    def __init__(self, index, options, stats):
+        self.index = index
+        self.name = client_name(index)
+        self.options = options
+        self.stats = stats
+        self.socket = socket.create_connection((options.host, options.port))
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.frameBuffer = framing.FrameBuffer(4096)
+        self.outBuffer = bytearray()
+        self.events = selectors.EVENT_READ
+        self.pending = None # Replies the setup is waiting for
+        self.reply = None # Which of them arrived
+        self.outgoingFiles = {} # Nonce -> name of the files announced
+        self.incomingFiles = {} # Transfer id -> [chunks still to come, announce time]
+        self.closed = False
+        self.startSession()
+
+    # Exchanges hellos with the server, like IRCClient.startSession
+    def startSession(self):
+        self.session = cryptosession.CryptoSession(self.options.crypto)
+        codecs = [self.options.codec] if self.options.codec == codec.JSON else [self.options.codec, codec.JSON]
+        offer = [] if self.options.no_compression else compression.offer()
+        self.socket.sendall(framing.frame(cryptosession.make_hello(dict(self.session.hello(), codecs=codecs, compression=offer))))
+        hello = []
+        while not hello:
+            if not self.frameBuffer.recvFrom(self.socket):
+                raise ConnectionError("Server closed the connection during the hello")
+            hello = self.frameBuffer.frames()
+        hello = cryptosession.read_hello(hello[0][1])
+        self.session.start(hello["nonce"])
+        self.codec = hello.get("codec", codec.JSON)
+        self.compression = compression.CompressionStream() if hello.get("compression") is not None else None
+        self.socket.setblocking(False)
+
+    # Encodes, compresses, encrypts and queues one command
+    def send(self, serverMsg):
+        data = codec.encode(self.codec, serverMsg)
+        if self.compression is not None:
+            data = self.compression.compress(data)
+        self.sendFrame(framing.frame(self.session.encrypt(data)))
+
+    # Queues a frame and sends what the socket accepts
+    def sendFrame(self, frame):
+        self.outBuffer += frame
+        self.flush()
+
+    def flush(self):
+        try:
+            sent = self.socket.send(self.outBuffer)
+        except (BlockingIOError, InterruptedError):
+            return
+        except socket.error:
+            self.close()
+            return
+        del self.outBuffer[:sent]
+
+    # Reads what is available and handles every complete frame
+    def receive(self):
+        try:
+            received = self.frameBuffer.recvFrom(self.socket)
+        except (BlockingIOError, InterruptedError):
+            return
+        except socket.error:
+            received = 0
+        if not received:
+            self.close()
+            return
+        for kind, data in self.frameBuffer.frames():
+            if kind == framing.DATA or kind == framing.DEFLATED_DATA:
+                self.receiveChunk(data)
+                continue
+            data = self.session.decrypt(data)
+            if self.compression is not None:
+                data = self.compression.decompress(data)
+            self.handle(decode_message(self.codec, data))
+
+    # Handles one message from the server
+    def handle(self, jsonData):
+        message = jsonData["message"]
+        # Room history repeats messages sent long ago, possibly by an earlier run
+        marker = message.find(MARKER) if "history" not in jsonData else -1
+        if marker != -1:
+            stamp = message[marker + len(MARKER):message.index("@", marker + len(MARKER))]
+            self.stats.latencies.append(time.monotonic_ns() - int(stamp))
+            self.stats.delivered += 1
+        elif "throttled" in jsonData:
+            self.stats.throttled += 1
+        elif "ping" in jsonData:
+            self.send({"command": "PO", "ping": jsonData["ping"]})
+        elif "send_file" in jsonData:
+            self.sendChunks(jsonData["file_nonce"], jsonData["transfer"], jsonData["chunks"], jsonData["chunk_size"])
+        elif "file" in jsonData:
+            info = jsonData["file"]
+            count = filetransfer.chunk_count(info["size"], info["chunk_size"])
+            # The send time is part of the file name
+            self.incomingFiles[info["transfer"]] = [count, int(info["name"].split("-")[1])]
+            self.send({"command": "FR", "transfer": info["transfer"], "missing": [[0, count]] if count else []})
+        elif self.pending is not None:
+            for reply in self.pending:
+                if reply in message:
+                    self.reply = reply
+                    self.pending = None
+                    break
+
+    # Counts one received file chunk, the file is done once all its chunks arrived
+    def receiveChunk(self, data):
+        transferId, seq = filetransfer.CHUNK.unpack_from(data)
+        self.stats.fileBytes += len(data) - filetransfer.CHUNK.size - filetransfer.DIGEST_SIZE
+        incoming = self.incomingFiles.get(transferId)
+        if incoming is not None:
+            incoming[0] -= 1
+            if incoming[0] <= 0:
+                self.stats.fileLatencies.append(time.monotonic_ns() - incoming[1])
+                del self.incomingFiles[transferId]
+
+    # Sends the requested chunks of a generated file, encrypted end to end like client.py does
+    def sendChunks(self, nonce, transferId, chunks, chunkSize):
+        if self.outgoingFiles.pop(nonce, None) is None:
+            return
+        payload = self.options.filePayload
+        for start, end in chunks:
+            for seq in range(start, end):
+                data = cryptosession.file_cipher(nonce, seq * chunkSize).encrypt(payload[seq * chunkSize:(seq + 1) * chunkSize])
+                header = filetransfer.CHUNK.pack(transferId, seq) + filetransfer.chunk_digest(data)
+                self.sendFrame(framing.frame(header + data, framing.DATA))
+
+    # Message text with the send time, padded to the configured size
+    def text(self):
+        text = MARKER + str(time.monotonic_ns()) + "@" + str(self.index) + " "
+        return text + "x" * max(0, self.options.message_size - len(text))
+
+    # Sends one message of the mix: a file, a private message or a room message
+    def sendNext(self, rng):
+        options = self.options
+        draw = rng.random()
+        if draw < options.file_fraction and options.file_size:
+            name = "file-" + str(time.monotonic_ns()) + "-" + str(self.index)
+            nonce = cryptosession.new_file_nonce()
+            self.outgoingFiles[nonce] = name
+            self.send({"command": "SFR", "target": rng.choice(self.rooms), "file_name": name, "file_size": options.file_size,
+                       "file_nonce": nonce, "file_hash": options.fileHash, "chunk_size": CONSTANTS.FILE_CHUNK_SIZE})
+            self.stats.sent["SFR"] += 1
+        elif draw < options.file_fraction + options.pm_fraction and options.clients > 1:
+            target = rng.randrange(options.clients - 1)
+            self.send({"command": "PM", "target": client_name(target if target < self.index else target + 1), "message": self.text()})
+            self.stats.sent["PM"] += 1
+        else:
+            self.send({"command": "MR", "roomname": rng.choice(self.rooms), "message": self.text()})
+            self.stats.sent["MR"] += 1
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.stats.disconnects += 1
+            self.socket.close()
+#--------------------------------------------------------------------#
+
+#--------------------------------------------------------------------#
+# Benchmark Process
+# Runs a share of the simulated clients on one selector loop.
+#--------------------------------------------------------------------#
+class BenchProcess():
+    def __init__(self, options, indices):
+        self.options = options
+        self.indices = indices
+        self.stats = BenchStats()
+        self.selector = selectors.DefaultSelector()
+        self.clients = []
+
+    # Handles every ready socket for up to timeout seconds
+    def poll(self, timeout):
+        for key, mask in self.selector.select(timeout):
+            client = key.data
+            if client.closed:
+                continue
+            if mask & selectors.EVENT_WRITE:
+                client.flush()
+            if mask & selectors.EVENT_READ and not client.closed:
+                client.receive()
+        for client in self.clients:
+            if client.closed:
+                if client.events:
+                    self.selector.unregister(client.socket)
+                    client.events = 0
+                continue
+            events = selectors.EVENT_READ | (selectors.EVENT_WRITE if client.outBuffer else 0)
+            if events != client.events:
+                self.selector.modify(client.socket, events, client)
+                client.events = events
+
+    # Sends a command on every client and keeps polling until each got one of the replies.
+    # Returns the clients that got the given reply
+    def awaitReplies(self, clients, command, replies, wanted):
+        for client in clients:
+            client.pending = replies
+            client.reply = None
+            client.send(command(client))
+        deadline = time.monotonic() + self.options.setup_timeout
+        while any(client.pending and not client.closed for client in clients) and time.monotonic() < deadline:
+            self.poll(0.05)
+        return [client for client in clients if client.reply == wanted]
+
+    # Connects, names and joins the clients, creating rooms that do not exist yet
+    def setup(self):
+        for index in self.indices:
+            client = SimClient(index, self.options, self.stats)
+            client.rooms = client_rooms(index, self.options)
+            self.selector.register(client.socket, selectors.EVENT_READ, client)
+            self.clients.append(client)
+        named = self.awaitReplies(self.clients, lambda client: {"command": "NN", "name": client.name}, ("Connected to server", "Name already in use"), "Connected to server")
+        self.stats.setupErrors += len(self.clients) - len(named)
+        for position in range(self.options.rooms_per_client):
+            waiting = [client for client in named if position < len(client.rooms)]
+            failed = 0
+            for attempt in range(3):
+                if not waiting:
+                    break
+                # A room nobody is in yet has to be created; a client in another process may create it first
+                joined = self.awaitReplies(waiting, lambda client: {"command": "JR", "roomname": client.rooms[position]}, ("successfully joined", "Unable to join"), "successfully joined")
+                missing = [client for client in waiting if client.reply == "Unable to join"]
+                failed += len(waiting) - len(joined) - len(missing)
+                self.awaitReplies(missing, lambda client: {"command": "CR", "roomname": client.rooms[position]}, ("Room created", "already taken"), "Room created")
+                waiting = [client for client in missing if client.reply == "already taken"]
+                failed += len([client for client in missing if client.reply is None])
+            self.stats.setupErrors += failed + len(waiting)
+
+    # Sends the traffic mix at the configured rate for the duration, then waits for what is in flight
+    def run(self, start):
+        options = self.options
+        rng = random.Random(options.seed + self.indices[0])
+        # Poisson arrivals for every client, driven by a heap of send times
+        timers = []
+        if options.rate:
+            for position, client in enumerate(self.clients):
+                heapq.heappush(timers, (start + rng.expovariate(options.rate), position))
+        end = start + options.duration
+        while True:
+            now = time.monotonic()
+            if now >= end:
+                break
+            while timers and timers[0][0] <= now:
+                due, position = heapq.heappop(timers)
+                client = self.clients[position]
+                if not client.closed and client.rooms:
+                    client.sendNext(rng)
+                heapq.heappush(timers, (due + rng.expovariate(options.rate), position))
+            self.poll(max(0, min(timers[0][0] if timers else end, end) - time.monotonic()))
+        drain = time.monotonic() + options.drain
+        while time.monotonic() < drain:
+            self.poll(0.05)
+        for client in self.clients:
+            if not client.closed:
+                client.closed = True
+                client.socket.close()
+#--------------------------------------------------------------------#
+
+# Runs one benchmark process and hands its statistics to the parent
+def run_process(options, indices, barrier, results):
+    process = BenchProcess(options, indices)
+    try:
+        process.setup()
+        barrier.wait()
+        process.run(time.monotonic())
+    finally:
+        results.put(process.stats.export())
+
+# Starts a server on the benchmark's port in a child process and waits until it accepts connections
+def start_server(options):
+    if options.server == "async":
+        code = "import sys, asyncserver; asyncserver.AsyncIRCServer(sys.argv[1], int(sys.argv[2])).run()"
+    else:
+        code = "import sys, server; server.IRCServer(sys.argv[1], int(sys.argv[2])).run()"
+    process = subprocess.Popen([sys.executable, "-c", code, options.host, str(options.port)], cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((options.host, options.port), 1).close()
+            return process
+        except socket.error:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Server did not start listening on port " + str(options.port))
+
+# Adds up the statistics of every process into the results written to JSON
+def summarize(options, exported, elapsed):
+    latencies = array('q')
+    fileLatencies = array('q')
+    sent = {"MR": 0, "PM": 0, "SFR": 0}
+    totals = {"delivered": 0, "file_bytes": 0, "setup_errors": 0, "disconnects": 0, "throttled": 0}
+    for stats in exported:
+        latencies.frombytes(stats["latencies"])
+        fileLatencies.frombytes(stats["file_latencies"])
+        for command, count in stats["sent"].items():
+            sent[command] += count
+        for key in totals:
+            totals[key] += stats[key]
+    latencies = sorted(latencies)
+    fileLatencies = sorted(fileLatencies)
+    config = dict((key, value) for key, value in vars(options).items() if key not in ("filePayload", "fileHash", "output"))
+    config.update({"crypto_mode": options.crypto, "compression": None if options.no_compression else (CONSTANTS.COMPRESSION or None)})
+    return {
+        "benchmark": "loadtest",
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime()),
+        "host": socket.gethostname(),
+        "python": sys.version.split()[0],
+        "config": config,
+        "elapsed_seconds": round(elapsed, 3),
+        "sent": sent,
+        "sent_per_second": round(sum(sent.values()) / options.duration, 1),
+        "delivered": totals["delivered"],
+        "delivered_per_second": round(totals["delivered"] / options.duration, 1),
+        "latency_ms": {"p50": ms(quantile(latencies, 0.5)), "p99": ms(quantile(latencies, 0.99)), "p999": ms(quantile(latencies, 0.999)),
+                       "max": ms(latencies[-1] if latencies else None), "mean": ms(sum(latencies) / len(latencies) if latencies else None)},
+        "files_received": len(fileLatencies),
+        "file_bytes_per_second": round(totals["file_bytes"] / options.duration, 1),
+        "file_latency_ms": {"p50": ms(quantile(fileLatencies, 0.5)), "p99": ms(quantile(fileLatencies, 0.99)), "max": ms(fileLatencies[-1] if fileLatencies else None)},
+        "setup_errors": totals["setup_errors"],
+        "disconnects": totals["disconnects"],
+        "throttled": totals["throttled"],
+    }
+
+#--------------------------------------------------------------------#
+# Main function
+# Usage: python loadtest.py [options], see --help. Opens --clients
+# simulated clients against a server on localhost (or starts one with
+# --server) and writes the results to a JSON file.
+#--------------------------------------------------------------------#
+def main():
+    parser = argparse.ArgumentParser(description="Drives simulated IRC clients against a server and measures throughput and delivery latency.")
+    parser.add_argument("--host", default=CONSTANTS.HOST)
+    parser.add_argument("--port", type=int, default=CONSTANTS.PORT)
+    parser.add_argument("--server", choices=("none", "selector", "async"), default="none", help="start a server for the run (default: use a running one)")
+    parser.add_argument("--clients", type=int, default=100, help="simulated clients")
+    parser.add_argument("--processes", type=int, default=1, help="processes the clients are spread over")
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--rooms-per-client", type=int, default=1)
+    parser.add_argument("--room-dist", choices=("uniform", "zipf"), default="uniform", help="how members are spread over the rooms")
+    parser.add_argument("--zipf-s", type=float, default=1.0, help="exponent of the zipf room distribution")
+    parser.add_argument("--rate", type=float, default=1.0, help="messages per second sent by each client")
+    parser.add_argument("--pm-fraction", type=float, default=0.1, help="share of the messages sent as PM")
+    parser.add_argument("--file-fraction", type=float, default=0.0, help="share of the messages sent as SFR")
+    parser.add_argument("--file-size", type=int, default=65536, help="bytes per file sent with SFR")
+    parser.add_argument("--message-size", type=int, default=64, help="characters per message")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of traffic")
+    parser.add_argument("--drain", type=float, default=2.0, help="seconds to wait for messages in flight")
+    parser.add_argument("--setup-timeout", type=float, default=30.0, help="seconds to wait for each setup step")
+    parser.add_argument("--crypto", choices=CONSTANTS.CRYPTO_MODES, default=CONSTANTS.CRYPTO_MODE)
+    parser.add_argument("--codec", choices=codec.CODECS, default=CONSTANTS.CODEC)
+    parser.add_argument("--no-compression", action="store_true", help="do not offer compression")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="results file (default: loadtest-<time>.json)")
+    options = parser.parse_args()
+
+    # Every file sent is the same generated payload, compressible like text
+    rng = random.Random(options.seed)
+    words = [bytes(rng.choice(b"abcdefghijklmnopqrstuvwxyz") for i in range(rng.randint(2, 9))) for j in range(512)]
+    payload = bytearray()
+    while len(payload) < options.file_size:
+        payload += rng.choice(words) + b" "
+    options.filePayload = bytes(payload[:options.file_size])
+    options.fileHash = filetransfer.chunk_digest(options.filePayload).hex()
+
+    server = start_server(options) if options.server != "none" else None
+    try:
+        processes = max(1, min(options.processes, options.clients))
+        barrier = multiprocessing.Barrier(processes)
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=run_process, args=(options, list(range(i, options.clients, processes)), barrier, results)) for i in range(processes)]
+        started = time.monotonic()
+        for worker in workers:
+            worker.start()
+        exported = [results.get() for worker in workers]
+        for worker in workers:
+            worker.join()
+        elapsed = time.monotonic() - started
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    summary = summarize(options, exported, elapsed)
+    path = options.output or "loadtest-" + time.strftime("%Y%m%d-%H%M%S") + ".json"
+    with open(path, 'w') as f:
+        json.dump(summary, f, indent=2)
+    print(json.dumps(dict((key, summary[key]) for key in ("sent_per_second", "delivered_per_second", "latency_ms", "setup_errors", "disconnects", "throttled")), indent=2))
+    print("Results written to " + path)
+
+if __name__ == "__main__":
+    main()
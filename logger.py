@@ -0,0 +1,133 @@
+#####################################################################
+#                    Haritha Munagala, Susham Yerabolu              #
+#                    CS 594 Internetworking Protocols               #
+#                             Spring 2018                           #
+#                              Logging                              #
+#####################################################################
+
+#--------------------------------------------------------------------#
+# Python Imports
+import os
+import sys
+import time
+import queue
+import atexit
+import threading
+import CONSTANTS
+#--------------------------------------------------------------------#
+
+# Log levels, a record is written if its level is at least LOG_LEVEL
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVELS = {"DEBUG": DEBUG, "INFO": INFO, "WARNING": WARNING, "ERROR": ERROR}
+NAMES = dict((level, name) for name, level in LEVELS.items())
+
+# Seconds the writer is given to drain the queue when the process exits
+EXIT_TIMEOUT = 1
+
+# Turns the fields of a record into one line of key=value pairs
+def format_record(stamp, level, event, fields):
+    line = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(stamp)) + ".%03d" % (stamp % 1 * 1000) + " " + NAMES[level] + " " + event
+    for key, value in fields.items():
+        line += " " + key + "=" + str(value)
+    return line + "\n"
+
+#--------------------------------------------------------------------#
+# Logger
+# Records are events with keyword fields. The calling thread only
+# checks the level and the event's sample rate and puts the record on a
+# queue; a background thread formats and writes it, so the event loop
+# never waits on stdout or a file. Fields are formatted by the writer,
+# callers should pass values instead of building strings.
+# An event with a sample rate N in LOG_SAMPLE is written once every N
+# times it happens. When the queue is full records are dropped and
+# counted rather than blocking the caller.
+#--------------------------------------------------------------------#
+class Logger():
+    def __init__(self, level, path=None, sample=None, queueSize=0):
+        self.level = level
+        self.path = path #File records are appended to, None for stdout
+        self.sample = dict(sample or {}) #Event -> write one in this many
+        self.counts = {} #Event -> times a sampled event happened
+        self.queueSize = queueSize
+        self.dropped = 0 #Records dropped because the queue was full
+        self.pid = None #Process the writer thread runs in
+        self.queue = None
+        self.writer = None
+
+    # Whether records of a level are written at all, lets callers skip work for disabled levels
+    def enabled(self, level):
+        return level >= self.level
+
+    # Starts the writer thread, again in a process forked after it was started
+    def start(self):
+        self.pid = os.getpid()
+        self.queue = queue.Queue(self.queueSize)
+        self.writer = threading.Thread(target=self.write, name="logger", daemon=True)
+        self.writer.start()
+
+    # Queues a record if its level is enabled and its event is sampled
+    def log(self, level, event, fields):
+        if level < self.level:
+            return
+        rate = self.sample.get(event)
+        if rate:
+            count = self.counts.get(event, 0)
+            self.counts[event] = count + 1
+            if count % rate:
+                return
+            fields["sampled"] = rate
+        if self.pid != os.getpid():
+            self.start()
+        try:
+            self.queue.put_nowait((time.time(), level, event, fields))
+        except queue.Full:
+            self.dropped += 1
+
+    def debug(self, event, **fields):
+        self.log(DEBUG, event, fields)
+
+    def info(self, event, **fields):
+        self.log(INFO, event, fields)
+
+    def warning(self, event, **fields):
+        self.log(WARNING, event, fields)
+
+    def error(self, event, **fields):
+        self.log(ERROR, event, fields)
+
+    # Writer thread, formats and writes records until it is handed None
+    def write(self):
+        records = self.queue
+        stream = open(self.path, 'a') if self.path else sys.stdout
+        dropped = 0
+        while True:
+            record = records.get()
+            if record is None:
+                break
+            if self.dropped != dropped:
+                stream.write(format_record(record[0], WARNING, "log_dropped", {"records": self.dropped - dropped}))
+                dropped = self.dropped
+            stream.write(format_record(*record))
+            # Flush once the queue is empty, not after every record
+            if records.empty():
+                stream.flush()
+        stream.flush()
+        if stream is not sys.stdout:
+            stream.close()
+
+    # Writes out what is still queued, called when the process exits
+    def close(self):
+        if self.pid == os.getpid() and self.writer.is_alive():
+            try:
+                self.queue.put(None, timeout=EXIT_TIMEOUT)
+                self.writer.join(EXIT_TIMEOUT)
+            except queue.Full:
+                pass
+#--------------------------------------------------------------------#
+
+# The logger of the server process, set up from CONSTANTS.py
+log = Logger(LEVELS[CONSTANTS.LOG_LEVEL], CONSTANTS.LOG_FILE or None, CONSTANTS.LOG_SAMPLE, CONSTANTS.LOG_QUEUE_SIZE)
+atexit.register(log.close)
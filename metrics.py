@@ -0,0 +1,242 @@
+#####################################################################
+#                    Haritha Munagala, Susham Yerabolu              #
+#                    CS 594 Internetworking Protocols               #
+#                             Spring 2018                           #
+#                              Metrics                              #
+#####################################################################
+
+#--------------------------------------------------------------------#
+# Python Imports
+import time
+import bisect
+import socket
+import selectors
+#--------------------------------------------------------------------#
+
+# Commands counted under their own code, anything else is counted as "invalid"
+COMMANDS = ("NN", "LR", "CR", "JR", "LER", "LC", "LRC", "MR", "PM", "RH", "SR", "SFR", "SFP", "FR", "ST", "PO")
+
+# Rate limits counted when they turn a command away
+LIMITS = ("client", "chat", "list", "file", "other", "room")
+
+# Upper bounds of the histogram buckets
+SECONDS = tuple(0.000001 * 2 ** i for i in range(22)) # 1 microsecond to about 2 seconds
+RECEIVERS = tuple(2 ** i for i in range(13)) # 1 to 4096 receivers
+
+# Longest HTTP request read from a scraper
+MAX_REQUEST_SIZE = 8192
+
+#--------------------------------------------------------------------#
+# Histogram
+# Counts observations in fixed buckets, like a Prometheus histogram.
+# Counts are kept per bucket and only made cumulative when rendered.
+#--------------------------------------------------------------------#
+class Histogram():
+    __slots__ = ('bounds', 'counts', 'total', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1) # The last bucket holds everything above the bounds
+        self.total = 0 # Sum of the observed values
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+
+    # Smallest bucket bound below which the given fraction of observations fall
+    def quantile(self, fraction):
+        if not self.count:
+            return 0
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= fraction * self.count:
+                return self.bounds[i] if i < len(self.bounds) else float('inf')
+
+    # Lines of the Prometheus text format, labels is '' or 'key="value",'
+    def exposition(self, name, labels=""):
+        lines = []
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            lines.append(name + '_bucket{' + labels + 'le="' + "%g" % bound + '"} ' + str(seen))
+        lines.append(name + '_bucket{' + labels + 'le="+Inf"} ' + str(self.count))
+        braces = '{' + labels.rstrip(',') + '}' if labels else ''
+        lines.append(name + '_sum' + braces + ' ' + repr(self.total))
+        lines.append(name + '_count' + braces + ' ' + str(self.count))
+        return lines
+#--------------------------------------------------------------------#
+
+#--------------------------------------------------------------------#
+# Metrics
+# Counters and histograms of one server. Counters are plain integers,
+# always kept. Histograms need the time taken around every command and
+# every encryption, so they are only kept once someone reads the
+# metrics (the ST command or the HTTP endpoint); until then `timing` is
+# False and the server skips the clock calls. Gauges such as queue
+# depths are not kept at all, the server works them out when read.
+#--------------------------------------------------------------------#
+class Metrics():
+    def __init__(self, timing=False):
+        self.started = time.time()
+        self.timing = timing # Histograms are being kept
+        self.commands = dict((command, 0) for command in COMMANDS + ("invalid",)) # Commands handled
+        self.commandSeconds = dict((command, Histogram(SECONDS)) for command in self.commands) # Time to handle each command
+        self.fanout = Histogram(RECEIVERS) # Receivers of each broadcast
+        self.encryptSeconds = Histogram(SECONDS) # Time to compress and encrypt one message
+        self.decryptSeconds = Histogram(SECONDS) # Time to decrypt and decompress one message
+        self.bytesIn = 0 # Bytes read from clients
+        self.bytesOut = 0 # Bytes queued for clients
+        self.framesIn = 0
+        self.framesOut = 0
+        self.writes = 0 # System calls writing to clients, each may carry several frames
+        self.broadcasts = 0
+        self.fileBytes = 0 # File bytes relayed to receivers
+        self.fileChunks = 0 # File chunks received from senders
+        self.slowConsumers = 0 # Times a client's outbound queue was full
+        self.reaped = 0 # Clients disconnected for not answering a ping or idling
+        self.limited = dict((limit, 0) for limit in LIMITS) # Commands turned away by each rate limit
+
+    # Label of a command code
+    def command(self, command):
+        return command if command in self.commandSeconds else "invalid"
+
+    # Text shown by the ST command, from the counters and the gauges worked out by the server
+    def summary(self, gauges):
+        uptime = max(time.time() - self.started, 0.001)
+        handled = sum(self.commands.values())
+        lines = ["Uptime: %.0f s" % uptime, "Commands: " + str(handled) + " (%.1f/s)" % (handled / uptime)]
+        for command, count in self.commands.items():
+            if count:
+                latency = self.commandSeconds[command]
+                line = command + ": " + str(count)
+                if latency.count:
+                    line += ", p50 %.0f us, p99 %.0f us" % (latency.quantile(0.5) * 1e6, latency.quantile(0.99) * 1e6)
+                lines.append(line)
+        lines.append("Bytes in/out: " + str(self.bytesIn) + " / " + str(self.bytesOut))
+        lines.append("Frames in/out: " + str(self.framesIn) + " / " + str(self.framesOut))
+        lines.append("Socket writes: " + str(self.writes) + (" (%.1f frames each)" % (self.framesOut / self.writes) if self.writes else ""))
+        lines.append("Broadcasts: " + str(self.broadcasts) + (", p99 fan-out " + str(self.fanout.quantile(0.99)) if self.fanout.count else ""))
+        if self.encryptSeconds.count:
+            lines.append("Encryption: %.1f us average" % (self.encryptSeconds.total / self.encryptSeconds.count * 1e6))
+        lines.append("File chunks/bytes relayed: " + str(self.fileChunks) + " / " + str(self.fileBytes))
+        lines.append("Slow consumers: " + str(self.slowConsumers))
+        lines.append("Reaped connections: " + str(self.reaped))
+        lines.append("Rate limited: " + ", ".join(limit + " " + str(count) for limit, count in self.limited.items()))
+        for name, value in gauges:
+            lines.append(name.replace("_", " ").capitalize() + ": " + str(value))
+        return "\n\t".join(lines)
+
+    # Everything in the Prometheus text exposition format
+    def exposition(self, gauges):
+        lines = []
+        def counter(name, value, help):
+            lines.extend(["# HELP irc_" + name + " " + help, "# TYPE irc_" + name + " counter", "irc_" + name + " " + str(value)])
+        lines.extend(["# HELP irc_commands_total Commands handled", "# TYPE irc_commands_total counter"])
+        for command, count in self.commands.items():
+            lines.append('irc_commands_total{command="' + command + '"} ' + str(count))
+        lines.extend(["# HELP irc_command_seconds Time to handle a command", "# TYPE irc_command_seconds histogram"])
+        for command, latency in self.commandSeconds.items():
+            if latency.count:
+                lines.extend(latency.exposition("irc_command_seconds", 'command="' + command + '",'))
+        counter("received_bytes_total", self.bytesIn, "Bytes read from clients")
+        counter("sent_bytes_total", self.bytesOut, "Bytes queued for clients")
+        counter("received_frames_total", self.framesIn, "Frames read from clients")
+        counter("sent_frames_total", self.framesOut, "Frames queued for clients")
+        counter("socket_writes_total", self.writes, "System calls writing to clients")
+        counter("broadcasts_total", self.broadcasts, "Messages sent to several clients")
+        counter("file_bytes_total", self.fileBytes, "File bytes relayed to receivers")
+        counter("file_chunks_total", self.fileChunks, "File chunks received from senders")
+        counter("slow_consumers_total", self.slowConsumers, "Times a client's outbound queue was full")
+        counter("reaped_connections_total", self.reaped, "Clients disconnected for not answering a ping or idling")
+        lines.extend(["# HELP irc_rate_limited_total Commands turned away by a rate limit", "# TYPE irc_rate_limited_total counter"])
+        for limit, count in self.limited.items():
+            lines.append('irc_rate_limited_total{limit="' + limit + '"} ' + str(count))
+        for name, histogram, help in (("fanout", self.fanout, "Receivers of a broadcast"), ("encrypt_seconds", self.encryptSeconds, "Time to compress and encrypt a message"), ("decrypt_seconds", self.decryptSeconds, "Time to decrypt and decompress a message")):
+            lines.extend(["# HELP irc_" + name + " " + help, "# TYPE irc_" + name + " histogram"])
+            lines.extend(histogram.exposition("irc_" + name))
+        for name, value in gauges:
+            lines.extend(["# TYPE irc_" + name + " gauge", "irc_" + name + " " + str(value)])
+        return "\n".join(lines) + "\n"
+#--------------------------------------------------------------------#
+
+# Answers one HTTP request with the metrics, returns the whole response
+def http_response(request, render):
+    line = bytes(request).split(b"\r\n", 1)[0].split(b" ")
+    if len(line) < 2 or line[0] != b"GET":
+        status, body = "405 Method Not Allowed", "Only GET is supported\n"
+    elif line[1].split(b"?")[0] not in (b"/", b"/metrics"):
+        status, body = "404 Not Found", "Metrics are at /metrics\n"
+    else:
+        status, body = "200 OK", render()
+    body = body.encode('UTF-8')
+    header = "HTTP/1.0 " + status + "\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\nContent-Length: " + str(len(body)) + "\r\nConnection: close\r\n\r\n"
+    return header.encode('ascii') + body
+
+#--------------------------------------------------------------------#
+# Metrics Endpoint
+# A small HTTP server on the selector loop of the IRC server, for
+# Prometheus to scrape. Each connection sends one request and gets one
+# response, written without blocking, then is closed.
+#--------------------------------------------------------------------#
+class MetricsEndpoint():
+    def __init__(self, selector, host, port, render):
+        self.selector = selector
+        self.render = render #Returns the metrics text
+        self.requests = {} #Socket -> bytes of the request read so far
+        self.responses = {} #Socket -> bytes of the response not yet sent
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((host, port))
+        self.socket.listen(socket.SOMAXCONN)
+        self.socket.setblocking(False)
+        self.selector.register(self.socket, selectors.EVENT_READ, self.accept)
+
+    def accept(self, listenSocket, mask):
+        try:
+            s, address = listenSocket.accept()
+        except socket.error:
+            return
+        s.setblocking(False)
+        self.requests[s] = bytearray()
+        self.selector.register(s, selectors.EVENT_READ, self.read)
+
+    # Reads the request, and answers it once it is complete
+    def read(self, s, mask):
+        try:
+            data = s.recv(MAX_REQUEST_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+        except socket.error:
+            data = b""
+        if not data:
+            self.close(s)
+            return
+        request = self.requests[s]
+        request += data
+        if b"\r\n\r\n" in request or len(request) >= MAX_REQUEST_SIZE:
+            del self.requests[s]
+            self.responses[s] = memoryview(http_response(request, self.render))
+            self.selector.modify(s, selectors.EVENT_WRITE, self.write)
+
+    # Sends as much of the response as the socket takes, closing once it is all sent
+    def write(self, s, mask):
+        try:
+            sent = s.send(self.responses[s])
+        except (BlockingIOError, InterruptedError):
+            return
+        except socket.error:
+            self.close(s)
+            return
+        self.responses[s] = self.responses[s][sent:]
+        if not self.responses[s]:
+            self.close(s)
+
+    def close(self, s):
+        self.requests.pop(s, None)
+        self.responses.pop(s, None)
+        self.selector.unregister(s)
+        s.close()
+#--------------------------------------------------------------------#
@@ -0,0 +1,241 @@
+#####################################################################
+#                    Haritha Munagala, Susham Yerabolu              #
+#                    CS 594 Internetworking Protocols               #
+#                             Spring 2018                           #
+#                          Microbenchmarks                          #
+#####################################################################
+
+#--------------------------------------------------------------------#
+# Python Imports
+import sys
+import json
+import time
+import socket
+import timeit
+import argparse
+import statistics
+import CONSTANTS
+import framing
+import cryptosession
+import codec
+import compression
+import server
+from client import decode_message
+#--------------------------------------------------------------------#
+
+# Message sizes and fan-outs every case is run with
+SIZES = (16, 256, 4096, 65536)
+FANOUTS = (1, 10, 100, 1000)
+ROOM_COUNTS = (10, 100, 1000, 10000)
+
+# Seconds each repeat of a case should take, the number of operations is fixed once per case
+REPEAT_SECONDS = 0.05
+
+# Text of a message of the given size, the same for every run
+def message_text(size):
+    text = "The quick brown fox jumps over the lazy dog. "
+    return (text * (size // len(text) + 1))[:size]
+
+# Client and server sessions with each other's nonces, as after the hellos
+def session_pair(mode):
+    client = cryptosession.CryptoSession(mode)
+    peer = cryptosession.CryptoSession(mode)
+    client.start(peer.hello()["nonce"])
+    peer.start(client.hello()["nonce"])
+    return client, peer
+
+#--------------------------------------------------------------------#
+# Null Socket
+# Stands in for a client socket: takes every byte at once, so the send
+# path runs without the kernel and nothing is ever queued.
+#--------------------------------------------------------------------#
+class NullSocket():
+    def send(self, data):
+        return len(data)
+
+    def sendmsg(self, buffers):
+        return sum(len(buffer) for buffer in buffers)
+#--------------------------------------------------------------------#
+
+# Rate limits no benchmark reaches, so commands are checked against them but never turned away
+UNREACHABLE = 1e12
+
+# An IRCServer with no listening socket, history log, search index or statistics timer,
+# holding `clients` connected clients whose sessions use `mode`
+def bench_server(clients, mode):
+    CONSTANTS.STATS_INTERVAL = 0
+    CONSTANTS.CLIENT_RATE_LIMIT = CONSTANTS.CLIENT_BURST = CONSTANTS.ROOM_FANOUT_LIMIT = CONSTANTS.ROOM_FANOUT_BURST = UNREACHABLE
+    CONSTANTS.COMMAND_RATE_LIMITS = dict((name, (UNREACHABLE, UNREACHABLE)) for name in CONSTANTS.COMMAND_RATE_LIMITS)
+    ircServer = server.IRCServer(CONSTANTS.HOST, 0)
+    ircServer.historyDir = None
+    ircServer.searchDir = None
+    ircServer.serverSocket = NullSocket()
+    ircServer.clients[ircServer.serverSocket] = "SERVER"
+    ircServer.nicknames["SERVER"] = ircServer.serverSocket
+    sockets = []
+    for i in range(clients):
+        s = NullSocket()
+        connection = server.IRCConnection(s)
+        connection.session = session_pair(mode)[1]
+        connection.codec = CONSTANTS.CODEC
+        ircServer.connections[s] = connection
+        ircServer.clients[s] = "client" + str(i)
+        ircServer.nicknames["client" + str(i)] = s
+        sockets.append(s)
+    return ircServer, sockets
+
+# The operation followed by the write at the end of the event loop cycle, which sends what it queued
+def cycle(ircServer, operation):
+    def run():
+        operation()
+        ircServer.flushPending()
+    return run
+
+# Puts the clients in a room, created if needed
+def fill_room(ircServer, roomName, sockets):
+    room = ircServer.rooms.get(roomName)
+    if room is None:
+        room = ircServer.rooms[roomName] = server.IRCRoom(roomName)
+    for s in sockets:
+        room.roomClients[s] = ircServer.clients[s]
+        ircServer.connections[s].rooms.add(roomName)
+    return room
+
+# A frame payload the server can handle again and again: CFB sessions are stateless,
+# so one encrypted command decrypts the same way every time
+def replayable_command(ircServer, s, command):
+    client, peer = session_pair("CFB")
+    connection = ircServer.connections[s]
+    connection.session = peer
+    return client.encrypt(codec.encode(connection.codec, command))
+
+#--------------------------------------------------------------------#
+# Cases
+# Each function yields (name, operation) pairs; the operation does the
+# measured work once. Names stay the same across versions so results
+# files can be compared.
+#--------------------------------------------------------------------#
+def codec_cases():
+    for codecName in (codec.JSON, codec.BINARY):
+        for size in SIZES:
+            command = {"command": "MR", "roomname": "room", "message": message_text(size)}
+            reply = {"message": "<SERVER> client in room says: " + message_text(size)}
+            encoded = codec.encode(codecName, reply)
+            yield "codec.encode_command/%s/%dB" % (codecName, size), lambda command=command, codecName=codecName: codec.encode(codecName, command)
+            yield "codec.encode_message/%s/%dB" % (codecName, size), lambda text=reply["message"], codecName=codecName: server.encode_message(codecName, text)
+            yield "codec.decode_message/%s/%dB" % (codecName, size), lambda encoded=encoded, codecName=codecName: decode_message(codecName, encoded)
+
+def crypto_cases():
+    for mode in ("CTR", "GCM", "CFB"):
+        for size in SIZES:
+            data = message_text(size).encode('UTF-8')
+            sender, receiver = session_pair(mode)
+            yield "crypto.encrypt/%s/%dB" % (mode, size), lambda sender=sender, data=data: sender.encrypt(data)
+            if mode == "GCM":
+                # Every GCM message has its own nonce, decrypt the first message over and over
+                sender, receiver = session_pair(mode)
+                ciphertext = sender.encrypt(data)
+                def decrypt(receiver=receiver, ciphertext=ciphertext):
+                    receiver.receiveCount = 0
+                    return receiver.decrypt(ciphertext)
+                yield "crypto.decrypt/%s/%dB" % (mode, size), decrypt
+            else:
+                ciphertext = sender.encrypt(data)
+                yield "crypto.decrypt/%s/%dB" % (mode, size), lambda receiver=receiver, ciphertext=ciphertext: receiver.decrypt(ciphertext)
+
+def compression_cases():
+    for size in SIZES:
+        data = codec.encode(CONSTANTS.CODEC, {"message": "<SERVER> client in room says: " + message_text(size)})
+        stream = compression.CompressionStream()
+        yield "compression.compress/%dB" % size, lambda stream=stream, data=data: stream.compress(data)
+        # A raw message leaves the stream as it was, so the same one can be decompressed again
+        raw = bytes((compression.RAW,)) + data
+        yield "compression.decompress_raw/%dB" % size, lambda stream=stream, raw=raw: stream.decompress(raw)
+
+def send_cases():
+    for mode in ("CTR", "CFB"):
+        for size in SIZES:
+            ircServer, sockets = bench_server(1, mode)
+            text = message_text(size)
+            yield "send.sendMessage/%s/%dB" % (mode, size), cycle(ircServer, lambda ircServer=ircServer, s=sockets[0], text=text: ircServer.sendMessage(s, text))
+
+def broadcast_cases():
+    for mode in ("CTR", "CFB"):
+        for fanout in FANOUTS:
+            ircServer, sockets = bench_server(fanout, mode)
+            text = "<SERVER> client0 in room says: " + message_text(64)
+            yield "broadcast/%s/%d" % (mode, fanout), cycle(ircServer, lambda ircServer=ircServer, sockets=sockets, text=text: ircServer.broadcast(sockets, text))
+
+def dispatch_cases():
+    for fanout in FANOUTS:
+        ircServer, sockets = bench_server(fanout, "CTR")
+        fill_room(ircServer, "room", sockets)
+        data = replayable_command(ircServer, sockets[0], {"command": "MR", "roomname": "room", "message": message_text(64)})
+        yield "dispatch.MR/fanout/%d" % fanout, cycle(ircServer, lambda ircServer=ircServer, s=sockets[0], data=data: ircServer.handleFrame(s, framing.MESSAGE, data))
+    ircServer, sockets = bench_server(2, "CTR")
+    data = replayable_command(ircServer, sockets[0], {"command": "PM", "target": "client1", "message": message_text(64)})
+    yield "dispatch.PM", cycle(ircServer, lambda ircServer=ircServer, s=sockets[0], data=data: ircServer.handleFrame(s, framing.MESSAGE, data))
+
+def room_cases():
+    for count in ROOM_COUNTS:
+        ircServer, sockets = bench_server(1, "CTR")
+        for i in range(count):
+            fill_room(ircServer, "room" + str(i), [])
+        fill_room(ircServer, "room" + str(count // 2), sockets)
+        lookup = replayable_command(ircServer, sockets[0], {"command": "MR", "roomname": "room" + str(count // 2), "message": "hi"})
+        yield "rooms.MR_lookup/%d" % count, cycle(ircServer, lambda ircServer=ircServer, s=sockets[0], data=lookup: ircServer.handleFrame(s, framing.MESSAGE, data))
+        listing = replayable_command(ircServer, sockets[0], {"command": "LR"})
+        yield "rooms.LR_scan/%d" % count, cycle(ircServer, lambda ircServer=ircServer, s=sockets[0], data=listing: ircServer.handleFrame(s, framing.MESSAGE, data))
+
+GROUPS = (codec_cases, crypto_cases, compression_cases, send_cases, broadcast_cases, dispatch_cases, room_cases)
+#--------------------------------------------------------------------#
+
+# Times one operation: the number of calls per repeat is picked so a repeat takes about
+# REPEAT_SECONDS, then the repeats are timed. Returns nanoseconds per call
+def measure(operation, repeats):
+    timer = timeit.Timer(operation)
+    number = 1
+    while timer.timeit(number) < REPEAT_SECONDS and number < 1 << 24:
+        number *= 2
+    times = [timer.timeit(number) / number * 1e9 for i in range(repeats)]
+    return {"ns_per_op": round(min(times), 1), "median_ns": round(statistics.median(times), 1), "ops": number}
+
+#--------------------------------------------------------------------#
+# Main function
+# Usage: python microbench.py [--filter TEXT] [--repeats N] [--output FILE] [--compare FILE]
+# Runs the fixed workloads, prints nanoseconds per operation and writes
+# them to JSON; --compare prints the change against an earlier run.
+#--------------------------------------------------------------------#
+def main():
+    parser = argparse.ArgumentParser(description="Times the per-message hot paths on fixed workloads.")
+    parser.add_argument("--filter", default="", help="only run cases whose name contains this text")
+    parser.add_argument("--repeats", type=int, default=5, help="timed repeats per case, the fastest counts")
+    parser.add_argument("--output", help="results file (default: microbench-<time>.json)")
+    parser.add_argument("--compare", help="results file of an earlier run to compare against")
+    options = parser.parse_args()
+
+    baseline = {}
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)["results"]
+
+    results = {}
+    for group in GROUPS:
+        for name, operation in group():
+            if options.filter not in name:
+                continue
+            results[name] = measure(operation, options.repeats)
+            line = "%-40s %12.1f ns" % (name, results[name]["ns_per_op"])
+            if name in baseline:
+                line += "   %+6.1f%%" % ((results[name]["ns_per_op"] / baseline[name]["ns_per_op"] - 1) * 100)
+            print(line)
+            sys.stdout.flush()
+
+    path = options.output or "microbench-" + time.strftime("%Y%m%d-%H%M%S") + ".json"
+    with open(path, 'w') as f:
+        json.dump({"benchmark": "microbench", "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime()), "host": socket.gethostname(),
+                   "python": sys.version.split()[0], "codec": CONSTANTS.CODEC, "compression": CONSTANTS.COMPRESSION, "results": results}, f, indent=2)
+    print("Results written to " + path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+#####################################################################
+#                    Haritha Munagala, Susham Yerabolu              #
+#                    CS 594 Internetworking Protocols               #
+#                             Spring 2018                           #
+#                           Rate Limiting                           #
+#####################################################################
+
+#--------------------------------------------------------------------#
+# Python Imports
+import time
+#--------------------------------------------------------------------#
+
+# Class of each command, limited by the bucket of the same name in CONSTANTS.COMMAND_RATE_LIMITS.
+# Commands missing here are "other"; pongs and chunk requests answer the server and are not limited
+COMMAND_CLASSES = {"MR": "chat", "PM": "chat", "LR": "list", "LC": "list", "LRC": "list", "RH": "list", "SR": "list", "ST": "list", "SFR": "file", "SFP": "file"}
+UNLIMITED = ("PO", "FR")
+
+#--------------------------------------------------------------------#
+# Token Bucket
+# Holds up to `burst` tokens and refills at `rate` tokens per second.
+# A rate of 0 means unlimited.
+#--------------------------------------------------------------------#
+class TokenBucket():
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+
+    # Adds the tokens earned since the last refill
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    # Takes tokens even if that leaves the bucket in debt, returns the seconds
+    # the caller should wait for the debt to be paid off
+    def consume(self, amount):
+        if not self.rate:
+            return 0
+        self.refill()
+        self.tokens -= amount
+        if self.tokens >= 0:
+            return 0
+        return -self.tokens / self.rate
+
+    # Returns 0 if `amount` tokens can be taken now, or else the seconds until they can, without taking them.
+    # More than `burst` tokens never fit, so they can be taken as soon as the bucket is full
+    def wait(self, amount):
+        if not self.rate:
+            return 0
+        self.refill()
+        amount = min(amount, self.burst)
+        if self.tokens < amount:
+            return (amount - self.tokens) / self.rate
+        return 0
+
+    # Takes tokens only if the bucket holds them, returns 0 if it did or else the seconds until it
+    # would. More than `burst` tokens are taken from a full bucket and leave it in debt for the rest,
+    # so a large amount gets through but is still charged in full
+    def take(self, amount):
+        wait = self.wait(amount)
+        if not wait and self.rate:
+            self.tokens -= amount
+        return wait
+#--------------------------------------------------------------------#
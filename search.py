@@ -0,0 +1,303 @@
+#####################################################################
+#                    Haritha Munagala, Susham Yerabolu              #
+#                    CS 594 Internetworking Protocols               #
+#                             Spring 2018                           #
+#                           Message Search                          #
+#####################################################################
+
+#--------------------------------------------------------------------#
+# Python Imports
+import os
+import re
+import json
+import mmap
+import struct
+import bisect
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+import CONSTANTS
+#--------------------------------------------------------------------#
+
+# Words are runs of letters, digits and underscores, matched without case
+WORD = re.compile(r'\w+')
+
+# Every document record is a 4 byte length followed by the JSON encoded document
+RECORD = struct.Struct('!I')
+
+# Offset of each document record, so document i of a segment is found at i * 8
+OFFSET = struct.Struct('!Q')
+
+# Postings are stored as arrays of 4 byte document ids
+POSTING = 'I'
+
+# Splits a message into the distinct words it is indexed under
+def tokenize(text):
+    return set(word.lower() for word in WORD.findall(text))
+
+# Terms that let a search be limited to a room, a sender or the target of a
+# private message. They start with a character tokenize never produces, so
+# they cannot clash with words
+def room_term(room):
+    return "#" + room
+
+def sender_term(sender):
+    return "@" + sender
+
+def target_term(target):
+    return ">" + target
+
+# Document ids found in every one of the posting lists, in ascending order
+def intersect(postings):
+    postings = sorted(postings, key=len)
+    result = postings[0]
+    for other in postings[1:]:
+        matched = []
+        for docId in result:
+            i = bisect.bisect_left(other, docId)
+            if i < len(other) and other[i] == docId:
+                matched.append(docId)
+        result = matched
+    return result
+
+# Document ids found in any of the posting lists, in ascending order
+def union(postings):
+    return sorted(set().union(*postings))
+
+#--------------------------------------------------------------------#
+# Search Segment
+# An immutable, compacted part of the index on disk covering `count`
+# documents from document id `base` on. The term dictionary is kept in
+# memory; postings and documents are read from mapped files.
+#   <base>-<count>.terms  term -> [position, length] in the postings
+#   <base>-<count>.post   all posting lists, back to back
+#   <base>-<count>.docs   document records
+#   <base>-<count>.didx   offset of every document record
+# The .terms file is written last, a segment without one is incomplete.
+#--------------------------------------------------------------------#
+class SearchSegment():
+    def __init__(self, directory, base, count):
+        self.directory = directory
+        self.base = base # Id of the first document
+        self.count = count # Number of documents
+        with open(self.path('.terms'), 'r') as f:
+            self.terms = json.load(f)
+        self.files = [open(self.path(extension), 'rb') for extension in ('.post', '.docs', '.didx')]
+        self.postings, self.docs, self.offsets = [mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b"" for f in self.files]
+
+    # Path of one of the segment's files
+    def path(self, extension):
+        return segment_path(self.directory, self.base, self.count, extension)
+
+    # Ids of the documents containing a term, in ascending order
+    def posting(self, term):
+        entry = self.terms.get(term)
+        if entry is None:
+            return None
+        itemSize = array(POSTING).itemsize
+        return array(POSTING, self.postings[entry[0] * itemSize:(entry[0] + entry[1]) * itemSize])
+
+    # Reads one document
+    def document(self, docId):
+        offset = OFFSET.unpack_from(self.offsets, (docId - self.base) * OFFSET.size)[0]
+        length = RECORD.unpack_from(self.docs, offset)[0]
+        return json.loads(self.docs[offset + RECORD.size:offset + RECORD.size + length].decode('UTF-8'))
+
+    # Unmaps and closes the files, then deletes them
+    def remove(self):
+        for mapped in (self.postings, self.docs, self.offsets):
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+        for f in self.files:
+            f.close()
+        for extension in ('.terms', '.post', '.docs', '.didx'):
+            os.remove(self.path(extension))
+#--------------------------------------------------------------------#
+
+# Path of a file of the segment covering `count` documents from `base` on
+def segment_path(directory, base, count, extension):
+    return os.path.join(directory, "%020d-%010d" % (base, count) + extension)
+
+# Writes a segment from its documents in id order and the posting list of every term, returns it opened
+def write_segment(directory, base, documents, postings):
+    count = len(documents)
+    with open(segment_path(directory, base, count, '.docs'), 'wb') as docs, open(segment_path(directory, base, count, '.didx'), 'wb') as offsets:
+        for doc in documents:
+            offsets.write(OFFSET.pack(docs.tell()))
+            data = doc if isinstance(doc, bytes) else json.dumps(doc).encode('UTF-8')
+            docs.write(RECORD.pack(len(data)) + data)
+    terms = {}
+    position = 0
+    with open(segment_path(directory, base, count, '.post'), 'wb') as post:
+        for term in sorted(postings):
+            ids = array(POSTING, postings[term])
+            ids.tofile(post)
+            terms[term] = [position, len(ids)]
+            position += len(ids)
+    with open(segment_path(directory, base, count, '.terms'), 'w') as f:
+        json.dump(terms, f)
+    return SearchSegment(directory, base, count)
+
+# Writes the segment holding the documents of two adjacent segments, returns it opened.
+# Runs on the merge thread; the two segments are only read, never changed
+def merge_segments(directory, older, newer):
+    postings = {}
+    for segment in (older, newer):
+        for term in segment.terms:
+            postings.setdefault(term, array(POSTING)).extend(segment.posting(term))
+    documents = []
+    for segment in (older, newer):
+        for i in range(segment.count):
+            offset = OFFSET.unpack_from(segment.offsets, i * OFFSET.size)[0]
+            length = RECORD.unpack_from(segment.docs, offset)[0]
+            documents.append(segment.docs[offset + RECORD.size:offset + RECORD.size + length])
+    return write_segment(directory, older.base, documents, postings)
+
+#--------------------------------------------------------------------#
+# Search Index
+# Incremental inverted index of the messages sent through the server.
+# New messages go to an in-memory tail (also appended to a tail log so
+# they survive a restart); once the tail holds SEARCH_TAIL_SIZE messages
+# it is written out as a segment. Neighbouring segments are merged
+# until every segment is more than twice as large as the next one,
+# which keeps their number logarithmic in the number of messages.
+# Merges run one at a time on a thread of their own, so a large one
+# never holds up the server; searches use the old segments until the
+# merged one is swapped in.
+# A document is [id, time, room, sender, target, message], with room
+# None for private messages and target None for room messages.
+#--------------------------------------------------------------------#
+class SearchIndex():
+    def __init__(self, directory):
+        self.directory = directory
+        self.segments = [] # On-disk segments, oldest first
+        self.tail = {} # Term -> ids of the tail documents containing it
+        self.tailDocs = [] # Documents not yet written to a segment
+        self.merger = ThreadPoolExecutor(1, thread_name_prefix="search")
+        self.merging = None # (older, newer, future) of the merge in progress
+        os.makedirs(directory, exist_ok=True)
+        self.loadSegments()
+        self.tailBase = self.segments[-1].base + self.segments[-1].count if self.segments else 0
+        self.nextDoc = self.tailBase # Id of the next document
+        self.replayTail()
+
+    # Opens the complete segments, deleting those a merge has replaced
+    def loadSegments(self):
+        found = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.terms'):
+                base, count = name[:-6].split('-')
+                found.append((int(base), int(count)))
+        # Sorted by base with the largest segment first, so a merged segment wins over its parts
+        end = 0
+        for base, count in sorted(found, key=lambda found: (found[0], -found[1])):
+            segment = SearchSegment(self.directory, base, count)
+            if base < end:
+                segment.remove()
+            else:
+                self.segments.append(segment)
+                end = base + count
+
+    # Reloads the documents of the tail log into the in-memory tail
+    def replayTail(self):
+        path = os.path.join(self.directory, 'tail.log')
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                data = f.read()
+            offset = 0
+            while offset + RECORD.size <= len(data):
+                length = RECORD.unpack_from(data, offset)[0]
+                if offset + RECORD.size + length > len(data):
+                    break # Cut short by a crash
+                doc = json.loads(data[offset + RECORD.size:offset + RECORD.size + length].decode('UTF-8'))
+                offset += RECORD.size + length
+                if doc[0] == self.nextDoc:
+                    self.index(doc)
+        self.tailLog = open(path, 'wb')
+        for doc in self.tailDocs:
+            data = json.dumps(doc).encode('UTF-8')
+            self.tailLog.write(RECORD.pack(len(data)) + data)
+        self.tailLog.flush()
+
+    # Adds a document to the in-memory tail
+    def index(self, doc):
+        terms = tokenize(doc[5])
+        terms.add(sender_term(doc[3]))
+        if doc[2] is not None:
+            terms.add(room_term(doc[2]))
+        else:
+            terms.add(target_term(doc[4]))
+        for term in terms:
+            self.tail.setdefault(term, []).append(doc[0])
+        self.tailDocs.append(doc)
+        self.nextDoc = doc[0] + 1
+
+    # Indexes a room message (target None) or a private message (room None)
+    def add(self, stamp, room, sender, target, message):
+        doc = [self.nextDoc, stamp, room, sender, target, message]
+        self.index(doc)
+        data = json.dumps(doc).encode('UTF-8')
+        self.tailLog.write(RECORD.pack(len(data)) + data)
+        self.tailLog.flush()
+        if len(self.tailDocs) >= CONSTANTS.SEARCH_TAIL_SIZE:
+            self.flushTail()
+        else:
+            self.compact()
+
+    # Writes the tail out as a segment and merges segments of similar size
+    def flushTail(self):
+        self.segments.append(write_segment(self.directory, self.tailBase, self.tailDocs, self.tail))
+        self.tail = {}
+        self.tailDocs = []
+        self.tailBase = self.nextDoc
+        self.tailLog.seek(0)
+        self.tailLog.truncate()
+        self.compact()
+
+    # Swaps in the segment of a finished merge, then hands the merge thread the newest two
+    # neighbouring segments that need merging, unless it is still busy
+    def compact(self):
+        if self.merging is not None:
+            older, newer, future = self.merging
+            # Merges fall behind under a steady flood of messages; past the limit the
+            # index waits for them, so searches do not go through ever more segments
+            if not future.done() and len(self.segments) <= CONSTANTS.SEARCH_MAX_SEGMENTS:
+                return
+            self.merging = None
+            merged = future.result()
+            i = self.segments.index(older)
+            self.segments[i:i + 2] = [merged]
+            # The merged segment is complete, its parts can go
+            older.remove()
+            newer.remove()
+        for i in range(len(self.segments) - 1, 0, -1):
+            older, newer = self.segments[i - 1], self.segments[i]
+            if 2 * newer.count > older.count:
+                self.merging = (older, newer, self.merger.submit(merge_segments, self.directory, older, newer))
+                return
+
+    # Yields the tail and then every segment, newest first, as (posting, document) functions
+    def sources(self):
+        yield (lambda term: self.tail.get(term)), (lambda docId: self.tailDocs[docId - self.tailBase])
+        for segment in reversed(self.segments):
+            yield segment.posting, segment.document
+
+    # Yields the documents containing every term, and one of the `scope` terms if given, newest first,
+    # starting below document `before` and stopping at the first document older than `since`. Only the
+    # posting lists of the terms are held in memory, documents are read one at a time as the caller asks
+    def search(self, terms, before=None, since=0, scope=None):
+        self.compact()
+        if before is None:
+            before = self.nextDoc
+        for posting, document in self.sources():
+            postings = [posting(term) for term in terms]
+            if not postings or None in postings:
+                continue
+            if scope is not None:
+                postings.append(union([ids for ids in map(posting, scope) if ids is not None]))
+            ids = intersect(postings)
+            for i in range(bisect.bisect_left(ids, before) - 1, -1, -1):
+                doc = document(ids[i])
+                if doc[1] < since:
+                    return
+                yield doc
+#--------------------------------------------------------------------#
@@ -9,64 +9,123 @@
 # Python Imports
 import socket
 import sys
+import os
+import binascii
 import threading
-import select
+import time
+import selectors
 import CONSTANTS
-import json
-from Crypto.Cipher import AES
-from Crypto import Random
+import framing
+import cryptosession
+import ratelimit
+import filetransfer
+import history
+import search
+import codec
+import compression
+import metrics
+import timerwheel
+import cryptopool
+from logger import log, DEBUG
 #--------------------------------------------------------------------#
 
+# Scatter/gather writes are missing on Windows, where pending frames are joined instead
+SENDMSG = hasattr(socket.socket, "sendmsg")
+
 #--------------------------------------------------------------------#
-# Encryption Functions for Secure Messaging
+# Message Functions for Secure Messaging
 #--------------------------------------------------------------------#
-# Adds padding to data keep block size = FIXED_BLOCK_SIZE
-def add_padding(data, interrupt, pad, block_size):
-    new_data = ''.join([data, interrupt])
-    new_data_len = len(new_data)
-    remaining_len = block_size - new_data_len
-    to_pad_len = remaining_len % block_size
-    pad_string = pad * to_pad_len
-    return ''.join([new_data, pad_string])
-
-# Removes extra padding
-def strip_padding(data, interrupt, pad):
-    return data.rstrip(pad).rstrip(interrupt)
-
-# Pads, encodes, and then encrypt the data
-def encode_n_encrypt(data):
-    # converts to JSON
+# Wraps the message and any extra fields and encodes them with the client's codec, ready for its crypto session
+def encode_message(codecName, data, extra=None):
     client_msg = {}
     client_msg["message"] = data
-    data = json.dumps(client_msg)
-
-    IV = Random.new().read(16) # Randomly generated Initialization vector
-    padded_data = add_padding(data, CONSTANTS.INTERRUPT, CONSTANTS.PAD, CONSTANTS.FIXED_BLOCK_SIZE)
-    padded_data = padded_data.encode('UTF-8')
-    obj = AES.new(CONSTANTS.KEY, AES.MODE_CFB, IV)
-    ciphertext = obj.encrypt(padded_data)
-    return IV+ciphertext
-
-# Decrypts, decodes, and strips pads in data
-def decrypt_n_decode(data):
-    IV = data[:16] # Extracts the Initialization Vector of size 16
-    ciphertext = data[16:] # Extracts the ciphertext
-    obj = AES.new(CONSTANTS.KEY, AES.MODE_CFB, IV)
-    decrypted_padded_data = obj.decrypt(ciphertext)
-    decrypted_padded_data = decrypted_padded_data.decode('UTF-8')
-    decrypted_data = strip_padding(decrypted_padded_data, CONSTANTS.INTERRUPT, CONSTANTS.PAD)
-    return decrypted_data
+    if extra:
+        client_msg.update(extra)
+    return codec.encode(codecName, client_msg)
 #--------------------------------------------------------------------#
 
 #--------------------------------------------------------------------#
 # IRC Room
 # This class defines what an IRC room is. An IRC room contains the room
 # name along with a dictionary of the clients that are part of that room
+# and the history of the messages sent to it
 #--------------------------------------------------------------------#
 class IRCRoom():
     def __init__(self, name):
         self.name = name #Name of the room
         self.roomClients = {} #Dictionary containing all clients that are part of the room
+        self.created = time.time() #When the room was created, a room created later under the same name is a different one
+        self.history = None #RoomHistory, opened when the room's history is first used
+        self.firstDoc = 0 #Id of the room's first search document, earlier ones belong to an older room of the same name
+        self.bucket = ratelimit.TokenBucket(CONSTANTS.ROOM_FANOUT_LIMIT, CONSTANTS.ROOM_FANOUT_BURST) #Limits the messages delivered to the members
+#--------------------------------------------------------------------#
+
+#--------------------------------------------------------------------#
+# IRC Connection
+# This class holds the per-connection state the server keeps for each
+# connected client socket
+#--------------------------------------------------------------------#
+class IRCConnection():
+    def __init__(self, socket):
+        self.socket = socket #Socket object of the client
+        self.frameBuffer = framing.FrameBuffer() #Reassembles messages split or merged by TCP
+        self.session = None #Crypto session, set up by the client's hello
+        self.codec = codec.JSON #Message codec, chosen in the client's hello
+        self.compression = None #CompressionStream, set up if the client's hello offered compression
+        self.outBuffer = bytearray() #Outbound bytes waiting for the socket to become writable
+        self.pending = [] #Frames sent during this event loop cycle, written together at its end
+        self.pendingBytes = 0 #Bytes of the pending frames
+        self.events = selectors.EVENT_READ #Events the socket is currently registered for
+        self.paused = False #Reading is paused until slow receivers catch up
+        self.blockedSenders = set() #Connections paused until this connection's queue drains
+        self.rooms = set() #Names of the rooms the client is part of
+        self.named = 0 #When the client took its current name, private messages to that name before are not its own
+        self.transfers = set() #Ids of the file transfers the client is sending
+        self.throttled = False #Reading is paused because a file transfer exceeded its rate limit
+        self.connected = time.monotonic() #When the connection was accepted
+        self.lastActivity = self.connected #When the client last sent anything, a pong included
+        self.lastCommand = self.connected #When the client last sent anything but a pong
+        self.pingSent = 0 #When the unanswered ping was sent, 0 if none is
+        self.timer = None #Timer checking the connection is still alive
+        self.bucket = ratelimit.TokenBucket(CONSTANTS.CLIENT_RATE_LIMIT, CONSTANTS.CLIENT_BURST) #Limits the commands the client sends
+        self.classBuckets = dict((name, ratelimit.TokenBucket(rate, burst)) for name, (rate, burst) in CONSTANTS.COMMAND_RATE_LIMITS.items()) #Limit each class of command
+        self.limitedUntil = 0 #Commands are turned away without a reply until then
+#--------------------------------------------------------------------#
+
+#--------------------------------------------------------------------#
+# IRC Transfer
+# This class defines a file transfer from one client to one or more
+# clients. Transfers are identified by an id that the sender puts in
+# front of every data frame, so several can be in flight at once.
+# Receivers first answer with the chunks they are missing (all of them,
+# unless they kept part of the file from an interrupted transfer), and
+# the sender is asked for the union of those chunks only.
+#--------------------------------------------------------------------#
+class IRCTransfer():
+    def __init__(self, transferId, sender, name, size, nonce, fileHash, chunkSize, targets):
+        self.id = transferId #Id carried by every data frame of the transfer
+        self.sender = sender #Socket of the client sending the file
+        self.name = name #Name of the file
+        self.size = size #Size of the file in bytes
+        self.nonce = nonce #Nonce of the file's end to end cipher
+        self.hash = fileHash #SHA-256 of the whole file, checked by the receivers
+        self.chunkSize = chunkSize #Bytes per data frame, the last one may be shorter
+        self.targets = targets #Sockets of the clients receiving the file
+        self.waiting = set(targets) #Receivers that have not said which chunks they need yet
+        self.chunks = [] #Ranges of chunk sequence numbers requested by the receivers
+        self.started = False #The sender has been asked for the chunks
+        self.expected = 0 #Chunks the sender was asked for
+        self.relayed = 0 #Chunks relayed so far
+        self.compress = False #Sender and receivers all compress, so chunks may be deflated
+        self.bucket = ratelimit.TokenBucket(CONSTANTS.TRANSFER_RATE_LIMIT, CONSTANTS.TRANSFER_BURST)
+
+    # Number of chunks the file is split into
+    def chunkCount(self):
+        return filetransfer.chunk_count(self.size, self.chunkSize)
+
+    # Fields telling receivers who sends the incoming file and how to store, decrypt and verify it
+    def info(self, senderName):
+        return {"file": {"transfer": self.id, "sender": senderName, "name": self.name, "size": self.size, "nonce": self.nonce, "hash": self.hash, "chunk_size": self.chunkSize}}
 #--------------------------------------------------------------------#
 
 #--------------------------------------------------------------------#
@@ -84,382 +143,1152 @@ class IRCServer(threading.Thread):
         #   Key: Socket Object
         #   Value: Client name associated with the socket object
         self.clients = {}
-        #List containing all rooms on the server
-        self.rooms = []
+        # Dictionary containing the connection state of every client socket
+        #   Key: Socket Object
+        #   Value: IRCConnection object
+        self.connections = {}
+        # Dictionary containing all rooms on the server
+        #   Key: Room name
+        #   Value: IRCRoom object
+        self.rooms = {}
+        # Dictionary indexing connected clients by name
+        #   Key: Client name
+        #   Value: Socket Object
+        self.nicknames = {}
+        # Event selector (epoll on Linux) that every socket is registered with once
+        self.selector = selectors.DefaultSelector()
+        # Slow consumers to disconnect once the current event has been handled
+        self.closing = set()
+        # Client whose message is being handled, paused by the "PAUSE" slow consumer policy.
+        # None for frames no client caused, like pings and the messages of a client leaving
+        self.currentSender = None
+        # Dictionary containing the file transfers in progress
+        #   Key: Transfer id
+        #   Value: IRCTransfer object
+        self.transfers = {}
+        self.nextTransferId = 1
+        # Timers run by the event loop
+        self.timerWheel = timerwheel.TimerWheel(CONSTANTS.TIMER_TICK, time.monotonic())
+        self.pings = 0 # Pings sent, the number is echoed in the pong
+        # Connections with pending frames, flushed at the end of every event loop cycle
+        self.dirty = []
+        # Threads for large encryptions and decryptions, and the (socket, frames) read in this
+        # cycle that wait to be decrypted together
+        self.cryptoPool = cryptopool.CryptoPool(CONSTANTS.CRYPTO_WORKERS, CONSTANTS.CRYPTO_OFFLOAD_SIZE) if CONSTANTS.CRYPTO_WORKERS else None
+        self.received = []
+        # Lets several processes accept connections on the same port
+        self.reusePort = False
+        # Directory the room histories are logged to, None keeps history in memory only
+        self.historyDir = CONSTANTS.HISTORY_DIR or None
+        # Directory of the message search index, None turns searching off
+        self.searchDir = CONSTANTS.SEARCH_DIR or None
+        self.searchIndex = None
+        # Bytes before and after compression over all connections
+        self.compressionStats = compression.CompressionStats()
+        # Counters and histograms, histograms are kept from the start if they are served over HTTP
+        self.metricsPort = CONSTANTS.METRICS_PORT
+        self.metrics = metrics.Metrics(bool(self.metricsPort))
 
     # Remove a client from all rooms they are part of and then from the list of connected clients
     def cleanup(self, socket):
-        # Remove person from all rooms
-        for room in self.rooms:
-            # Go through all clients in a room
-            for personSocket in room.roomClients:
-                # Remove the client from the room, then check the next room
-                if personSocket == socket:
-                    del room.roomClients[personSocket]
-                    break
-            # Notify that the user has left the room
-            for personSocket in room.roomClients:
-                if personSocket != socket:
-                    personSocket.send(encode_n_encrypt("<" + room.name + "> " + self.clients[socket] + " has left!"))
+        # Stop watching the socket for events
+        try:
+            self.selector.unregister(socket)
+        except (KeyError, ValueError):
+            pass
+
+        # Remove person from the rooms they are part of
+        connection = self.connections.pop(socket, None)
+        if connection is not None:
+            if connection.timer is not None:
+                connection.timer.cancel()
+            for roomName in connection.rooms:
+                room = self.rooms[roomName]
+                del room.roomClients[socket]
+                # Delete the room once nobody is left, otherwise notify that the user has left the room
+                if len(room.roomClients) == 0:
+                    self.removeRoom(room)
+                else:
+                    self.broadcast(room.roomClients, "<" + room.name + "> " + self.clients[socket] + " has left!", socket)
+
+        # Abandon the files the client was sending
+        if connection is not None:
+            for transferId in connection.transfers:
+                transfer = self.transfers.pop(transferId)
+                self.broadcast(transfer.targets, "<" + self.clients[self.serverSocket] + "> File " + transfer.name + " from " + self.clients[socket] + " was interrupted!", extra={"file_failed": transferId})
+
+        # Stop waiting for the client to ask for the chunks of files sent to it
+        for transfer in list(self.transfers.values()):
+            if socket in transfer.waiting:
+                transfer.waiting.discard(socket)
+                if not transfer.waiting:
+                    self.startSending(transfer)
 
         # Remove client from list of clients
+        if self.nicknames.get(self.clients[socket]) == socket:
+            self.clientLeft(socket)
+            del self.nicknames[self.clients[socket]]
         del self.clients[socket]
+        self.closing.discard(socket)
+
+        # Nobody is waiting on this client's queue any more
+        if connection is not None:
+            for sender in connection.blockedSenders:
+                self.resumeReading(sender)
+
+    # Adds a new room, starting its search results after the messages already indexed
+    def createRoom(self, name):
+        room = IRCRoom(name)
+        if self.messageIndex() is not None:
+            room.firstDoc = self.messageIndex().nextDoc
+        self.rooms[name] = room
+        return room
+
+    # Deletes a room nobody is left in, along with its history
+    def removeRoom(self, room):
+        del self.rooms[room.name]
+        if room.history is not None:
+            room.history.remove()
+
+    # Opens the history of a room, logged under the hex encoded room name so any name is a valid path,
+    # followed by the creation time so a room created later under the same name starts out empty
+    def historyOf(self, room):
+        if room.history is None:
+            directory = None
+            if self.historyDir:
+                directory = os.path.join(self.historyDir, "%s-%d" % (binascii.hexlify(room.name.encode('UTF-8')).decode('ascii'), room.created * 1000000))
+            room.history = history.RoomHistory(directory)
+        return room.history
+
+    # Sends a client up to `limit` messages of a room sent before message number `before`
+    # (the newest ones if before is None), with the number to ask for the page before them
+    def sendHistory(self, s, room, before, limit):
+        roomHistory = self.historyOf(room)
+        entries = roomHistory.before(roomHistory.nextSeq if before is None else before, limit)
+        if not entries:
+            self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> No earlier messages in " + room.name)
+            return
+        message = ""
+        for seq, stamp, sender, text in entries:
+            message += "\n\t#" + str(seq) + " [" + time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(stamp)) + "] " + sender + ": " + text
+        self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> History of " + room.name + ":" + message, {"history": room.name, "before": entries[0][0]})
+
+    # Keeps a message for RH and SR: a room message in the room's history and the search index,
+    # a private message in the search index only
+    def recordMessage(self, record):
+        if record["room"] is not None:
+            room = self.rooms.get(record["room"])
+            if room is None:
+                return
+            self.historyOf(room).add(record["sender"], record["message"], record["time"])
+        if self.messageIndex() is not None:
+            self.messageIndex().add(record["time"], record["room"], record["sender"], record["target"], record["message"])
+
+    # Opens the message search index, None if searching is turned off
+    def messageIndex(self):
+        if self.searchIndex is None and self.searchDir:
+            self.searchIndex = search.SearchIndex(self.searchDir)
+        return self.searchIndex
+
+    # Sends a client the messages it may see that contain every word of the query, newest first.
+    # Room messages are visible to the room's members, private messages to their sender and target
+    # while they keep the name the message was sent under
+    def sendSearch(self, s, jsonData):
+        index = self.messageIndex()
+        if index is None:
+            self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> Search is not enabled on this server")
+            return
+        terms = list(search.tokenize(jsonData["query"]))
+        room = jsonData.get("roomname")
+        if room is not None:
+            if room not in self.connections[s].rooms:
+                self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> Unable to search! The room does not exist or you are not part of the room!")
+                return
+            terms.append(search.room_term(room))
+        if jsonData.get("from"):
+            terms.append(search.sender_term(jsonData["from"]))
+        if not terms:
+            self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> Nothing to search for!")
+            return
+        try:
+            since = time.time() - float(jsonData["days"]) * 86400 if jsonData.get("days") else 0
+            limit = max(1, min(int(jsonData.get("count") or CONSTANTS.SEARCH_PAGE), CONSTANTS.SEARCH_PAGE))
+            before = jsonData.get("before")
+            before = None if before is None else int(before)
+        except (TypeError, ValueError, OverflowError):
+            self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> Unable to search! days, count and before take numbers")
+            return
+
+        name = self.clients[s]
+        rooms = self.connections[s].rooms
+        named = self.connections[s].named
+        # Outside a room only the documents of the client's rooms and those from or to its name are looked at
+        scope = None if room is not None else [search.room_term(r) for r in rooms] + [search.sender_term(name), search.target_term(name)]
+        message = ""
+        found = 0
+        last = None
+        more = False
+        # Results are read lazily, the search stops as soon as the page is full
+        # or SEARCH_SCAN documents were read, the client continues from the last one
+        for examined, (docId, stamp, docRoom, sender, target, text) in enumerate(index.search(terms, before, since, scope), 1):
+            last = docId
+            if (docRoom in rooms and docId >= self.rooms[docRoom].firstDoc) if docRoom is not None else ((name == sender or name == target) and stamp >= named):
+                where = " in " + docRoom if docRoom is not None else " to " + target
+                message += "\n\t#" + str(docId) + " [" + time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(stamp)) + "] " + sender + where + ": " + text
+                found += 1
+                if found == limit:
+                    break
+            if examined == CONSTANTS.SEARCH_SCAN:
+                more = True
+                break
+        if more:
+            message += "\n\tSearched down to #" + str(last) + ", add before:" + str(last) + " for older messages"
+        if not found and not more:
+            self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> No messages found")
+        else:
+            self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> Search results:" + message, {"search": jsonData["query"], "before": last})
+
+    # Called once a client has taken a name, previous is the name it gave up (if any).
+    # Together with the room hooks below this lets subclasses share clients and rooms
+    # with other servers
+    def clientNamed(self, s, previous):
+        pass
+
+    # Called once a named client has disconnected, before it is removed
+    def clientLeft(self, s):
+        pass
+
+    # Called once a client has joined a room
+    def roomJoined(self, room, s):
+        pass
+
+    # Called once a client has left a room
+    def roomLeft(self, room, s):
+        pass
+
+    # Re-registers the socket for the events the connection currently needs
+    def updateEvents(self, connection):
+        events = 0
+        if not connection.paused and not connection.throttled:
+            events |= selectors.EVENT_READ
+        if connection.outBuffer:
+            events |= selectors.EVENT_WRITE
+        if events == connection.events:
+            return
+        if not events:
+            self.selector.unregister(connection.socket)
+        elif not connection.events:
+            self.selector.register(connection.socket, events, self.handleClient)
+        else:
+            self.selector.modify(connection.socket, events, self.handleClient)
+        connection.events = events
+
+    # Stops reading from a client until the receivers it is filling up drain
+    def pauseReading(self, connection):
+        if not connection.paused:
+            connection.paused = True
+            self.updateEvents(connection)
+
+    # Starts reading from a paused client again
+    def resumeReading(self, connection):
+        if connection.paused and connection.socket in self.connections:
+            connection.paused = False
+            self.updateEvents(connection)
+            self.rewatchConnection(connection)
+
+    # Runs callback(argument) from the event loop after delay seconds, returns a timer that can be cancelled
+    def callLater(self, delay, callback, argument):
+        return self.timerWheel.schedule(time.monotonic() + delay, callback, argument)
+
+    # Starts checking that a new connection stays alive
+    def watchConnection(self, connection):
+        if CONSTANTS.HELLO_TIMEOUT or CONSTANTS.PING_INTERVAL or CONSTANTS.IDLE_TIMEOUT:
+            connection.timer = self.callLater(CONSTANTS.HELLO_TIMEOUT or CONSTANTS.PING_INTERVAL or CONSTANTS.IDLE_TIMEOUT, self.checkConnection, connection)
+
+    # Starts checking a client again once the server reads from it again. Its pong and commands
+    # have been waiting unread, so it gets a full interval before it is pinged or reaped
+    def rewatchConnection(self, connection):
+        if connection.paused or connection.throttled:
+            return
+        connection.pingSent = 0
+        connection.lastActivity = time.monotonic()
+        if connection.timer is None and (CONSTANTS.PING_INTERVAL or CONSTANTS.IDLE_TIMEOUT):
+            connection.timer = self.callLater(CONSTANTS.PING_INTERVAL or CONSTANTS.IDLE_TIMEOUT, self.checkConnection, connection)
+
+    # Disconnects a client that sent nothing for too long, pings a quiet one, then checks again
+    # when the next limit runs out. Frames only note when they arrived, so a busy client costs
+    # one timer per check and not one per frame
+    def checkConnection(self, connection):
+        connection.timer = None
+        s = connection.socket
+        if s not in self.connections:
+            return
+        now = time.monotonic()
+        if connection.session is None:
+            if not CONSTANTS.HELLO_TIMEOUT:
+                # Nothing can be sent before the hello, look again later
+                deadline = now + (CONSTANTS.PING_INTERVAL or CONSTANTS.IDLE_TIMEOUT)
+            elif now - connection.connected >= CONSTANTS.HELLO_TIMEOUT:
+                self.reap(connection, "no hello")
+                return
+            else:
+                deadline = connection.connected + CONSTANTS.HELLO_TIMEOUT
+        elif connection.paused or connection.throttled:
+            # The server is not reading from the client, so its answers cannot be seen.
+            # Checking starts again when reading resumes
+            return
+        else:
+            if CONSTANTS.IDLE_TIMEOUT and now - connection.lastCommand >= CONSTANTS.IDLE_TIMEOUT:
+                self.reap(connection, "idle")
+                return
+            # Anything the client sent since the ping shows it is still there
+            if connection.pingSent and connection.lastActivity >= connection.pingSent:
+                connection.pingSent = 0
+            if connection.pingSent:
+                if now - connection.pingSent >= CONSTANTS.PONG_TIMEOUT:
+                    self.reap(connection, "ping timeout")
+                    return
+                deadline = connection.pingSent + CONSTANTS.PONG_TIMEOUT
+            elif CONSTANTS.PING_INTERVAL and now - connection.lastActivity >= CONSTANTS.PING_INTERVAL:
+                self.pings += 1
+                connection.pingSent = now
+                self.sendMessage(s, "", {"ping": self.pings})
+                deadline = now + CONSTANTS.PONG_TIMEOUT
+            elif CONSTANTS.PING_INTERVAL:
+                deadline = connection.lastActivity + CONSTANTS.PING_INTERVAL
+            else:
+                deadline = None
+            if CONSTANTS.IDLE_TIMEOUT:
+                deadline = min(deadline or float('inf'), connection.lastCommand + CONSTANTS.IDLE_TIMEOUT)
+        if deadline is not None and s in self.connections:
+            connection.timer = self.callLater(max(0, deadline - now), self.checkConnection, connection)
+
+    # Disconnects a client that stopped answering or stayed idle for too long
+    def reap(self, connection, reason):
+        s = connection.socket
+        log.info("client_reaped", client=self.clients[s], reason=reason)
+        self.metrics.reaped += 1
+        self.lock.acquire()
+        self.cleanup(s)
+        self.lock.release()
+        s.close()
+
+    # Stops reading from a client whose file transfer went over its rate limit
+    def throttle(self, connection, delay):
+        if not connection.throttled:
+            connection.throttled = True
+            self.updateEvents(connection)
+            self.callLater(delay, self.unthrottle, connection)
+
+    # Starts reading from a throttled client again
+    def unthrottle(self, connection):
+        if connection.throttled and connection.socket in self.connections:
+            connection.throttled = False
+            self.updateEvents(connection)
+            self.rewatchConnection(connection)
+
+    # Takes a token for a command from the client's buckets, returns whether the command may run
+    def allowCommand(self, connection, command):
+        if command in ratelimit.UNLIMITED:
+            return True
+        limit = ratelimit.COMMAND_CLASSES.get(command, "other")
+        bucket = connection.classBuckets.get(limit)
+        wait = bucket.wait(1) if bucket is not None else 0
+        if not wait:
+            limit = "client"
+            wait = connection.bucket.wait(1)
+        if wait:
+            self.rateLimited(connection, limit, wait)
+            return False
+        # Tokens are only taken once both buckets allow the command, so refused commands cost nothing
+        if bucket is not None:
+            bucket.take(1)
+        connection.bucket.take(1)
+        return True
+
+    # Turns a command away, telling the client once how long to wait so the replies cannot be used for flooding
+    def rateLimited(self, connection, limit, wait):
+        self.metrics.limited[limit] += 1
+        now = time.monotonic()
+        if now >= connection.limitedUntil:
+            connection.limitedUntil = now + wait
+            self.sendMessage(connection.socket, "<" + self.clients[self.serverSocket] + "> Slow down! Too many " + ("messages to this room" if limit == "room" else "commands") + ", try again in %.2f seconds" % wait, {"throttled": limit, "retry_after": round(wait, 3)})
+
+    # Applies the slow consumer policy to a client whose outbound queue is full
+    def slowConsumer(self, connection, frame, policy):
+        self.metrics.slowConsumers += 1
+        sender = self.connections.get(self.currentSender)
+        if policy == "PAUSE" and sender is not None and sender is not connection:
+            # Queue anyway, but stop reading from whoever is producing the data
+            self.queueFrame(connection, frame)
+            connection.blockedSenders.add(sender)
+            self.pauseReading(sender)
+        elif policy != "DROP" or not connection.session.stateless or connection.compression is not None:
+            # Cannot cleanup here, the caller may be iterating over a room.
+            # PAUSE disconnects when the data does not come from another client that could be paused,
+            # stream sessions and compression streams cannot skip a frame either, so DROP disconnects them too
+            self.closing.add(connection.socket)
+        # "DROP" simply discards the frame for this client
+
+    # Queues a frame behind whatever the client has not received yet
+    def queueFrame(self, connection, frame):
+        if connection.pending:
+            self.queuePending(connection, frame)
+            return
+        connection.outBuffer += frame
+        self.updateEvents(connection)
+
+    # Holds a frame until the end of the event loop cycle, when all of the client's frames are written at once
+    def queuePending(self, connection, frame):
+        if not connection.pending:
+            self.dirty.append(connection)
+        connection.pending.append(frame)
+        connection.pendingBytes += len(frame)
+
+    # Queues an already framed message for the client, written out at the end of the event loop cycle.
+    # Bulk frames (file data) always pause the sender instead of dropping or disconnecting
+    def sendFrame(self, s, frame, bulk=False):
+        connection = self.connections.get(s)
+        if connection is None or s in self.closing:
+            return
+        self.metrics.framesOut += 1
+        self.metrics.bytesOut += len(frame)
+        # Only bytes the socket refused count, the frames of this cycle are usually all taken by the flush
+        if len(connection.outBuffer) + len(frame) > CONSTANTS.MAX_OUTPUT_BUFFER:
+            self.slowConsumer(connection, frame, "PAUSE" if bulk else CONSTANTS.SLOW_CONSUMER_POLICY)
+            return
+        if connection.outBuffer:
+            # Keep ordering; the selector flushes the queue when the socket is writable
+            connection.outBuffer += frame
+            return
+        if not connection.pending:
+            self.dirty.append(connection)
+        connection.pending.append(frame)
+        connection.pendingBytes += len(frame)
+
+    # Writes the frames queued for each client during the cycle, one scatter/gather write per client.
+    # What a socket does not take is queued and sent once it becomes writable
+    def flushPending(self):
+        dirty = self.dirty
+        self.dirty = []
+        for connection in dirty:
+            frames = connection.pending
+            size = connection.pendingBytes
+            connection.pending = []
+            connection.pendingBytes = 0
+            s = connection.socket
+            if s in self.closing or s not in self.connections:
+                continue
+            try:
+                if len(frames) == 1:
+                    sent = s.send(frames[0])
+                elif SENDMSG:
+                    sent = s.sendmsg(frames[:framing.MAX_IOVECS])
+                else:
+                    sent = s.send(b"".join(frames))
+            except (BlockingIOError, InterruptedError):
+                sent = 0
+            except socket.error:
+                self.closing.add(s)
+                continue
+            if sent < size:
+                for frame in frames:
+                    if sent >= len(frame):
+                        sent -= len(frame)
+                    else:
+                        connection.outBuffer += memoryview(frame)[sent:]
+                        sent = 0
+                self.updateEvents(connection)
+            self.releaseSenders(connection)
+        self.metrics.writes += len(dirty)
+
+    # Writes queued bytes to a writable client socket
+    def flushClient(self, s):
+        connection = self.connections[s]
+        try:
+            sent = s.send(connection.outBuffer)
+        except (BlockingIOError, InterruptedError):
+            return
+        except socket.error:
+            self.closing.add(s)
+            return
+        self.metrics.writes += 1
+        del connection.outBuffer[:sent]
+        if not connection.outBuffer:
+            self.updateEvents(connection)
+        self.releaseSenders(connection)
+
+    # Lets the senders paused on a client continue once its queue is low enough
+    def releaseSenders(self, connection):
+        if connection.blockedSenders and len(connection.outBuffer) <= CONSTANTS.OUTPUT_LOW_WATER:
+            for sender in connection.blockedSenders:
+                self.resumeReading(sender)
+            connection.blockedSenders.clear()
+
+    # Compresses a message if the client asked for compression, then encrypts it with the client's session
+    def encryptMessage(self, connection, plaintext):
+        if self.metrics.timing:
+            start = time.perf_counter()
+        if connection.compression is not None:
+            plaintext = connection.compression.compress(plaintext)
+        data = connection.session.encrypt(plaintext)
+        if self.metrics.timing:
+            self.metrics.encryptSeconds.observe(time.perf_counter() - start)
+        return data
+
+    # Decrypts a message from a client, unless the crypto pool already did, then decompresses it
+    # if the client asked for compression
+    def decryptMessage(self, connection, data, plaintext=None):
+        if isinstance(plaintext, Exception):
+            raise plaintext
+        if self.metrics.timing:
+            start = time.perf_counter()
+        if plaintext is None:
+            plaintext = connection.session.decrypt(data)
+        if connection.compression is not None:
+            plaintext = connection.compression.decompress(plaintext)
+        if self.metrics.timing:
+            self.metrics.decryptSeconds.observe(time.perf_counter() - start)
+        return plaintext
+
+    # Encrypts a message with the client's session and sends it as one frame. The record
+    # of a client's message is kept once the message is on its way (see recordMessage)
+    def sendMessage(self, s, message, extra=None, record=None):
+        connection = self.connections.get(s)
+        if connection is not None and connection.session is not None:
+            self.sendFrame(s, framing.frame(self.encryptMessage(connection, encode_message(connection.codec, message, extra))))
+        if record is not None:
+            self.recordMessage(record)
+
+    # Sends a message to every socket except the excluded one. The message is serialized
+    # once per codec; stateless (CFB) sessions also share one encrypted frame per codec,
+    # unless the message goes through a client's compression stream. Stream sessions
+    # (CTR/GCM) encrypt it with each client's own keystream. A record is kept like in sendMessage
+    def broadcast(self, sockets, message, exclude=None, extra=None, record=None):
+        plaintexts = {}
+        frames = {}
+        receivers = 0
+        offloaded = []
+        for userSocket in sockets:
+            connection = self.connections.get(userSocket)
+            if userSocket == exclude or connection is None or connection.session is None:
+                continue
+            receivers += 1
+            plaintext = plaintexts.get(connection.codec)
+            if plaintext is None:
+                plaintext = plaintexts[connection.codec] = encode_message(connection.codec, message, extra)
+            if connection.session.stateless and (connection.compression is None or not connection.compression.worthwhile(plaintext)):
+                key = (connection.codec, connection.compression is not None)
+                frame = frames.get(key)
+                if frame is None:
+                    frame = frames[key] = framing.frame(self.encryptMessage(connection, plaintext))
+                self.sendFrame(userSocket, frame)
+            elif self.cryptoPool is not None and len(plaintext) >= self.cryptoPool.threshold:
+                # Compression streams stay in this thread, only the encryption is handed over
+                data = connection.compression.compress(plaintext) if connection.compression is not None else plaintext
+                offloaded.append((userSocket, connection.session, data))
+            else:
+                self.sendFrame(userSocket, framing.frame(self.encryptMessage(connection, plaintext)))
+        if offloaded:
+            # Each receiver gets one frame, so its frames stay in order however the pool orders the work
+            results = self.cryptoPool.process("encrypt", [(session, [data]) for userSocket, session, data in offloaded])
+            for (userSocket, session, data), result in zip(offloaded, results):
+                if isinstance(result[0], Exception):
+                    raise result[0]
+                self.sendFrame(userSocket, framing.frame(result[0]))
+        self.metrics.broadcasts += 1
+        if self.metrics.timing:
+            self.metrics.fanout.observe(receivers)
+        if record is not None:
+            self.recordMessage(record)
+
+    # Accepts an incoming client connection and registers it with the event selector
+    def acceptClient(self, serverSocket, mask):
+        try:
+            clientSocket, clientAddr = serverSocket.accept()
+        except socket.error:
+            return
+        # If client is already connected to the server, send an appropriate message
+        if(clientSocket in self.clients):
+            self.sendMessage(clientSocket, "You are already connected to the server!")
+        else:
+            # Sends are queued, never allowed to block the event loop
+            clientSocket.setblocking(False)
+            # Frames are already batched per event loop cycle, waiting for more would only add delay
+            if CONSTANTS.TCP_NODELAY:
+                clientSocket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            # Add to list of all connected clients
+            self.lock.acquire()
+            self.clients[clientSocket] = clientSocket
+            self.connections[clientSocket] = IRCConnection(clientSocket)
+            self.lock.release()
+            # Register once; the selector calls handleClient whenever the socket is ready
+            self.selector.register(clientSocket, selectors.EVENT_READ, self.handleClient)
+            self.watchConnection(self.connections[clientSocket])
+
+    # Handles a ready client socket
+    def handleClient(self, s, mask):
+        if mask & selectors.EVENT_WRITE:
+            self.flushClient(s)
+        if mask & selectors.EVENT_READ and s in self.connections:
+            self.readClient(s, mask)
+
+    # Handles a readable client socket
+    def readClient(self, s, mask):
+        try:
+            received = self.connections[s].frameBuffer.recvFrom(s)
+            self.metrics.bytesIn += received
+
+            if not received:
+                # Handles the unexpected connection closed by client
+                self.lock.acquire()
+                # Remove client from all rooms and then from list of connected clients
+                client_name = self.clients[s]
+                self.cleanup(s)
+                self.lock.release()
+                s.close()
+                log.info("client_closed", client=client_name)
+            else:
+                frames = self.connections[s].frameBuffer.frames()
+                if self.cryptoPool is not None:
+                    # Handled once every ready client has been read, so their messages are decrypted together
+                    self.received.append((s, frames))
+                    return
+                # Handle every complete message that arrived with this read
+                self.currentSender = s
+                try:
+                    for kind, data in frames:
+                        self.metrics.framesIn += 1
+                        self.handleFrame(s, kind, data)
+                finally:
+                    self.currentSender = None
+
+        except (BlockingIOError, InterruptedError):
+            return
+        except Exception as e:
+            self.clientError(s, e)
+
+    # Disconnect client from server and remove from connected clients list
+    def clientError(self, s, e):
+        log.warning("client_error", client=self.clients.get(s), error=e)
+        self.lock.acquire()
+        self.cleanup(s)
+        self.lock.release()
+        s.close()
+
+    # Handles the frames read in this cycle, their messages decrypted by the crypto pool
+    # first; each client's in order, different clients side by side
+    def handleReceived(self):
+        received = self.received
+        self.received = []
+        batch = []
+        for s, frames in received:
+            connection = self.connections.get(s)
+            # Messages after a hello cannot be decrypted until the hello has been handled
+            if connection is not None and connection.session is not None:
+                batch.append((connection.session, [data for kind, data in frames if kind == framing.MESSAGE]))
+            else:
+                batch.append((None, []))
+        results = iter(self.cryptoPool.process("decrypt", batch))
+        for s, frames in received:
+            plaintexts = iter(next(results))
+            if s not in self.connections:
+                continue
+            try:
+                self.currentSender = s
+                try:
+                    for kind, data in frames:
+                        self.metrics.framesIn += 1
+                        self.handleFrame(s, kind, data, next(plaintexts, None) if kind == framing.MESSAGE else None)
+                finally:
+                    self.currentSender = None
+            except Exception as e:
+                self.clientError(s, e)
+
+    # Records the file a client is about to send and the clients it goes to
+    def startFileTransfer(self, s, jsonData, targets):
+        chunkSize = jsonData["chunk_size"]
+        if chunkSize <= 0 or chunkSize % 16 or chunkSize > CONSTANTS.MAX_FRAME_SIZE - 64:
+            raise ValueError("Invalid chunk size: " + str(chunkSize))
+        transfer = IRCTransfer(self.nextTransferId, s, jsonData["file_name"], jsonData["file_size"], jsonData["file_nonce"], jsonData["file_hash"], chunkSize, targets)
+        self.nextTransferId += 1
+        self.transfers[transfer.id] = transfer
+        self.connections[s].transfers.add(transfer.id)
+        # Chunks are only deflated if everyone involved can inflate them
+        transfer.compress = all(self.connections[client].compression is not None for client in [s] + targets)
+        # Receivers that never answer get the whole file
+        self.callLater(CONSTANTS.FILE_READY_TIMEOUT, self.fileReadyTimeout, transfer)
+        return transfer
+
+    # Adds the chunks one receiver is missing, and asks the sender for them once every receiver answered
+    def requestChunks(self, s, transfer, missing):
+        count = transfer.chunkCount()
+        missing = [[max(0, start), min(count, end)] for start, end in missing if start < end]
+        transfer.chunks = filetransfer.merge_ranges(transfer.chunks, missing)
+        transfer.waiting.discard(s)
+        if not transfer.waiting:
+            self.startSending(transfer)
+
+    # Asks the sender for every chunk a receiver that has not answered in time may need
+    def fileReadyTimeout(self, transfer):
+        if self.transfers.get(transfer.id) is transfer and not transfer.started:
+            transfer.chunks = [[0, transfer.chunkCount()]] if transfer.chunkCount() else []
+            transfer.waiting.clear()
+            self.startSending(transfer)
+
+    # Sends the sender the chunks the receivers asked for
+    def startSending(self, transfer):
+        if transfer.started:
+            return
+        transfer.started = True
+        transfer.expected = filetransfer.range_count(transfer.chunks)
+        self.sendMessage(transfer.sender, "<" + self.clients[self.serverSocket] + "> RECEIVING FILE: " + transfer.name, {"send_file": transfer.name, "file_nonce": transfer.nonce, "transfer": transfer.id, "chunks": transfer.chunks, "chunk_size": transfer.chunkSize, "compress": transfer.compress})
+        self.checkFileTransfer(transfer)
+
+    # Ends the file transfer once every requested chunk has been relayed
+    def checkFileTransfer(self, transfer):
+        if(transfer.started and transfer.relayed >= transfer.expected):
+            self.sendMessage(transfer.sender, "<" + self.clients[self.serverSocket] + "> File " + transfer.name + " sent succesfully!")
+            del self.transfers[transfer.id]
+            self.connections[transfer.sender].transfers.discard(transfer.id)
+
+    # Handles one complete message received from a client
+    def handleFrame(self, s, kind, data, plaintext=None):
+        connection = self.connections[s]
+        connection.lastActivity = time.monotonic()
+
+        # Performs file transfer among client via server
+        if kind == framing.DATA or kind == framing.DEFLATED_DATA:
+            transferId, seq = filetransfer.CHUNK.unpack_from(data)
+            transfer = self.transfers.get(transferId)
+            if transfer is None or transfer.sender != s or not transfer.started:
+                raise ValueError("File data received outside of a file transfer")
+            if kind == framing.DEFLATED_DATA and not transfer.compress:
+                raise ValueError("Deflated file data received for a transfer that does not compress")
+            # File data is encrypted end to end; relay one frame to every target client as is
+            frame = framing.frame(data, kind)
+            for client in transfer.targets:
+                self.sendFrame(client, frame, True)
+            transfer.relayed += 1
+            self.metrics.fileChunks += 1
+            self.metrics.fileBytes += len(data) * len(transfer.targets)
+            if transfer.compress:
+                wire = len(data) - filetransfer.CHUNK.size - filetransfer.DIGEST_SIZE
+                self.compressionStats.fileBytes += min(transfer.chunkSize, transfer.size - seq * transfer.chunkSize) if kind == framing.DEFLATED_DATA else wire
+                self.compressionStats.fileWireBytes += wire
+
+            # Keep the upload within its rate limit so it cannot starve other clients
+            delay = transfer.bucket.consume(len(data))
+            if delay:
+                self.throttle(connection, delay)
+
+            connection.lastCommand = connection.lastActivity
+            self.checkFileTransfer(transfer)
+            return
+
+        # Payloads are only dumped when debug records are written
+        if log.enabled(DEBUG):
+            log.debug("frame_received", client=self.clients[s], size=len(data), data=data)
+
+        # The first message on a connection is the plaintext hello choosing the cipher
+        if connection.session is None:
+            hello = cryptosession.read_hello(data)
+            if hello.get("crypto") not in CONSTANTS.CRYPTO_MODES:
+                raise ValueError("Unsupported crypto mode: " + str(hello.get("crypto")))
+            connection.session = cryptosession.CryptoSession(hello["crypto"])
+            connection.session.start(hello["nonce"])
+            # Clients that offer no codecs speak JSON, clients that offer no compression are sent messages as is
+            connection.codec = codec.choose(hello.get("codecs"))
+            method = compression.choose(hello.get("compression"))
+            if method is not None:
+                connection.compression = compression.CompressionStream(self.compressionStats)
+            self.sendFrame(s, framing.frame(cryptosession.make_hello(dict(connection.session.hello(), codec=connection.codec, compression=method))))
+            return
+
+        # Decrypt once, stream sessions cannot decrypt the same message twice
+        jsonData = codec.decode(connection.codec, self.decryptMessage(connection, data, plaintext))
+        if log.enabled(DEBUG):
+            log.debug("command_received", client=self.clients[s], data=jsonData)
+
+        command = jsonData["command"]
+        if command != "PO":
+            connection.lastCommand = connection.lastActivity
+        # Limits apply before any work is done for the command
+        if not self.allowCommand(connection, command):
+            return
+        label = self.metrics.command(command)
+        self.metrics.commands[label] += 1
+        if self.metrics.timing:
+            start = time.perf_counter()
+            self.handleCommand(s, command, jsonData)
+            self.metrics.commandSeconds[label].observe(time.perf_counter() - start)
+        else:
+            self.handleCommand(s, command, jsonData)
+
+    # Runs one command from a client
+    def handleCommand(self, s, command, jsonData):
+        # Associate client name to socket object
+        if command == "NN":
+            self.lock.acquire()
+            name = jsonData["name"]
+            if name in self.nicknames:
+                self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> Name already in use!")
+            else:
+                # Release the previous name, if the client had one
+                previous = None
+                if self.nicknames.get(self.clients[s]) == s:
+                    previous = self.clients[s]
+                    del self.nicknames[previous]
+                self.clients[s] = jsonData["name"]
+                self.nicknames[name] = s
+                self.connections[s].named = time.time()
+                self.clientNamed(s, previous)
+                self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> Connected to server under username: " + name)
+            self.lock.release()
+
+        # Client wants a list of all active rooms
+        elif command == "LR":
+            self.lock.acquire()
+            if self.rooms:
+                message = ""
+                for room in self.rooms:
+                    message += "\n\t" + room
+
+                self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> Available Rooms:" + message)
+            else:
+                self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> No avaiable rooms")
+            self.lock.release()
+
+        # Client wants to create a room
+        elif command == "CR":
+            self.lock.acquire()
+            if jsonData["roomname"] in self.rooms:
+                self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> Room name already taken! Please enter a different room name!")
+            else:
+                # Create new room with the given room name and add it to the rooms index
+                newRoom = self.createRoom(jsonData["roomname"])
+                # Add the client to the room list
+                newRoom.roomClients[s] = self.clients[s]
+                self.connections[s].rooms.add(newRoom.name)
+                self.roomJoined(newRoom, s)
+                # Send message to client
+                self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> Room created succesfully! You have been added to the room!")
+            self.lock.release()
+
+        # Client wants to join a room
+        elif command == "JR":
+            self.lock.acquire()
+            room = self.rooms.get(jsonData["roomname"])
+            # Add the client to a room if it exists
+            if room is not None:
+                # Check to make sure that user is not already in room:
+                if s not in room.roomClients:
+                    # Add user to the room if it exists
+                    room.roomClients[s] = self.clients[s]
+                    self.connections[s].rooms.add(room.name)
+                    self.roomJoined(room, s)
+
+                    # Notify client that they have joined the room succesfully
+                    self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> You have successfully joined the room!")
+
+                     # Notify other members in the room about new client joining
+                    self.broadcast(room.roomClients, "<" + self.clients[self.serverSocket] + "> " + self.clients[s] + " has joined the room " + room.name + "!", s)
+
+                    # Catch the client up on the latest messages
+                    if CONSTANTS.HISTORY_ON_JOIN and self.historyOf(room).nextSeq:
+                        self.sendHistory(s, room, None, CONSTANTS.HISTORY_ON_JOIN)
+                else:
+                    self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> You are already in the room!")
+
+            # Notify client that the room doesn't exist!
+            else:
+                self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> Unable to join room! The room may not exist. Try creating a room with the CREATEROOM [roomname] command")
+            self.lock.release()
+
+        # Client wants to leave a room
+        elif command == "LER":
+            self.lock.acquire()
+            room = self.rooms.get(jsonData["roomname"])
+            if room is not None:
+                # Attempt to remove client from the room
+                try:
+                    del room.roomClients[s]
+                    self.connections[s].rooms.discard(room.name)
+                    self.roomLeft(room, s)
+                    # Inform client that they have left the room successfully
+                    self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> You have successfully left the room!")
+
+                    # If there are no more clients in the room, delete the room
+                    if len(room.roomClients) == 0:
+                        self.removeRoom(room)
+                    else:
+                        # Notify other in room that the user has left the room
+                        self.broadcast(room.roomClients, "<" + self.clients[self.serverSocket] + "> " + self.clients[s] + " has left the room " + room.name + "!")
+                except KeyError: # Client is not in the room!
+                    self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> Unable to leave room!")
+            else:
+                self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> No room exists with name: " + jsonData["roomname"])
+
+            self.lock.release()
+
+        # Client wants a list of clients connected to the server
+        elif command == "LC":
+            self.lock.acquire()
+            if self.clients:
+                message = ""
+                for personSocket, person in self.clients.items():
+                    if personSocket != self.serverSocket:
+                        message += "\n\t" + person
+
+                self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> Connected Clients:" + message)
+            else:
+                # You are the only connected client on server
+                self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> You are all alone! Go invite more people to join!!")
+            self.lock.release()
+
+        # Client wants a list of clients in the room
+        elif command == "LRC":
+            self.lock.acquire()
+            room = jsonData["roomname"]
+            if self.rooms:
+                r = self.rooms.get(room)
+                if r is not None:
+                    message = ""
+                    # Get the list of clients in the room
+                    for personSocket, person in r.roomClients.items():
+                        if personSocket != self.serverSocket:
+                            message += "\n\t" + person
+                    self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> Connected Clients in " + room + ":" + message)
+                else:
+                    self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> Nobody in the room")
+            else:
+                self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> No rooms exist!")
+            self.lock.release()
+
+        # Client wants to send a message to a room
+        elif command == "MR":
+            self.lock.acquire()
+
+            room = jsonData["roomname"]
+            message = jsonData["message"]
+            r = self.rooms.get(room)
+
+            # Check to make sure that the room exists and the client is part of it
+            if r is not None and s in r.roomClients:
+                # The room's fan-out budget is spent before any message is encrypted. A fan-out larger than
+                # the burst waits for a full bucket and leaves it in debt, so big rooms pay for every member
+                wait = r.bucket.take(len(r.roomClients) - 1)
+                if wait:
+                    self.rateLimited(self.connections[s], "room", wait)
+                    self.lock.release()
+                    return
+                # Send messages to all others in the room and keep it in the room's history
+                record = {"time": time.time(), "room": r.name, "sender": self.clients[s], "target": None, "message": message}
+                self.broadcast(r.roomClients, "<" + self.clients[self.serverSocket] + "> " + self.clients[s] + " in " + r.name + " says: " + message, s, record=record)
+                self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> Message sent to room")
+            # Send client a message indicating that the room does not exist or they are not part of the indicated room
+            else:
+                self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> Unable to send message! The room does not exist or you are not part of the room!")
+            self.lock.release()
+
+        # Client wants to send a private message to another client
+        elif command == "PM":
+            self.lock.acquire()
+            target = jsonData["target"]
+            message = jsonData["message"]
+            personSocket = self.nicknames.get(target)
+            if self.clients:
+                if personSocket == s:
+                    self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> Cannot send message to yourself!")
+                elif personSocket is not None and personSocket != self.serverSocket:
+                    record = {"time": time.time(), "room": None, "sender": self.clients[s], "target": target, "message": message}
+                    self.sendMessage(personSocket, "<" + self.clients[self.serverSocket] + "> " + self.clients[s] + " sent a message to you: " + message, record=record)
+                    self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> Private message sent to " + target)
+            else:
+                # You are the only connected client on server
+                self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> Unable to send private message! Nobody else is online!")
+            self.lock.release()
+
+        # Client wants earlier messages of a room it is part of
+        elif command == "RH":
+            self.lock.acquire()
+            r = self.rooms.get(jsonData["roomname"])
+            if r is not None and s in r.roomClients:
+                try:
+                    limit = min(int(jsonData.get("count") or CONSTANTS.HISTORY_PAGE), CONSTANTS.HISTORY_PAGE)
+                    before = jsonData.get("before")
+                    before = None if before is None else int(before)
+                except (TypeError, ValueError, OverflowError):
+                    self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> Unable to read history! count and before take numbers")
+                else:
+                    self.sendHistory(s, r, before, max(1, limit))
+            else:
+                self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> Unable to read history! The room does not exist or you are not part of the room!")
+            self.lock.release()
+
+        # Client wants to search the messages it can see
+        elif command == "SR":
+            self.lock.acquire()
+            self.sendSearch(s, jsonData)
+            self.lock.release()
+
+        # Client wants to send a file to a room
+        elif command == "SFR":
+            self.lock.acquire()
+            target = jsonData["target"]
+            r = self.rooms.get(target)
+
+            # Check to make sure that the room exists and the client is part of it
+            if r is not None and s in r.roomClients:
+                # Send messages to all others in the room that are connected to this server
+                transfer = self.startFileTransfer(s, jsonData, [userSocket for userSocket in r.roomClients if userSocket != s and userSocket in self.connections])
+                self.broadcast(transfer.targets, "<" + self.clients[self.serverSocket] + "> " + self.clients[s] + " in room " + target + " IS SENDING FILE: " + transfer.name + " " + str(transfer.size), extra=transfer.info(self.clients[s]))
+                # The sender is told to start once the receivers said which chunks they need
+                if not transfer.waiting:
+                    self.startSending(transfer)
+            # Send client a message indicating that the room does not exist or they are not part of the indicated room
+            else:
+                self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> Unable to send file! The room does not exist or you are not part of the room!")
+
+            self.lock.release()
+
+        # Client wants to send a file to another client
+        elif command == "SFP":
+            self.lock.acquire()
+            target = jsonData["target"]
+            personSocket = self.nicknames.get(target)
+
+            if self.clients:
+                if personSocket == s:
+                    self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> Cannot send file to yourself!")
+                elif personSocket is not None and personSocket not in self.connections and personSocket != self.serverSocket:
+                    self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> Unable to send private file! " + target + " is connected to another server")
+                elif personSocket is not None and personSocket != self.serverSocket:
+                    transfer = self.startFileTransfer(s, jsonData, [personSocket])
+                    self.sendMessage(personSocket, "<" + self.clients[self.serverSocket] + "> " + self.clients[s] + " (in private mode) is SENDING FILE: " + transfer.name + " " + str(transfer.size), transfer.info(self.clients[s]))
+                else:
+                    self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> Unable to send private file! Nobody is online with name: " + target)
+            else:
+                # You are the only connected client on server
+                self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> Unable to send private file! Nobody else is online!")
+            self.lock.release()
+
+        # Client says which chunks of a file sent to it are still missing
+        elif command == "FR":
+            self.lock.acquire()
+            transfer = self.transfers.get(jsonData["transfer"])
+            if transfer is not None and s in transfer.waiting:
+                self.requestChunks(s, transfer, jsonData["missing"])
+            self.lock.release()
+
+        # Client wants the server's metrics
+        elif command == "ST":
+            if CONSTANTS.ADMINS and self.clients[s] not in CONSTANTS.ADMINS:
+                self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> Only administrators can read the server statistics!")
+            else:
+                # Keep the histograms from now on
+                self.metrics.timing = True
+                self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> Server statistics:\n\t" + self.metrics.summary(self.gauges()))
+
+        # Client answers a ping, handleFrame already noted that it is alive
+        elif command == "PO":
+            pass
+
+        # Client send an invalid command
+        else:
+            self.sendMessage(s, "<" + self.clients[self.serverSocket] + "> Received invalid command! Please enter a valid command!")
+
+    # Bytes queued for a client that it has not read yet
+    def outputQueued(self, connection):
+        return len(connection.outBuffer) + connection.pendingBytes
+
+    # Current values of the gauges, worked out only when the metrics are read
+    def gauges(self):
+        queued = [self.outputQueued(connection) for connection in self.connections.values()]
+        stats = self.compressionStats
+        return [("connections", len(self.connections)), ("rooms", len(self.rooms)), ("file_transfers", len(self.transfers)),
+                ("queued_bytes", sum(queued)), ("max_queued_bytes", max(queued) if queued else 0),
+                ("paused_connections", sum(1 for connection in self.connections.values() if connection.paused or connection.throttled)),
+                ("message_compression_ratio", "%.3f" % stats.ratio(stats.messageBytes, stats.messageWireBytes)),
+                ("file_compression_ratio", "%.3f" % stats.ratio(stats.fileBytes, stats.fileWireBytes)),
+                ("log_dropped", log.dropped)]
+
+    # Metrics in the Prometheus text format, for the HTTP endpoint
+    def renderMetrics(self):
+        return self.metrics.exposition(self.gauges())
+
+    # Logs the server statistics, every STATS_INTERVAL seconds
+    def reportStats(self, argument):
+        stats = self.compressionStats
+        log.info("statistics", connections=len(self.connections), rooms=len(self.rooms), transfers=len(self.transfers),
+                 message_bytes=stats.messageBytes, message_wire_bytes=stats.messageWireBytes, message_ratio="%.3f" % stats.ratio(stats.messageBytes, stats.messageWireBytes),
+                 file_bytes=stats.fileBytes, file_wire_bytes=stats.fileWireBytes, file_ratio="%.3f" % stats.ratio(stats.fileBytes, stats.fileWireBytes))
+        self.callLater(CONSTANTS.STATS_INTERVAL, self.reportStats, None)
+
+    # Disconnects the clients marked for closing while an event was handled
+    def disconnectClosing(self):
+        for s in list(self.closing):
+            self.lock.acquire()
+            log.info("client_disconnected", client=self.clients[s])
+            self.cleanup(s)
+            self.lock.release()
+            s.close()
 
     # The function that is executed once initialized is complete
     def run(self):
         # Create and bind socket to host and port
         self.serverSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.serverSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reusePort:
+            # The kernel spreads incoming connections over every process bound to the port
+            self.serverSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.serverSocket.bind((self.host, self.port))
-        FILE_TRANSFER_MODE = False
-        FILE_NAME = None
-        FILE_SIZE = None
-        FILE_CLIENT_LIST=[]
 
         # Check if server socket is in the clients list or not
         self.lock.acquire()
         if("SERVER" in self.clients):
-            print("Server is alredy active and running!")
+            log.error("server_running")
             sys.exit(1)
         else:
             # Add server socket to dictionary
             self.clients[self.serverSocket] = "SERVER"
+            self.nicknames["SERVER"] = self.serverSocket
         self.lock.release()
 
-        self.serverSocket.listen(1)
+        self.serverSocket.listen(socket.SOMAXCONN)
+        self.selector.register(self.serverSocket, selectors.EVENT_READ, self.acceptClient)
+        if self.metricsPort:
+            try:
+                self.metricsEndpoint = metrics.MetricsEndpoint(self.selector, CONSTANTS.METRICS_HOST, self.metricsPort, self.renderMetrics)
+            except socket.error as e:
+                log.error("metrics_unavailable", port=self.metricsPort, error=e)
+        if CONSTANTS.STATS_INTERVAL:
+            self.callLater(CONSTANTS.STATS_INTERVAL, self.reportStats, None)
         while True:
+            # Sleep no longer than until the next timer is due
+            timeout = self.timerWheel.timeout(time.monotonic())
             try:
-                read, write, error = select.select(list(self.clients.keys()), [], [])
+                events = self.selector.select(timeout)
             except socket.error as msg:
                 continue
 
-            for s in read:
-                # Server socket is readable so have it listen to incoming client connections
-                if s == self.serverSocket:
-                    try:
-                        clientSocket, clientAddr = self.serverSocket.accept()
-                    except socket.error:
-                        break
-                    # If client is already connected to the server, send an appropriate message
-                    if(clientSocket in self.clients):
-                        clientSocket.send(encode_n_encrypt("You are already connected to the server!"))
-                    else:
-                        # Add to list of all connected clients
-                        self.lock.acquire()
-                        self.clients[clientSocket] = clientSocket
-                        self.lock.release()
-                else:
-                    try:
-                        data = s.recv(1024)
-
-                        print("Data Received (Encrypted): " + str(data))
-                        if data:
-                            print("\nData Received (Decrypted): " + str(decrypt_n_decode(data)))
-
-                        if not data:
-                            # Handles the unexpected connection closed by client
-                            self.lock.acquire()
-                            # Remove client from all rooms and then from list of connected clients
-                            client_name = self.clients[s]
-                            self.cleanup(s)
-                            self.lock.release()
-                            s.close()
-                            print("Connection closed by client: " + client_name)
-
-                        # Performs file transfer among client via server
-                        elif(FILE_TRANSFER_MODE):
-                            data = decrypt_n_decode(data)
-                            total_received_data = 0
-
-                            # Transfers file data as it is recived to target client(s)
-                            while True:
-                                # Sending the received file data to target clients
-                                for client in FILE_CLIENT_LIST:
-                                    client.send(encode_n_encrypt(data))
-                                total_received_data += len(data)
-                                # Recieves file data fromt the sender client
-                                if(total_received_data < FILE_SIZE):
-                                    data = s.recv(1024)
-                                    data = decrypt_n_decode(data)
-                                else:
-                                    break
-
-                            s.send(encode_n_encrypt("<" + self.clients[self.serverSocket] + "> File " + FILE_NAME + " sent succesfully!"))
-
-                            # Resetting the file parameters
-                            FILE_TRANSFER_MODE = False
-                            FILE_NAME = None
-                            FILE_SIZE = None
-                            FILE_CLIENT_LIST = []
-
-                        else:
-                            data = decrypt_n_decode(data)
-                            jsonData = json.loads(str(data))
-                            command = jsonData["command"]
-
-                            # Associate client name to socket object
-                            if command == "NN":
-                                self.lock.acquire()
-                                name = jsonData["name"]
-                                if name in self.clients.values():
-                                    s.send(encode_n_encrypt("<" + self.clients[self.serverSocket] + "> Name already in use!"))
-                                else:
-                                    self.clients[s] = jsonData["name"]
-                                    s.send(encode_n_encrypt("<" + self.clients[self.serverSocket] + "> Connected to server under username: " + name))
-                                self.lock.release()
-
-                            # Client wants a list of all active rooms
-                            elif command == "LR":
-                                self.lock.acquire()
-                                if self.rooms:
-                                    message = ""
-                                    for room in self.rooms:
-                                        message += "\n\t" + room.name
-
-                                    s.send(encode_n_encrypt("<" + self.clients[self.serverSocket] + "> Available Rooms:" + message))
-                                else:
-                                    s.send(encode_n_encrypt("<" + self.clients[self.serverSocket] + "> No avaiable rooms"))
-                                self.lock.release()
-
-                            # Client wants to create a room
-                            elif command == "CR":
-                                allowCreate = True
-                                self.lock.acquire()
-                                for room in self.rooms:
-                                    if jsonData["roomname"] == room.name:
-                                        allowCreate = False
-                                        s.send(encode_n_encrypt("<" + self.clients[self.serverSocket] + "> Room name already taken! Please enter a different room name!"))
-                                        break
-
-                                if allowCreate == True:
-                                    # Create new room with the given room name
-                                    newRoom = IRCRoom(jsonData["roomname"])
-                                    # Add the client to the room list
-                                    newRoom.roomClients[s] = self.clients[s]
-                                    # Add room to list of rooms
-                                    self.rooms.append(newRoom)
-                                    # Send message to client
-                                    s.send(encode_n_encrypt("<" + self.clients[self.serverSocket] + "> Room created succesfully! You have been added to the room!"))
-                                self.lock.release()
-
-                            # Client wants to join a room
-                            elif command == "JR":
-                                roomExists = False
-                                self.lock.acquire()
-                                # Add the client to a room if it exists
-                                for room in self.rooms:
-                                    if jsonData["roomname"] == room.name:
-                                        # Check to make sure that user is not already in room:
-                                        if s not in room.roomClients:
-                                            # Add user to the room if it exists
-                                            room.roomClients[s] = self.clients[s]
-
-                                            # Notify client that they have joined the room succesfully
-                                            s.send(encode_n_encrypt("<" + self.clients[self.serverSocket] + "> You have successfully joined the room!"))
-
-                                             # Notify other members in the room about new client joining
-                                            for userSocket in room.roomClients:
-                                                if userSocket != s:
-                                                    userSocket.send(encode_n_encrypt("<" + self.clients[self.serverSocket] + "> " + self.clients[s] + " has joined the room " + room.name + "!"))
-                                        else:
-                                            s.send(encode_n_encrypt("<" + self.clients[self.serverSocket] + "> You are already in the room!"))
-                                        roomExists = True
-                                        break
-
-                                # Notify client that the room doesn't exist!
-                                if roomExists == False:
-                                    s.send(encode_n_encrypt("<" + self.clients[self.serverSocket] + "> Unable to join room! The room may not exist. Try creating a room with the CREATEROOM [roomname] command"))
-                                self.lock.release()
-
-                            # Client wants to leave a room
-                            elif command == "LER":
-                                self.lock.acquire()
-                                room_found = False
-                                # Find the room in the list of rooms
-                                for room in self.rooms:
-                                    if jsonData["roomname"] == room.name:
-                                        room_found = True
-                                        # Attempt to remove client from the room
-                                        try:
-                                            del room.roomClients[s]
-                                            # Inform client that they have left the room successfully
-                                            s.send(encode_n_encrypt("<" + self.clients[self.serverSocket] + "> You have successfully left the room!"))
-
-                                            # If there are no more clients in the room, delete the room
-                                            if len(room.roomClients) == 0:
-                                                self.rooms.remove(room)
-                                            else:
-                                                # Notify other in room that the user has left the room
-                                                for personSocket in room.roomClients:
-                                                    personSocket.send(encode_n_encrypt("<" + self.clients[self.serverSocket] + "> " + self.clients[s] + " has left the room " + room.name + "!"))
-
-                                            break
-                                        except KeyError: # Client is not in the room!
-                                            s.send(encode_n_encrypt("<" + self.clients[self.serverSocket] + "> Unable to leave room!"))
-                                            break
-                                if (not room_found):
-                                    s.send(encode_n_encrypt("<" + self.clients[self.serverSocket] + "> No room exists with name: " + jsonData["roomname"]))
-
-                                self.lock.release()
-
-                            # Client wants a list of clients connected to the server
-                            elif command == "LC":
-                                self.lock.acquire()
-                                if self.clients:
-                                    message = ""
-                                    for personSocket, person in self.clients.items():
-                                        if personSocket != self.serverSocket:
-                                            message += "\n\t" + person
-
-                                    s.send(encode_n_encrypt("<" + self.clients[self.serverSocket] + "> Connected Clients:" + message))
-                                else:
-                                    # You are the only connected client on server
-                                    s.send(encode_n_encrypt("<" + self.clients[self.serverSocket] + "> You are all alone! Go invite more people to join!!"))
-                                self.lock.release()
-
-                            # Client wants a list of clients in the room
-                            elif command == "LRC":
-                                self.lock.acquire()
-                                room = jsonData["roomname"]
-                                success = False
-                                if self.rooms:
-                                    message = ""
-                                    # Find the room the get list of clients
-                                    for r in self.rooms:
-                                        if room == r.name:
-                                            # Get the list of clients in the room
-                                            for personSocket, person in r.roomClients.items():
-                                                if personSocket != self.serverSocket:
-                                                    message += "\n\t" + person
-                                            s.send(encode_n_encrypt("<" + self.clients[self.serverSocket] + "> Connected Clients in " + room + ":" + message))
-                                            success = True
-                                            break
-                                    if success == False:
-                                        s.send(encode_n_encrypt("<" + self.clients[self.serverSocket] + "> Nobody in the room"))
-                                else:
-                                    s.send(encode_n_encrypt("<" + self.clients[self.serverSocket] + "> No rooms exist!"))
-                                self.lock.release()
-
-                            # Client wants to send a message to a room
-                            elif command == "MR":
-                                self.lock.acquire()
-
-                                room = jsonData["roomname"]
-                                message = jsonData["message"]
-                                success = False
-
-                                # Search through rooms list
-                                if self.rooms:
-                                    for r in self.rooms:
-                                        # Found room
-                                        if room == r.name:
-                                            # Check to make sure that the client is part of the room first
-                                            if s in r.roomClients:
-                                                # Send messages to all others in the room
-                                                for userSocket in r.roomClients.keys():
-                                                    if userSocket != s:
-                                                        userSocket.send(encode_n_encrypt("<" + self.clients[self.serverSocket] + "> " + self.clients[s] + " in " + r.name + " says: " + message))
-                                                success = True
-                                                break
-                                # Send client a message indicating that the room does not exist or they are not part of the indicated room
-                                if success == False:
-                                    s.send(encode_n_encrypt("<" + self.clients[self.serverSocket] + "> Unable to send message! The room does not exist or you are not part of the room!") )
-                                else:
-                                     s.send(encode_n_encrypt("<" + self.clients[self.serverSocket] + "> Message sent to room") )
-                                self.lock.release()
-
-                            # Client wants to send a private message to another client
-                            elif command == "PM":
-                                self.lock.acquire()
-                                target = jsonData["target"]
-                                message = jsonData["message"]
-                                if self.clients:
-                                    for personSocket, person in self.clients.items():
-                                        if personSocket != self.serverSocket and person == target and personSocket != s:
-                                            personSocket.send(encode_n_encrypt("<" + self.clients[self.serverSocket] + "> " + self.clients[s] + " sent a message to you: " + message))
-                                            s.send(encode_n_encrypt("<" + self.clients[self.serverSocket] + "> Private message sent to " + person))
-                                        if person == target and personSocket == s:
-                                            s.send(encode_n_encrypt("<" + self.clients[self.serverSocket] + "> Cannot send message to yourself!"))
-                                            break
-                                else:
-                                    # You are the only connected client on server
-                                    s.send(encode_n_encrypt("<" + self.clients[self.serverSocket] + "> Unable to send private message! Nobody else is online!"))
-                                self.lock.release()
-
-                            # Client wants to send a file to a room
-                            elif command == "SFR":
-                                self.lock.acquire()
-                                target = jsonData["target"]
-                                FILE_NAME = jsonData["file_name"]
-                                FILE_SIZE = jsonData["file_size"]
-                                FILE_TRANSFER_MODE = True
-                                FILE_CLIENT_LIST = []
-                                success = False
-
-                                if self.rooms:
-                                    for r in self.rooms:
-                                        # Found room
-                                        if target == r.name:
-                                            # Check to make sure that the client is part of the room first
-                                            if s in r.roomClients:
-                                                # Send messages to all others in the room
-                                                for userSocket in r.roomClients.keys():
-                                                    if userSocket != s:
-                                                        userSocket.send(encode_n_encrypt("<" + self.clients[self.serverSocket] + "> " + self.clients[s] + " in room " + target + " IS SENDING FILE: " + FILE_NAME + " " + str(FILE_SIZE)))
-                                                        FILE_CLIENT_LIST.append(userSocket)
-                                                success = True
-                                                break
-
-                                # Send client a message indicating that the room does not exist or they are not part of the indicated room
-                                if success == False:
-                                    s.send(encode_n_encrypt("<" + self.clients[self.serverSocket] + "> Unable to send file! The room does not exist or you are not part of the room!") )
-                                # Send client message to start the file transfer
-                                else:
-                                    s.send(encode_n_encrypt(("<" + self.clients[self.serverSocket] + "> RECEIVING FILE: " + FILE_NAME)))
-
-                                self.lock.release()
-
-                            # Client wants to send a file to another client
-                            elif command == "SFP":
-                                self.lock.acquire()
-                                target = jsonData["target"]
-                                FILE_NAME = jsonData["file_name"]
-                                FILE_SIZE = jsonData["file_size"]
-                                FILE_TRANSFER_MODE = True
-                                FILE_CLIENT_LIST = []
-                                success = False
-
-                                if self.clients:
-                                    for personSocket, person in self.clients.items():
-                                        if personSocket != self.serverSocket and person == target and personSocket != s:
-                                            FILE_CLIENT_LIST.append(personSocket)
-                                            s.send(encode_n_encrypt(("<" + self.clients[self.serverSocket] + "> RECEIVING FILE: " + FILE_NAME)))
-                                            personSocket.send(encode_n_encrypt("<" + self.clients[self.serverSocket] + "> " + self.clients[s] + " (in private mode) is SENDING FILE: " + FILE_NAME + " " + str(FILE_SIZE)))
-                                            success = True
-                                        if person == target and personSocket == s:
-                                            s.send(encode_n_encrypt("<" + self.clients[self.serverSocket] + "> Cannot send file to yourself!"))
-                                            success = True
-                                            break
-                                    if success == False:
-                                            s.send(encode_n_encrypt("<" + self.clients[self.serverSocket] + "> Unable to send private file! Nobody is online with name: " + target))
-                                else:
-                                    # You are the only connected client on server
-                                    s.send(encode_n_encrypt("<" + self.clients[self.serverSocket] + "> Unable to send private file! Nobody else is online!"))
-                                self.lock.release()
-
-                            # Client send an invalid command
-                            else:
-                                s.send(encode_n_encrypt("<" + self.clients[self.serverSocket] + "> Received invalid command! Please enter a valid command!"))
-
-                    except Exception as e:
-                        # Disconnect client from server and remove from connected clients list
-                        print("ERROR: " + str(e))
-                        s.close()
-
-                        self.lock.acquire()
-                        self.cleanup(s)
-                        self.lock.release()
-                        continue
+            # Each registered socket carries the callback that handles its readiness
+            for key, mask in events:
+                callback = key.data
+                callback(key.fileobj, mask)
+            if self.received:
+                self.handleReceived()
+
+            # Run the timers that are due, skipping those cancelled by an earlier one
+            for timer in self.timerWheel.advance(time.monotonic()):
+                if timer.callback is not None:
+                    timer.callback(timer.argument)
+
+            # Write out what the cycle sent, then drop clients that could not keep up with their
+            # outbound queue or whose connection failed; their departure may send more
+            while self.dirty or self.closing:
+                self.flushPending()
+                self.disconnectClosing()
 
         self.serverSocket.close() #Technically, unreachable code.
 #--------------------------------------------------------------------#
@@ -472,6 +1301,8 @@ class IRCServer(threading.Thread):
 def main():
     server = IRCServer(CONSTANTS.HOST, CONSTANTS.PORT)
     server.start()
+    # Worker pools only take work while the main thread is alive, so wait for the server here
+    server.join()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,142 @@
+#####################################################################
+#                    Haritha Munagala, Susham Yerabolu              #
+#                    CS 594 Internetworking Protocols               #
+#                             Spring 2018                           #
+#                            Timer Wheel                            #
+#####################################################################
+
+#--------------------------------------------------------------------#
+# Python Imports
+import math
+#--------------------------------------------------------------------#
+
+# Slots of the innermost wheel and of each outer wheel. The innermost wheel
+# covers 256 ticks, each outer wheel 64 times the one inside it
+ROOT_BITS = 8
+LEVEL_BITS = 6
+LEVELS = 4
+
+# Fraction of a tick added before rounding a time down to its tick. Without it, now / tick
+# can come out just below the tick timeout() waited for, and the loop would spin on select(0)
+ROUNDING = 1e-6
+
+#--------------------------------------------------------------------#
+# Timer
+# A callback scheduled on a TimerWheel. Cancelling only takes it out of
+# its slot, and a timer cancelled after it became due is skipped.
+#--------------------------------------------------------------------#
+class Timer():
+    __slots__ = ('wheel', 'expires', 'callback', 'argument', 'slot')
+
+    def __init__(self, wheel, expires, callback, argument):
+        self.wheel = wheel
+        self.expires = expires # Tick the timer fires at
+        self.callback = callback
+        self.argument = argument
+        self.slot = None # Set of the slot holding the timer
+
+    def cancel(self):
+        self.callback = None
+        if self.slot is not None:
+            self.slot.discard(self)
+            self.slot = None
+            self.wheel.count -= 1
+#--------------------------------------------------------------------#
+
+#--------------------------------------------------------------------#
+# Timer Wheel
+# Hierarchical timing wheel, like the one in the Linux kernel. Time is
+# cut into ticks of `tick` seconds. A timer due within 256 ticks sits in
+# the slot of its tick in the innermost wheel; later timers sit in the
+# slot of an outer wheel covering a range of ticks, and every time the
+# innermost wheel comes round, the next slot of the wheel outside it is
+# emptied into the wheels inside. Scheduling, cancelling and expiring a
+# timer are O(1) however many timers there are; timers fire on the
+# first tick at or after their deadline.
+#--------------------------------------------------------------------#
+class TimerWheel():
+    def __init__(self, tick, now):
+        self.tick = tick # Seconds per tick
+        self.current = self.tickAt(now) # Next tick to process
+        self.wheels = [[set() for i in range(1 << ROOT_BITS)]] + [[set() for i in range(1 << LEVEL_BITS)] for level in range(LEVELS - 1)]
+        self.count = 0 # Timers waiting
+
+    # Tick that time `now` falls in
+    def tickAt(self, now):
+        return int(now / self.tick + ROUNDING)
+
+    # Runs callback(argument) once time `deadline` is reached, returns the Timer
+    def schedule(self, deadline, callback, argument):
+        timer = Timer(self, max(int(math.ceil(deadline / self.tick)), self.current), callback, argument)
+        self.place(timer)
+        self.count += 1
+        return timer
+
+    # Puts a timer in the slot covering its tick
+    def place(self, timer):
+        delta = timer.expires - self.current
+        if delta < 1 << ROOT_BITS:
+            slot = self.wheels[0][timer.expires & ((1 << ROOT_BITS) - 1)]
+        else:
+            for level in range(1, LEVELS):
+                shift = ROOT_BITS + level * LEVEL_BITS
+                if delta < 1 << shift or level == LEVELS - 1:
+                    break
+            # Timers beyond the outermost wheel wait in its last slot and are placed again from there
+            expires = min(timer.expires, self.current + (1 << shift) - 1)
+            slot = self.wheels[level][(expires >> (shift - LEVEL_BITS)) & ((1 << LEVEL_BITS) - 1)]
+        slot.add(timer)
+        timer.slot = slot
+
+    # Empties the slot of an outer wheel into the wheels inside it
+    def cascade(self, level):
+        shift = ROOT_BITS + (level - 1) * LEVEL_BITS
+        index = (self.current >> shift) & ((1 << LEVEL_BITS) - 1)
+        slot = self.wheels[level][index]
+        timers = list(slot)
+        slot.clear()
+        for timer in timers:
+            self.place(timer)
+        return index
+
+    # Processes every tick up to time `now` and returns the timers that became due
+    def advance(self, now):
+        target = self.tickAt(now)
+        if not self.count:
+            self.current = max(self.current, target + 1)
+            return []
+        due = []
+        while self.current <= target:
+            index = self.current & ((1 << ROOT_BITS) - 1)
+            if index == 0:
+                # The innermost wheel came round, bring in the timers of the next range of ticks
+                for level in range(1, LEVELS):
+                    if self.cascade(level):
+                        break
+            slot = self.wheels[0][index]
+            if slot:
+                for timer in slot:
+                    timer.slot = None
+                due.extend(slot)
+                self.count -= len(slot)
+                slot.clear()
+            self.current += 1
+        return due
+
+    # Seconds from `now` until the next tick that has to be processed, None without timers
+    def timeout(self, now):
+        if not self.count:
+            return None
+        index = self.current & ((1 << ROOT_BITS) - 1)
+        base = self.current - index
+        if index == 0:
+            # The outer wheels cascade on this tick, the innermost one is not filled yet
+            return max(0, self.current * self.tick - now)
+        for i in range(index, 1 << ROOT_BITS):
+            if self.wheels[0][i]:
+                break
+        else:
+            # Nothing more in the innermost wheel before it comes round and cascades
+            i = 1 << ROOT_BITS
+        return max(0, (base + i) * self.tick - now)
+#--------------------------------------------------------------------#